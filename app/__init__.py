@@ -2,20 +2,64 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
+db = SQLAlchemy()
 
-# Generate database tables
-from app import models
 
-db.create_all()
+def create_app(config=Config):
+    """Create the Flask app. Creating the app doesn't touch the database, and the
+    database tables aren't created here, only by scripts/create_tables.py."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    # Engines with a connection pool use a pool that's monitored, see /api/database_pool
+    from app.modules.pool_monitor import MonitoredQueuePool
 
-# These imports import from this module to get database
-# access, so they're kept at the bottom of the module to
-# prevent circular imports.
-from app.routes.api import api
-from app.routes.website import website
+    engine_options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    if "pool_size" in engine_options:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": MonitoredQueuePool, **engine_options}
+    db.init_app(app)
+    # Let code that runs outside of requests, eg. background threads and
+    # scripts, use the database without pushing an app context
+    db.app = app
 
-app.register_blueprint(api, url_prefix="/api")
-app.register_blueprint(website, url_prefix="/")
+    # These imports import from this module to get database access, so they're
+    # kept inside this function to prevent circular imports. Importing the
+    # inventories module registers the events that keep inventory totals up to date.
+    from app import models
+    from app.modules import inventories
+    from app.routes.api import api
+    from app.routes.website import website
+
+    app.register_blueprint(api, url_prefix="/api")
+    app.register_blueprint(website, url_prefix="/")
+    return app
+
+
+def preload_app(app):
+    """Load static game data, and the filter of known email addresses, into the
+    app before worker processes are forked from it (eg. with gunicorn --preload),
+    so that it's loaded once and shared between the workers. The connections used
+    to load it are closed, so that no worker inherits a connection that another
+    process is also using. Also clears the request metrics left by the workers of
+    any previous server."""
+    from app.modules.resource_catalogue import reload_resource_catalogue
+    from app.routes.api import known_emails, request_metrics
+
+    request_metrics.clear()
+    with app.app_context():
+        reload_resource_catalogue()
+        known_emails.rebuild()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def dispose_engine(app):
+    """Discard the database connections that a forked worker process inherited
+    from its parent. The worker opens its own connections when it needs them."""
+    from app.modules.pool_monitor import pool_monitor
+
+    with app.app_context():
+        db.engine.dispose()
+    pool_monitor.reset()
+
+
+app = create_app()
@@ -18,6 +18,11 @@ class ServerError(BaseError):
     message = "Generic internal server error."
 
 
+class ServiceUnavailableError(ServerError):
+    status_code = 503
+    message = "The server is too busy to complete the request, try again later."
+
+
 class UserError(BaseError):
     """Base error for when the user uses the API incorrectly."""
 
@@ -56,6 +61,10 @@ class MalformedHeaderError(BadRequestError):
     message = "The value of a header is malformed."
 
 
+class MalformedParameterError(BadRequestError):
+    message = "The value of a query string parameter is malformed."
+
+
 # ----------------------------------------------------------------
 # Other user errors
 
@@ -65,6 +74,11 @@ class ResourceAlreadyExistsError(UserError):
     message = "The resource being created already exists."
 
 
+class InsufficientFundsError(UserError):
+    status_code = 409
+    message = "A wallet doesn't hold enough money to complete the transaction."
+
+
 class ResourceNotFoundError(UserError):
     status_code = 404
     message = "The specified resource was not found."
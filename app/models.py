@@ -1,11 +1,12 @@
 import mmh3
-import bcrypt
-import string
-import secrets
+import base64
 from datetime import datetime, timezone
 from sqlalchemy.dialects.mysql import INTEGER, BINARY, DECIMAL, FLOAT
+from sqlalchemy import literal_column
+from sqlalchemy.orm import validates
 from app import db
-from app.modules.profile_image import ProfileImage
+from app.modules import access_tokens, passwords, resource_catalogue
+from app.modules.profile_image.profile_image import image_data_length
 
 # Alias database types so that this module can be used by plain SQLAlchemy as well as Flask-SQLAlchemy
 Column = db.Column
@@ -22,6 +23,9 @@ relationship = db.relationship
 UnsignedInt = INTEGER(unsigned=True)
 UnsignedFloat = FLOAT(unsigned=True)
 
+# The money in the wallet of every new entity
+starting_wallet_value = 100
+
 # Alias decimal types to make the argument format more convenient
 def Decimal(integer_places, decimal_places, **kwargs):
     return DECIMAL(precision=(integer_places + decimal_places), scale=decimal_places, **kwargs)
@@ -32,6 +36,24 @@ def UnsignedDecimal(integer_places, decimal_places, **kwargs):
     return Decimal(integer_places, decimal_places, **kwargs)
 
 
+def VersionColumn():
+    """A counter that's incremented by every UPDATE of the row, including bulk
+    updates, so that cached representations of the row can be checked without
+    loading it. The column must be named 'version'."""
+    return Column(UnsignedInt, nullable=False, default=0, onupdate=literal_column("version") + 1)
+
+
+def normalise_email_address(email_address):
+    """Email addresses are compared without surrounding whitespace, and without case."""
+    return email_address.strip().lower()
+
+
+def hash_email_address(email_address):
+    """Return the 128-bit hash that an email address is looked up by, as 16 bytes."""
+    email_hash = mmh3.hash128(normalise_email_address(email_address))
+    return email_hash.to_bytes(16, byteorder="big")
+
+
 class Account(db.Model):
     """An account is used to sign in to Doctrine, and contains all user information
     and credentials."""
@@ -44,22 +66,24 @@ class Account(db.Model):
     password_hash = Column(BINARY(60), nullable=False)
     is_developer = Column(Boolean, nullable=False, default=False)
     creation_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    profiles = relationship("Profile", back_populates="account", order_by="Profile.id")
+    version = VersionColumn()
 
     def __init__(self, email_address, password):
         # Generate password hash
-        password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        password_hash = passwords.hash_password(password)
         super().__init__(email_address=email_address, password_hash=password_hash)
 
-    def _asdict(self):
+    def _asdict(self, embed_profiles=True):
         account_info = {
             "id": self.id,
             "email_address": str(self.email_address),
             "creation_time": self.creation_time.replace(tzinfo=timezone.utc).isoformat(),
             "is_developer": self.is_developer,
-            "profiles": [
-                profile._asdict(embed_account=False) for profile in Profile.query.filter_by(account=self).all()
-            ],
         }
+        # Optional, to prevent circular references
+        if embed_profiles:
+            account_info["profiles"] = [profile._asdict(embed_account=False) for profile in self.profiles]
         return account_info
 
     def __repr__(self):
@@ -71,13 +95,8 @@ class AccessToken(db.Model):
 
     __tablename__ = "access_token"
 
-    def generate_access_token(self):
-        url_safe_characters = string.ascii_letters + "_-.~"
-        while True:
-            token = "".join([secrets.choice(url_safe_characters) for _ in range(64)])
-            # Enforce token uniqueness
-            if db.session.query(AccessToken).filter_by(token=token).count() == 0:
-                return token
+    def generate_access_token():
+        return access_tokens.generate_token(access_tokens.get_signing_key())
 
     id = Column(UnsignedInt, primary_key=True)
     account_id = Column(UnsignedInt, ForeignKey("account.id"), nullable=False)
@@ -85,9 +104,21 @@ class AccessToken(db.Model):
     token = Column(String(64), nullable=False, unique=True, default=generate_access_token)
     creation_time = Column(DateTime, nullable=False, default=datetime.utcnow)
     duration = Column(Interval, nullable=False)
+    # Stored as well as the duration, so that expired tokens can be found with an index range scan
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __init__(self, account, duration):
+        creation_time = datetime.utcnow()
+        super().__init__(
+            account=account, duration=duration, creation_time=creation_time, expires_at=creation_time + duration
+        )
+
+    @property
+    def expiry_time(self):
+        return self.expires_at
 
     def is_expired(self):
-        return datetime.utcnow() > self.creation_time + self.duration
+        return datetime.utcnow() > self.expiry_time
 
     def __repr__(self):
         return f"<AuthenticationToken #{self.id}>"
@@ -104,12 +135,12 @@ class EmailAddress(db.Model):
     id = Column(UnsignedInt, primary_key=True)
     hash = Column(BINARY(16), nullable=False, unique=True)
     email_address = Column(String(255), nullable=False)
+    version = VersionColumn()
 
     def __init__(self, email_address):
         # Generate hash from the email address automatically
-        email_hash = mmh3.hash128(email_address)
-        email_hash = email_hash.to_bytes(16, byteorder="big")
-        super().__init__(hash=email_hash, email_address=email_address)
+        email_address = normalise_email_address(email_address)
+        super().__init__(hash=hash_email_address(email_address), email_address=email_address)
 
     def __repr__(self):
         return f"<EmailAddress '{self.email_address}'>"
@@ -129,24 +160,43 @@ class Profile(db.Model):
     name = Column(String(32), unique=True, nullable=False)
     picture = Column(BINARY(128), nullable=False)
     account_id = Column(UnsignedInt, ForeignKey("account.id"), nullable=False)
-    account = relationship("Account")
+    account = relationship("Account", back_populates="profiles")
     entity_id = Column(UnsignedInt, ForeignKey("entity.id"), nullable=False, unique=True)
     entity = relationship("Entity")
     creation_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    version = VersionColumn()
+
+    @validates("picture")
+    def validate_picture(self, key, picture):
+        """Ensure that only well-formed image data is stored, so that pictures can
+        be serialised without being decoded first. Accepts bytes or a ProfileImage."""
+        picture = bytes(picture)
+        if len(picture) != image_data_length:
+            raise ValueError(f"Profile pictures must be exactly {image_data_length} bytes long.")
+        return picture
+
+    @property
+    def picture_string(self):
+        """The picture as a Base64-encoded string. The encoded string is kept until
+        the picture changes."""
+        picture = self.picture
+        cached_picture = self.__dict__.get("_cached_picture")
+        if cached_picture is None or cached_picture[0] is not picture:
+            cached_picture = (picture, base64.b64encode(picture).decode("utf-8"))
+            self._cached_picture = cached_picture
+        return cached_picture[1]
 
     def _asdict(self, embed_account=True):
         profile_info = {
             "id": self.id,
             "name": self.name,
-            "picture": ProfileImage.from_bytes(self.picture).to_base64_string(),
+            "picture": self.picture_string,
             "entity": self.entity._asdict(),
             "creation_time": self.creation_time.replace(tzinfo=timezone.utc).isoformat(),
         }
         # Optional, to prevent circular references
         if embed_account:
-            profile_info["account"] = self.account._asdict()
-            # Remove redundant profile information
-            del profile_info["account"]["profiles"]
+            profile_info["account"] = self.account._asdict(embed_profiles=False)
         return profile_info
 
     def __repr__(self):
@@ -178,11 +228,9 @@ class Entity(db.Model):
     wallet = relationship("Wallet")
 
     def __init__(self):
-        # Create a wallet for the entity
-        wallet = Wallet(value=100)
-        db.session.add(wallet)
-        db.session.commit()
-        super().__init__(wallet=wallet)
+        # Create a wallet for the entity. The wallet is saved along with the entity,
+        # in the same transaction.
+        super().__init__(wallet=Wallet(value=starting_wallet_value))
 
     def _asdict(self):
         entity_info = {
@@ -200,6 +248,22 @@ class Inventory(db.Model):
     id = Column(UnsignedInt, primary_key=True)
     quantity_limit = Column(UnsignedInt)
     volume_limit = Column(UnsignedFloat)
+    # Totals of the resources held in the inventory. These are kept up to date by
+    # app.modules.inventories as resources are added, removed and moved, so that
+    # checking how full an inventory is doesn't need to touch every resource.
+    item_count = Column(UnsignedInt, nullable=False, default=0)
+    total_mass = Column(UnsignedDecimal(13, 3), nullable=False, default=0)
+    total_volume = Column(UnsignedDecimal(13, 3), nullable=False, default=0)
+
+    def can_accept(self, resource_type_id, count=1):
+        """Test whether there's room in the inventory for more resources of a type."""
+        if self.quantity_limit is not None and self.item_count + count > self.quantity_limit:
+            return False
+        if self.volume_limit is not None:
+            volume = resource_catalogue.get_resource_type_catalogue(resource_type_id).volume(resource_type_id)
+            if self.total_volume + count * volume > self.volume_limit:
+                return False
+        return True
 
     def __repr__(self):
         return f"<Inventory #{self.id}>"
@@ -235,7 +299,10 @@ class Resource(db.Model):
     resource_type = relationship("ResourceType")
 
     def __repr__(self):
-        return f"<Resource #{self.id} {self.resource_type.name}>"
+        if self.resource_type_id is None:
+            return f"<Resource #{self.id}>"
+        catalogue = resource_catalogue.get_resource_type_catalogue(self.resource_type_id)
+        return f"<Resource #{self.id} {catalogue.name(self.resource_type_id)}>"
 
 
 class ResourceType(db.Model):
@@ -285,6 +352,7 @@ class WorldEntity(db.Model):
     """An asset as a 3D object physically in the game world."""
 
     __tablename__ = "world_entity"
+    __table_args__ = (db.Index("ix_world_entity_location", "location_dome_id", "location_x", "location_y"),)
 
     id = Column(UnsignedInt, primary_key=True)
     location_dome_id = Column(UnsignedInt, ForeignKey("dome.id"), nullable=False)
@@ -304,6 +372,7 @@ class Wallet(db.Model):
 
     id = Column(UnsignedInt, primary_key=True)
     value = Column(UnsignedDecimal(12, 2), nullable=False)
+    version = VersionColumn()
 
     def _asdict(self):
         wallet_info = {
@@ -316,7 +385,7 @@ class Wallet(db.Model):
         return f"<Wallet #{self.id}>"
 
 
-class TransactionEvent:
+class TransactionEvent(db.Model):
     """A transaction of assets and/or money between two entities. Can tie
     together multiple financial and asset exchanges."""
 
@@ -325,11 +394,18 @@ class TransactionEvent:
     id = Column(UnsignedInt, primary_key=True)
     transaction_time = Column(DateTime, nullable=False, default=datetime.utcnow)
 
+    def _asdict(self):
+        transaction_event_info = {
+            "id": self.id,
+            "transaction_time": self.transaction_time.replace(tzinfo=timezone.utc).isoformat(),
+        }
+        return transaction_event_info
+
     def __repr__(self):
         return f"<TransactionEvent #{self.id}>"
 
 
-class FinancialTransaction:
+class FinancialTransaction(db.Model):
     """Financial exchange component of a transaction."""
 
     __tablename__ = "financial_transaction"
@@ -347,7 +423,7 @@ class FinancialTransaction:
         return f"<FinancialTransaction #{self.id}>"
 
 
-class AssetTransaction:
+class AssetTransaction(db.Model):
     """Asset exchange component of a transaction."""
 
     __tablename__ = "asset_transaction"
@@ -366,7 +442,7 @@ class AssetTransaction:
         return f"<AssetTransaction #{self.id}>"
 
 
-class AccountSignInEvent:
+class AccountSignInEvent(db.Model):
     """Logs the time an account was signed in to."""
 
     __tablename__ = "account_sign_in_event"
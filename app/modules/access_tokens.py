@@ -0,0 +1,47 @@
+import base64
+import hashlib
+import hmac
+import secrets
+from flask import current_app
+
+# Every token is 64 URL-safe characters, to fit the access_token.token column.
+# Plain tokens are 48 random bytes (384 bits). Signed tokens are 32 random bytes
+# (256 bits) followed by a '.' and a 15 byte HMAC of the random part, so that a
+# token that wasn't issued by the server can be rejected without looking it up.
+# Either way, the chance of two tokens ever colliding is negligible, so
+# uniqueness is left to the unique index on the column.
+token_length = 64
+signature_length = 15
+
+
+def encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def sign(token_id, signing_key):
+    signature = hmac.new(signing_key, token_id.encode("utf-8"), hashlib.sha256).digest()
+    return encode(signature[:signature_length])
+
+
+def get_signing_key():
+    """Return the key that access tokens are signed with, or None if they aren't."""
+    signing_key = current_app.config["ACCESS_TOKEN_SIGNING_KEY"]
+    return signing_key.encode("utf-8") if signing_key else None
+
+
+def generate_token(signing_key=None):
+    """Return a new random access token string, signed if a key is given."""
+    if signing_key is None:
+        return encode(secrets.token_bytes(48))
+    token_id = encode(secrets.token_bytes(32))
+    return f"{token_id}.{sign(token_id, signing_key)}"
+
+
+def has_valid_signature(token, signing_key):
+    """Test whether a token was signed with the given key. Tokens come from
+    clients, so may contain any characters."""
+    if len(token) != token_length:
+        return False
+    token_id, _, signature = token.partition(".")
+    # Compared as bytes, as compare_digest only accepts ASCII strings
+    return hmac.compare_digest(sign(token_id, signing_key).encode("ascii"), signature.encode("utf-8"))
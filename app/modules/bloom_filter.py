@@ -0,0 +1,151 @@
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """A set of 128-bit hashes (as 16 bytes), that can say for certain that a hash
+    was never added, or that it probably was. The chance of a false 'probably' is
+    about error_rate while no more than capacity hashes have been added. The
+    hashes must already be uniformly distributed, eg. the output of mmh3.hash128."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.item_count = 0
+
+    def _positions(self, item_hash):
+        # Derive every bit position from the two halves of the hash (double hashing)
+        h1 = int.from_bytes(item_hash[:8], "big")
+        h2 = int.from_bytes(item_hash[8:], "big") | 1
+        return ((h1 + i * h2) % self.bit_count for i in range(self.hash_count))
+
+    def add(self, item_hash):
+        for position in self._positions(item_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.item_count += 1
+
+    def __contains__(self, item_hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item_hash))
+
+
+class KnownEmailFilter:
+    """A Bloom filter of the hashes of every email address in the database, so
+    that sign-ins for email addresses that don't exist can be turned away without
+    a database lookup.
+
+    Each worker has its own filter. It's built from every row, and then kept up
+    to date from the sign_ups log, which the hash of every email address that's
+    added or changed is appended to once it's committed, so rows committed out of
+    ID order can't be missed. A miss is only trusted once the filter has caught up
+    with the log. If it can't, eg. because the log was started afresh, or once the
+    filter is older than max_age seconds, a miss is answered with 'maybe', so that
+    the caller looks the address up in the database. The filter is then rebuilt
+    in a background thread (as it is once it's fuller than its capacity), at most
+    once every min_rebuild_interval seconds."""
+
+    def __init__(self, load_hashes, sign_ups, error_rate=0.001, min_rebuild_interval=10, max_age=3600):
+        """Takes a function that returns the hash of every email address, and a
+        ChangeLog of the hex hashes of email addresses added since."""
+        self.load_hashes = load_hashes
+        self.sign_ups = sign_ups
+        self.error_rate = error_rate
+        self.min_rebuild_interval = min_rebuild_interval
+        self.max_age = max_age
+        self._filter = None
+        self._position = None
+        self._build_time = None
+        self._last_rebuild_start_time = None
+        self._rebuild_thread = None
+        self._lock = threading.Lock()
+        # Statistics
+        self.rejected = 0
+        self.passed = 0
+        self.unchecked = 0
+        self.rebuilds = 0
+
+    def rebuild(self):
+        """Build the filter from scratch, from every email address in the database."""
+        # The position is taken first, so that addresses committed while the rows
+        # are being loaded are read from the log afterwards
+        position = self.sign_ups.position()
+        build_time = time.monotonic()
+        hashes = self.load_hashes()
+        # Room is left for the addresses added before the next rebuild
+        bloom_filter = BloomFilter(max(1000, 2 * len(hashes)), self.error_rate)
+        for email_hash in hashes:
+            bloom_filter.add(bytes(email_hash))
+        with self._lock:
+            self._filter = bloom_filter
+            self._position = position
+            self._build_time = build_time
+            self.rebuilds += 1
+
+    def _start_rebuild(self):
+        # Called with the lock held. Only one rebuild runs at a time.
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        now = time.monotonic()
+        last_start_time = self._last_rebuild_start_time
+        if last_start_time is not None and now - last_start_time < self.min_rebuild_interval:
+            return
+        self._last_rebuild_start_time = now
+        self._rebuild_thread = threading.Thread(target=self._run_rebuild, name="known email filter", daemon=True)
+        self._rebuild_thread.start()
+
+    def _run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild the known email filter")
+
+    def _catch_up(self):
+        # Called with the lock held. Adds the hashes appended to the log since the
+        # filter's position, and returns whether the filter is now up to date.
+        if self._filter is None or self._position is None:
+            return False
+        position, added_hashes = self.sign_ups.read(self._position)
+        if added_hashes is None:
+            self._position = None
+            return False
+        for email_hash in added_hashes:
+            self._filter.add(bytes.fromhex(email_hash))
+        self._position = position
+        return True
+
+    def might_exist(self, email_hash):
+        """Test whether an email address may exist. False means it certainly doesn't."""
+        email_hash = bytes(email_hash)
+        with self._lock:
+            if self._filter is not None and email_hash in self._filter:
+                self.passed += 1
+                return True
+            if not self._catch_up() or time.monotonic() - self._build_time >= self.max_age:
+                self._start_rebuild()
+                self.unchecked += 1
+                return True
+            if self._filter.item_count > self._filter.capacity:
+                # Misses are still certain, but more unknown addresses pass
+                self._start_rebuild()
+            # Hashes read from the log while catching up can include this one
+            if email_hash in self._filter:
+                self.passed += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def stats(self):
+        return {
+            "capacity": self._filter.capacity if self._filter else 0,
+            "items": self._filter.item_count if self._filter else 0,
+            "rejected": self.rejected,
+            "passed": self.passed,
+            "unchecked": self.unchecked,
+            "rebuilds": self.rebuilds,
+        }
@@ -0,0 +1,55 @@
+import logging
+import threading
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Whether each engine's database gives the rows of a multi-row INSERT consecutive IDs
+_has_consecutive_ids = {}
+_lock = threading.Lock()
+
+
+def has_consecutive_ids(connection):
+    """Test whether the rows of every multi-row INSERT get consecutive auto-increment
+    IDs. SQLite only ever runs one write at a time, so they always do. MySQL only
+    guarantees it with an innodb_autoinc_lock_mode of 0 or 1 ('traditional' or
+    'consecutive', the default before MySQL 8.0), and an auto_increment_increment
+    of 1. Checked once per engine."""
+    engine = connection.engine
+    with _lock:
+        if engine in _has_consecutive_ids:
+            return _has_consecutive_ids[engine]
+    if connection.dialect.name == "sqlite":
+        result = True
+    elif connection.dialect.name == "mysql":
+        settings = connection.execute("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment")
+        lock_mode, increment = settings.first()
+        result = lock_mode in (0, 1) and increment == 1
+        if not result:
+            logger.warning(
+                "Batches of rows are inserted one at a time, as innodb_autoinc_lock_mode is %d and "
+                "auto_increment_increment is %d, so multi-row INSERTs may not get consecutive IDs",
+                lock_mode,
+                increment,
+            )
+    else:
+        result = False
+    with _lock:
+        _has_consecutive_ids[engine] = result
+    return result
+
+
+def insert_rows(table, rows):
+    """Insert rows into a table with an auto-increment primary key, in the current
+    session's transaction, and return their IDs in the same order. The rows are
+    inserted with a single statement if the database gives them consecutive IDs,
+    and one at a time otherwise."""
+    connection = db.session.connection()
+    if not has_consecutive_ids(connection):
+        return [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+    result = connection.execute(table.insert().values(rows))
+    # MySQL reports the ID of the first row of a multi-row INSERT, and SQLite the last
+    first_id = result.lastrowid
+    if connection.dialect.name == "sqlite":
+        first_id -= len(rows) - 1
+    return list(range(first_id, first_id + len(rows)))
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache. The size of the cache is limited
+    either by the number of items or, if a size function is given, by the total
+    size of the cached values (eg. size_function=len for bytes)."""
+
+    def __init__(self, max_size, size_function=None):
+        self.max_size = max_size
+        self.size_function = size_function or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached for a key, or the default if there isn't one."""
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Cache a value, evicting the least recently used values to make room."""
+        value_size = self.size_function(value)
+        if value_size > self.max_size:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self.size_function(self._items.pop(key))
+            self._items[key] = value
+            self.size += value_size
+            while self.size > self.max_size:
+                _, evicted_value = self._items.popitem(last=False)
+                self.size -= self.size_function(evicted_value)
+
+    def get_or_create(self, key, create_function):
+        """Return the value cached for a key, calling create_function() to create
+        and cache the value if there isn't one."""
+        value = self.get(key)
+        if value is None:
+            value = create_function()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        """Remove a key from the cache, if it's there."""
+        with self._lock:
+            if key in self._items:
+                self.size -= self.size_function(self._items.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def stats(self):
+        """Return the hit and miss counters, for sizing the cache."""
+        return {
+            "size": self.size,
+            "max_size": self.max_size,
+            "items": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,162 @@
+import fcntl
+import logging
+import os
+import secrets
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeMarker:
+    """A version that changes whenever something is marked as changed, and that
+    every worker process can read cheaply. Each change writes a new random version
+    to a file shared by the workers. Without a file, only changes made by this
+    process are seen."""
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self._local_changes = 0
+        self._lock = threading.Lock()
+
+    def mark(self):
+        with self._lock:
+            self._local_changes += 1
+        if self.file_name is None:
+            return
+        # Written to a temporary file first, so that readers never see a partly written version
+        temporary_file_name = f"{self.file_name}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            with open(temporary_file_name, "w") as file:
+                file.write(secrets.token_hex(16))
+            os.replace(temporary_file_name, self.file_name)
+        except OSError:
+            logger.exception("Failed to mark %s as changed", self.file_name)
+
+    def version(self):
+        """Return the current version, or None if it can't be read."""
+        if self.file_name is None:
+            return self._local_changes
+        try:
+            with open(self.file_name) as file:
+                return self._local_changes, file.read()
+        except FileNotFoundError:
+            return self._local_changes, ""
+        except OSError:
+            return None
+
+
+# A reader's place in a ChangeLog. The generation and inode identify the log
+# file, and failed_appends counts the changes this process failed to record.
+LogPosition = namedtuple("LogPosition", ["generation", "inode", "offset", "failed_appends"])
+
+
+class ChangeLog:
+    """A log of the items (eg. hashes or tokens) that have changed, that every
+    worker process can read cheaply. Items are appended to a file shared by the
+    workers, and each reader keeps its position in the file, so that it only
+    reads the items added since, and only stats the file when nothing has been.
+    Once the file grows past max_size bytes it's started afresh, and readers part
+    way through the old file are told that they've missed changes. Without a
+    file, only changes made by this process are seen."""
+
+    def __init__(self, file_name=None, max_size=1024 * 1024):
+        self.file_name = file_name
+        self.max_size = max_size
+        self._local_items = []
+        self._local_size = 0
+        self._local_generation = 0
+        self._failed_appends = 0
+        self._lock = threading.Lock()
+
+    def append(self, items):
+        """Add items, which must be strings without line breaks, to the log."""
+        lines = "".join(f"{item}\n" for item in items).encode("utf-8")
+        if not lines:
+            return
+        if self.file_name is None:
+            with self._lock:
+                if self._local_size + len(lines) > self.max_size:
+                    self._local_items = []
+                    self._local_size = 0
+                    self._local_generation += 1
+                self._local_items.extend(lines.decode("utf-8").splitlines())
+                self._local_size += len(lines)
+            return
+        try:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            # Writers take turns, so that no items are appended to a file that's being replaced
+            with open(f"{self.file_name}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    with open(self.file_name, "r+b") as file:
+                        is_readable = len(file.readline().split()) == 2
+                        size = file.seek(0, os.SEEK_END)
+                        if is_readable and size + len(lines) <= self.max_size:
+                            file.write(lines)
+                            return
+                except FileNotFoundError:
+                    size = None
+                # A new file starts with its generation, and whether it replaced an
+                # older file, which readers positioned in the older file can't follow
+                header = f"{secrets.token_hex(16)} {'new' if size is None else 'restarted'}\n".encode("utf-8")
+                temporary_file_name = f"{self.file_name}.{os.getpid()}-{threading.get_ident()}.tmp"
+                with open(temporary_file_name, "wb") as file:
+                    file.write(header + lines)
+                os.replace(temporary_file_name, self.file_name)
+        except OSError:
+            logger.exception("Failed to append %d items to %s", lines.count(b"\n"), self.file_name)
+            with self._lock:
+                self._failed_appends += 1
+
+    def position(self):
+        """Return the position at the end of the log."""
+        return self.read(None)[0]
+
+    def read(self, position):
+        """Return the position at the end of the log, and the items added after
+        the given position. The items are None if some of them can't be known, eg.
+        if the log has been started afresh since then, or if it can't be read."""
+        failed_appends = self._failed_appends
+        if self.file_name is None:
+            with self._lock:
+                end = LogPosition(self._local_generation, None, len(self._local_items), failed_appends)
+                if position is None or position.generation != end.generation:
+                    return end, None
+                return end, self._local_items[position.offset :]
+        if position is not None and position.failed_appends != failed_appends:
+            position = None
+        try:
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            # Nothing has been added since a position taken before the file existed
+            end = LogPosition(None, None, 0, failed_appends)
+            return end, [] if position is not None and position.generation is None else None
+        except OSError:
+            return position, None
+        if position is not None and (position.inode, position.offset) == (stat.st_ino, stat.st_size):
+            return position, []
+        try:
+            with open(self.file_name, "rb") as file:
+                header = file.readline()
+                generation, state = header.decode("utf-8").split()
+                if position is not None and position.generation is None and state == "new":
+                    # Everything in a file created since the position was taken was added after it
+                    position = LogPosition(generation, None, len(header), failed_appends)
+                file_size = os.fstat(file.fileno()).st_size
+                if position is not None and (
+                    position.generation != generation or not len(header) <= position.offset <= file_size
+                ):
+                    position = None
+                offset = len(header) if position is None else position.offset
+                file.seek(offset)
+                data = file.read()
+                # Only whole lines are read, in case an item is still being written
+                data = data[: data.rfind(b"\n") + 1]
+                end = LogPosition(generation, os.fstat(file.fileno()).st_ino, offset + len(data), failed_appends)
+        except (OSError, ValueError):
+            return position, None
+        if position is None:
+            return end, None
+        return end, data.decode("utf-8").splitlines()
@@ -0,0 +1,284 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import Dome, DomeConnection
+from app.modules.cache import LRUCache
+from app.modules.change_marker import ChangeMarker
+
+logger = logging.getLogger(__name__)
+
+# Distinguishes paths that aren't cached from cached results of None, which mean there's no route
+not_cached = object()
+
+
+class DomeGraph:
+    """The network of biodomes and the tunnels between them, held in memory as
+    compact adjacency arrays. Domes are addressed by their database ID, and
+    tunnels are two-way. The length of a tunnel is the distance between the world
+    locations of the domes it connects."""
+
+    def __init__(self, domes, connections, path_cache_size=10000):
+        """Takes an iterable of (id, world_location_x, world_location_y) tuples
+        and an iterable of (dome_id_1, dome_id_2) tuples."""
+        self.ids = array("I")
+        self.x = array("d")
+        self.y = array("d")
+        for dome_id, x, y in domes:
+            self.ids.append(dome_id)
+            self.x.append(x)
+            self.y.append(y)
+        self.index = {dome_id: i for i, dome_id in enumerate(self.ids)}
+
+        # Build the adjacency arrays. The neighbours of the dome at index i are
+        # stored in neighbours[offsets[i]:offsets[i + 1]], in compressed sparse
+        # row format, with the length of each tunnel in the same place in lengths.
+        edges = [(self.index[dome_id_1], self.index[dome_id_2]) for dome_id_1, dome_id_2 in connections]
+        degrees = [0] * len(self.ids)
+        for i, j in edges:
+            degrees[i] += 1
+            degrees[j] += 1
+        self.offsets = array("I", [0])
+        for degree in degrees:
+            self.offsets.append(self.offsets[-1] + degree)
+        self.neighbours = array("I", bytes(4 * self.offsets[-1]))
+        self.lengths = array("d", bytes(8 * self.offsets[-1]))
+        next_slot = list(self.offsets[:-1])
+        for i, j in edges:
+            length = self.distance(i, j)
+            for a, b in ((i, j), (j, i)):
+                self.neighbours[next_slot[a]] = b
+                self.lengths[next_slot[a]] = length
+                next_slot[a] += 1
+
+        self.path_cache = LRUCache(max_size=path_cache_size)
+        self._components = None
+
+    @classmethod
+    def from_database(cls):
+        """Load the dome graph from the dome and dome_connection tables."""
+        domes = db.session.query(Dome.id, Dome.world_location_x, Dome.world_location_y).all()
+        connections = db.session.query(DomeConnection.dome_id_1, DomeConnection.dome_id_2).all()
+        return cls(domes, connections)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, dome_id):
+        return dome_id in self.index
+
+    def distance(self, i, j):
+        """The straight-line distance between the domes at indices i and j."""
+        return math.hypot(self.x[i] - self.x[j], self.y[i] - self.y[j])
+
+    def shortest_path(self, start_id, end_id):
+        """Return (length, [dome IDs]) for the shortest route between two domes, or
+        None if there isn't one. Uses A*, with the straight-line distance to the
+        destination as the heuristic. Results are cached."""
+        # A* would search the whole of the start's component before giving up
+        if not self.is_reachable(start_id, end_id):
+            return None
+        # Tunnels are two-way, so a path and its reverse share a cache entry
+        key = (min(start_id, end_id), max(start_id, end_id))
+        # Looked up in one step, as another thread can evict the entry at any time
+        result = self.path_cache.get(key, not_cached)
+        if result is not_cached:
+            result = self._a_star(*key)
+            self.path_cache.set(key, result)
+        if result is None or start_id == key[0]:
+            return result
+        length, path = result
+        return length, path[::-1]
+
+    def _a_star(self, start_id, end_id):
+        start = self.index[start_id]
+        end = self.index[end_id]
+        offsets, neighbours, lengths = self.offsets, self.neighbours, self.lengths
+        distances = {start: 0.0}
+        previous = {}
+        queue = [(self.distance(start, end), 0.0, start)]
+        while queue:
+            _, distance, current = heapq.heappop(queue)
+            if current == end:
+                path = [self.ids[end]]
+                while current != start:
+                    current = previous[current]
+                    path.append(self.ids[current])
+                return distance, path[::-1]
+            if distance > distances[current]:
+                continue  # A shorter route to this dome has already been found
+            for k in range(offsets[current], offsets[current + 1]):
+                neighbour = neighbours[k]
+                neighbour_distance = distance + lengths[k]
+                if neighbour_distance < distances.get(neighbour, math.inf):
+                    distances[neighbour] = neighbour_distance
+                    previous[neighbour] = current
+                    estimate = neighbour_distance + self.distance(neighbour, end)
+                    heapq.heappush(queue, (estimate, neighbour_distance, neighbour))
+        return None
+
+    def neighbourhood(self, dome_id, hops):
+        """Return the IDs of every dome reachable from a dome through at most
+        the given number of tunnels, including the dome itself."""
+        start = self.index[dome_id]
+        offsets, neighbours = self.offsets, self.neighbours
+        seen = {start}
+        frontier = [start]
+        for _ in range(hops):
+            next_frontier = []
+            for current in frontier:
+                for neighbour in neighbours[offsets[current] : offsets[current + 1]]:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return [self.ids[i] for i in sorted(seen)]
+
+    @property
+    def components(self):
+        """The connected components of the graph, as an array holding the component
+        number of the dome at each index."""
+        if self._components is None:
+            offsets, neighbours = self.offsets, self.neighbours
+            components = array("i", [-1]) * len(self.ids)
+            component = 0
+            for start in range(len(self.ids)):
+                if components[start] != -1:
+                    continue
+                components[start] = component
+                queue = deque([start])
+                while queue:
+                    current = queue.popleft()
+                    for neighbour in neighbours[offsets[current] : offsets[current + 1]]:
+                        if components[neighbour] == -1:
+                            components[neighbour] = component
+                            queue.append(neighbour)
+                component += 1
+            self._components = components
+        return self._components
+
+    def connected_components(self):
+        """Return the connected components of the graph, as lists of dome IDs."""
+        groups = {}
+        for i, component in enumerate(self.components):
+            groups.setdefault(component, []).append(self.ids[i])
+        return list(groups.values())
+
+    def is_reachable(self, start_id, end_id):
+        """Test whether there is any route between two domes."""
+        return self.components[self.index[start_id]] == self.components[self.index[end_id]]
+
+
+# Each worker keeps its own copy of the dome graph. Commits that add, change or
+# delete domes or tunnels mark dome_changes, which is shared between workers, and
+# every worker checks it at most once every change_check_interval seconds.
+# Changes made directly in the database are picked up after dome_graph_ttl.
+# Reloads run in a background thread, and the old graph is served until the new
+# one is ready, so that no request waits for a reload other than the first.
+dome_changes = ChangeMarker()
+change_check_interval = 1  # Seconds
+dome_graph_ttl = 300  # Seconds
+_dome_graph = None
+_dome_graph_version = None
+_dome_graph_load_time = 0
+_last_change_check_time = 0
+_dome_graph_lock = threading.Lock()
+_first_load_lock = threading.Lock()
+_reload_thread = None
+
+
+def load_dome_graph():
+    """Load a new dome graph from the database, and start serving it."""
+    global _dome_graph, _dome_graph_version, _dome_graph_load_time
+    # Read first, so that changes committed while the graph loads aren't missed
+    version = dome_changes.version()
+    load_time = time.monotonic()
+    dome_graph = DomeGraph.from_database()
+    # Found before the graph is served, so that no request has to wait for them
+    dome_graph.components
+    with _dome_graph_lock:
+        _dome_graph = dome_graph
+        _dome_graph_version = version
+        _dome_graph_load_time = load_time
+    return dome_graph
+
+
+def reload_dome_graph():
+    try:
+        load_dome_graph()
+    except Exception:
+        logger.exception("Failed to reload the dome graph")
+    finally:
+        db.session.remove()
+
+
+def _is_out_of_date():
+    # Called with the lock held
+    global _last_change_check_time
+    now = time.monotonic()
+    if now - _dome_graph_load_time > dome_graph_ttl:
+        return True
+    if now - _last_change_check_time < change_check_interval:
+        return False
+    _last_change_check_time = now
+    version = dome_changes.version()
+    return version is not None and version != _dome_graph_version
+
+
+def get_dome_graph():
+    """Return the dome graph, loading it from the database if there isn't one
+    yet, and starting a reload if it's out of date."""
+    global _reload_thread
+    with _dome_graph_lock:
+        dome_graph = _dome_graph
+        is_reloading = _reload_thread is not None and _reload_thread.is_alive()
+        if dome_graph is not None and not is_reloading and _is_out_of_date():
+            _reload_thread = threading.Thread(target=reload_dome_graph, name="dome graph", daemon=True)
+            _reload_thread.start()
+    if dome_graph is not None:
+        return dome_graph
+    # Only one thread loads the first graph, and the others wait for it
+    with _first_load_lock:
+        return _dome_graph or load_dome_graph()
+
+
+def get_loaded_dome_graph():
+    """Return the dome graph if it has been loaded, or None, without loading it."""
+    return _dome_graph
+
+
+def record_dome_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["domes_changed"] = True
+
+
+for model in (Dome, DomeConnection):
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, event_name, record_dome_change)
+
+
+@event.listens_for(db.session, "after_commit")
+def mark_dome_changes(session):
+    # Marked once the changes are visible, so that no worker reloads the graph
+    # before they are and keeps the old one, rather than when a savepoint is
+    # released. This worker checks straight away.
+    global _last_change_check_time
+    if session.transaction.nested:
+        return
+    if session.info.pop("domes_changed", False):
+        dome_changes.mark()
+        _last_change_check_time = 0
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def forget_dome_changes(session, transaction):
+    # The changes of a transaction that was rolled back are never marked
+    if transaction.parent is None:
+        session.info.pop("domes_changed", None)
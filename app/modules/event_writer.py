@@ -0,0 +1,124 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedEventWriter:
+    """Writes rows to an append-only table from a background thread, so that
+    logging an event doesn't add a database round trip to the request that caused
+    it. Rows are queued in memory and inserted in batches, with one multi-row
+    INSERT per batch, whenever max_batch_size rows are waiting or flush_interval
+    seconds have passed since the last flush.
+
+    Queued rows are lost if the process is killed, so this is only for tables
+    where losing the last second of events is acceptable (eg. logs and audit
+    trails). If the queue is full, new rows are dropped and counted."""
+
+    def __init__(self, table, get_engine, max_batch_size=500, flush_interval=1.0, max_queue_size=100000):
+        """Takes the table to insert into, and a function that returns the engine
+        to insert with. The function is first called from the thread making the
+        first write, eg. inside a request, so can depend on the app context."""
+        self.table = table
+        self.get_engine = get_engine
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._engine = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        # Statistics
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.total_flush_time = 0
+        self.max_flush_time = 0
+        self.last_flush_time = 0
+
+    def write(self, row):
+        """Queue a row, as a dict of column names to values, to be inserted."""
+        with self._condition:
+            self._start()
+            if self._closed or len(self._queue) >= self.max_queue_size:
+                self.dropped += 1
+                return
+            self._queue.append(row)
+            if len(self._queue) >= self.max_batch_size:
+                self._condition.notify()
+
+    def _start(self):
+        # The background thread is started on first use, by the process that uses
+        # it. Forked worker processes don't inherit threads, so each one starts its
+        # own, and discards any rows that were queued in the parent process.
+        if self._pid != os.getpid():
+            self._queue.clear()
+            self._engine = self.get_engine()
+            self._thread = threading.Thread(target=self._run, name=f"{self.table.name} writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._queue) < self.max_batch_size and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                if self._closed and not self._queue:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Insert every queued row now, in batches of up to max_batch_size rows."""
+        # Only one flush runs at a time, so that rows are inserted in the order they were queued
+        with self._flush_lock:
+            while True:
+                with self._condition:
+                    batch_size = min(len(self._queue), self.max_batch_size)
+                    batch = [self._queue.popleft() for _ in range(batch_size)]
+                if not batch:
+                    return
+                start = time.perf_counter()
+                try:
+                    with self._engine.begin() as connection:
+                        connection.execute(self.table.insert(), batch)
+                except Exception:
+                    logger.exception("Failed to write %d rows to %s", len(batch), self.table.name)
+                    self.failed += len(batch)
+                    continue
+                flush_time = time.perf_counter() - start
+                self.written += len(batch)
+                self.flushes += 1
+                self.total_flush_time += flush_time
+                self.max_flush_time = max(self.max_flush_time, flush_time)
+                self.last_flush_time = flush_time
+
+    def close(self):
+        """Write every queued row and stop the background thread. Called
+        automatically when the process exits normally."""
+        with self._condition:
+            if self._thread is None or self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "mean_flush_seconds": self.total_flush_time / self.flushes if self.flushes else 0,
+            "max_flush_seconds": self.max_flush_time,
+            "last_flush_seconds": self.last_flush_time,
+        }
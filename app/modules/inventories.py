@@ -0,0 +1,114 @@
+from collections import namedtuple
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.util import identity_key
+from app import db
+from app.models import Inventory, Resource, ResourceType
+from app.modules.resource_catalogue import get_resource_type_catalogue
+
+# Totals of an inventory, as (item count, total mass, total volume)
+InventoryTotals = namedtuple("InventoryTotals", ["item_count", "total_mass", "total_volume"])
+InventoryDrift = namedtuple("InventoryDrift", ["inventory_id", "stored", "actual"])
+total_columns = ("item_count", "total_mass", "total_volume")
+
+
+def adjust_inventory_totals(connection, inventory_id, resource_type_id, count):
+    """Add count resources of a type to the totals of an inventory, or remove them
+    if count is negative, in a single UPDATE statement. Resources without a
+    resource type (complex assets like vehicles) only count towards item_count."""
+    inventory = Inventory.__table__
+    values = {"item_count": inventory.c.item_count + count}
+    if resource_type_id is not None:
+        catalogue = get_resource_type_catalogue(resource_type_id, connection)
+        values["total_mass"] = inventory.c.total_mass + count * catalogue.mass(resource_type_id)
+        values["total_volume"] = inventory.c.total_volume + count * catalogue.volume(resource_type_id)
+    connection.execute(inventory.update().where(inventory.c.id == inventory_id).values(values))
+
+
+def mark_inventory_changed(resource, inventory_id):
+    # Remember which inventories were changed during the flush, so that their
+    # now out of date totals can be expired once it's finished
+    session = object_session(resource)
+    if session is not None:
+        session.info.setdefault("changed_inventory_ids", set()).add(inventory_id)
+
+
+@event.listens_for(Resource, "after_insert")
+def add_resource_to_totals(mapper, connection, resource):
+    adjust_inventory_totals(connection, resource.inventory_id, resource.resource_type_id, 1)
+    mark_inventory_changed(resource, resource.inventory_id)
+
+
+@event.listens_for(Resource, "after_delete")
+def remove_resource_from_totals(mapper, connection, resource):
+    adjust_inventory_totals(connection, resource.inventory_id, resource.resource_type_id, -1)
+    mark_inventory_changed(resource, resource.inventory_id)
+
+
+@event.listens_for(Resource, "before_update")
+def move_resource_between_totals(mapper, connection, resource):
+    inventory_history = get_history(resource, "inventory_id")
+    resource_type_history = get_history(resource, "resource_type_id")
+    if not inventory_history.has_changes() and not resource_type_history.has_changes():
+        return
+    if inventory_history.deleted and resource_type_history.deleted:
+        old_inventory_id = inventory_history.deleted[0]
+        old_resource_type_id = resource_type_history.deleted[0]
+    else:
+        # The old values weren't loaded (eg. they were expired by a commit), but
+        # the row hasn't been updated yet, so they can still be read from it
+        resource_table = Resource.__table__
+        query = select([resource_table.c.inventory_id, resource_table.c.resource_type_id])
+        old_inventory_id, old_resource_type_id = connection.execute(
+            query.where(resource_table.c.id == resource.id)
+        ).first()
+    adjust_inventory_totals(connection, old_inventory_id, old_resource_type_id, -1)
+    adjust_inventory_totals(connection, resource.inventory_id, resource.resource_type_id, 1)
+    mark_inventory_changed(resource, old_inventory_id)
+    mark_inventory_changed(resource, resource.inventory_id)
+
+
+@event.listens_for(db.session, "after_flush_postexec")
+def expire_changed_inventories(session, flush_context):
+    for inventory_id in session.info.pop("changed_inventory_ids", ()):
+        inventory = session.identity_map.get(identity_key(Inventory, inventory_id))
+        if inventory is not None:
+            session.expire(inventory, total_columns)
+
+
+def compute_inventory_totals():
+    """Return the totals of every inventory that holds resources, computed from
+    scratch from the resource and resource_type tables."""
+    query = (
+        db.session.query(
+            Resource.inventory_id,
+            func.count(Resource.id),
+            func.coalesce(func.sum(ResourceType.mass), 0),
+            func.coalesce(func.sum(ResourceType.volume), 0),
+        )
+        .outerjoin(ResourceType)
+        .group_by(Resource.inventory_id)
+    )
+    return {inventory_id: InventoryTotals(*totals) for inventory_id, *totals in query}
+
+
+def reconcile_inventory_totals(fix=False):
+    """Find every inventory whose stored totals don't match its resources, and
+    return them as a list of InventoryDrift. If fix is True, the stored totals
+    are corrected and the session is committed."""
+    actual_totals = compute_inventory_totals()
+    empty_totals = InventoryTotals(0, 0, 0)
+    drifts = []
+    stored_totals = db.session.query(Inventory.id, Inventory.item_count, Inventory.total_mass, Inventory.total_volume)
+    for inventory_id, *stored in stored_totals.yield_per(10000):
+        stored = InventoryTotals(*stored)
+        actual = actual_totals.get(inventory_id, empty_totals)
+        if stored != actual:
+            drifts.append(InventoryDrift(inventory_id, stored, actual))
+    if fix and drifts:
+        db.session.bulk_update_mappings(
+            Inventory, [dict(id=drift.inventory_id, **drift.actual._asdict()) for drift in drifts]
+        )
+        db.session.commit()
+    return drifts
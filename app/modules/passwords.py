@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import threading
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from app import exceptions
+
+
+class PasswordHashingService:
+    """Runs bcrypt in a pool of worker processes, so that hashing and checking
+    passwords doesn't hold up the process serving requests. Only a limited number
+    of passwords can be waiting at once; past that, requests are turned away
+    straight away with a ServiceUnavailableError instead of queueing."""
+
+    def __init__(self, processes, queue_depth, work_factor, timeout=None):
+        self.processes = processes
+        self.queue_depth = queue_depth
+        self.work_factor = work_factor
+        self.timeout = timeout
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._queue_slots = threading.BoundedSemaphore(processes + queue_depth)
+
+    @property
+    def pool(self):
+        # The pool is created on first use, so that it belongs to the process
+        # (eg. gunicorn worker) that uses it. Pool processes are spawned rather
+        # than forked so that they don't inherit the worker's sockets.
+        with self._pool_lock:
+            if self._pool is None:
+                mp_context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=mp_context)
+            return self._pool
+
+    def _run(self, function, *args):
+        if not self._queue_slots.acquire(blocking=False):
+            raise exceptions.ServiceUnavailableError("Too many passwords are being checked at once, try again later.")
+        try:
+            future = self.pool.submit(function, *args)
+        except BaseException as error:
+            self._queue_slots.release()
+            if isinstance(error, BrokenProcessPool):
+                self._discard_pool()
+                raise exceptions.ServiceUnavailableError
+            raise
+        # The slot is held until the job has finished, even if the request stops
+        # waiting for it, so that jobs that time out still count towards the limit
+        future.add_done_callback(lambda future: self._queue_slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            self._discard_pool()
+            raise exceptions.ServiceUnavailableError
+        except TimeoutError:
+            # Jobs that haven't started yet are dropped, but a running job can't be stopped
+            future.cancel()
+            raise exceptions.ServiceUnavailableError
+
+    def _discard_pool(self):
+        # A worker process died; start a new pool for the next request
+        with self._pool_lock:
+            self._pool = None
+
+    def hash_password(self, password):
+        """Return the bcrypt hash of a password."""
+        salt = bcrypt.gensalt(rounds=self.work_factor)
+        return self._run(bcrypt.hashpw, password.encode("utf-8"), salt)
+
+    def check_password(self, password, password_hash):
+        """Test that a password matches a bcrypt hash."""
+        return self._run(bcrypt.checkpw, password.encode("utf-8"), bytes(password_hash))
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+_service = None
+_service_pid = None
+
+
+def get_password_hashing_service():
+    """Return the password hashing service for the current process, creating it
+    from the app configuration if needed."""
+    global _service, _service_pid
+    # Each forked worker process gets its own service and pool
+    if _service is None or _service_pid != os.getpid():
+        config = current_app.config
+        _service = PasswordHashingService(
+            processes=config["PASSWORD_HASHING_PROCESSES"],
+            queue_depth=config["PASSWORD_HASHING_QUEUE_DEPTH"],
+            work_factor=config["PASSWORD_HASHING_WORK_FACTOR"],
+            timeout=config["PASSWORD_HASHING_TIMEOUT"],
+        )
+        _service_pid = os.getpid()
+    return _service
+
+
+def hash_password(password):
+    return get_password_hashing_service().hash_password(password)
+
+
+def check_password(password, password_hash):
+    return get_password_hashing_service().check_password(password, password_hash)
@@ -0,0 +1,109 @@
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMonitor:
+    """Collects statistics about a worker's database connection pool, so that
+    time spent waiting for a connection can be told apart from time spent in
+    the database. Connections in use and opened are counted from pool events.
+    SQLAlchemy has no event for when a checkout starts, so checkouts are timed
+    by the pool class returned by create_pool_class()."""
+
+    def __init__(self):
+        self.pool = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.connections_in_use = 0
+            self.max_connections_in_use = 0
+            self.connections_opened = 0
+            self.connections_closed = 0
+            self.max_overflow_in_use = 0
+            self.total_wait_seconds = 0
+            self.max_wait_seconds = 0
+
+    def create_pool_class(self, base_class=QueuePool):
+        """Return a pool class that's monitored by this monitor, for the 'poolclass'
+        engine option."""
+        monitor = self
+
+        class MonitoredPool(base_class):
+            # Engines check out connections with either of these methods
+            def connect(self):
+                return monitor._timed_checkout(self, super().connect)
+
+            def unique_connection(self):
+                return monitor._timed_checkout(self, super().unique_connection)
+
+        event.listen(MonitoredPool, "connect", self._on_connect)
+        event.listen(MonitoredPool, "close", self._on_close)
+        event.listen(MonitoredPool, "checkout", self._on_checkout)
+        event.listen(MonitoredPool, "checkin", self._on_checkin)
+        return MonitoredPool
+
+    def _timed_checkout(self, pool, checkout):
+        self.pool = pool
+        start = time.perf_counter()
+        try:
+            connection = checkout()
+        except exc.TimeoutError:
+            self._record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        self._record_checkout(time.perf_counter() - start, overflow=pool.overflow())
+        return connection
+
+    def _record_checkout(self, wait_seconds, timed_out=False, overflow=0):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+            self.max_overflow_in_use = max(self.max_overflow_in_use, overflow)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
+
+    def _on_close(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_closed += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.connections_in_use += 1
+            self.max_connections_in_use = max(self.max_connections_in_use, self.connections_in_use)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_in_use -= 1
+
+    def stats(self):
+        with self._lock:
+            checkout_attempts = self.checkouts + self.timeouts
+            return {
+                "pool_size": self.pool.size() if self.pool is not None else None,
+                "overflow_in_use": max(0, self.pool.overflow()) if self.pool is not None else 0,
+                "max_overflow_in_use": max(0, self.max_overflow_in_use),
+                "connections_in_use": self.connections_in_use,
+                "max_connections_in_use": self.max_connections_in_use,
+                "connections_open": self.connections_opened - self.connections_closed,
+                "connections_opened": self.connections_opened,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "mean_wait_seconds": self.total_wait_seconds / checkout_attempts if checkout_attempts else 0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+# Each worker monitors its own pool. Only engines configured with a pool_size
+# use the monitored pool class (see create_app).
+pool_monitor = PoolMonitor()
+MonitoredQueuePool = pool_monitor.create_pool_class()
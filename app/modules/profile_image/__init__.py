@@ -1,2 +1,2 @@
 from .profile_image import ProfileImage
-from .generator import generate_profile_image
\ No newline at end of file
+from .generator import generate_profile_image, generate_profile_images
\ No newline at end of file
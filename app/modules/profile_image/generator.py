@@ -1,5 +1,7 @@
-from .profile_image import ProfileImage
+from .profile_image import ProfileImage, image_data_length
+from .masks import MaskSet, apply_mask, solid
 import glob
+import numpy
 import random
 import os
 
@@ -7,16 +9,51 @@ module_path = os.path.dirname(os.path.realpath(__file__))
 icon_paths = glob.glob(module_path + "/image_components/icons/*.png")
 border_paths = glob.glob(module_path + "/image_components/borders/*.png")
 
+# Masks are decoded from the .png files once, the first time an image is generated
+icon_masks = MaskSet(icon_paths)
+border_masks = MaskSet(border_paths)
+
 background_colours = [10, 14, 7]
 midground_colours = [9, 15, 13, 4, 6, 0]
 foreground_colours = [1, 2, 3, 5, 8, 11, 12]
 
 def generate_profile_image():
     """Generate a random profile image."""
-    profile_image = ProfileImage()
-    profile_image.fill(random.choice(background_colours))
-    border_path = random.choice(border_paths)
-    icon_path = random.choice(icon_paths)
-    profile_image.apply_image_as_mask(border_path, random.choice(midground_colours))
-    profile_image.apply_image_as_mask(icon_path, random.choice(foreground_colours))
-    return profile_image
+    image = solid(random.choice(background_colours))
+    border_mask = random.choice(border_masks)
+    icon_mask = random.choice(icon_masks)
+    image = apply_mask(image, border_mask, random.choice(midground_colours))
+    image = apply_mask(image, icon_mask, random.choice(foreground_colours))
+    return ProfileImage.from_int(image)
+
+
+def generate_profile_image_array(count, seed=None):
+    """Generate a batch of random profile images as an array of colour indices
+    with shape (count, height, width). Passing a seed makes the batch reproducible."""
+    rng = numpy.random.default_rng(seed)
+    # Pick the colours and masks for every image up front
+    background = rng.choice(background_colours, count).astype(numpy.uint8)
+    midground = rng.choice(midground_colours, count).astype(numpy.uint8)
+    foreground = rng.choice(foreground_colours, count).astype(numpy.uint8)
+    borders = border_masks.array[rng.integers(len(border_masks), size=count)]
+    icons = icon_masks.array[rng.integers(len(icon_masks), size=count)]
+
+    # Composite every image in the batch at once. XORing a pixel with (old ^ new)
+    # changes it from the old colour to the new one, so multiplying that by the
+    # mask only changes the masked pixels. This is much faster than numpy.where.
+    images = numpy.broadcast_to(background[:, None, None], borders.shape)
+    images = images ^ ((background ^ midground)[:, None, None] * borders)
+    images = images ^ ((images ^ foreground[:, None, None]) * icons)
+    return images
+
+
+def generate_profile_images(count, seed=None):
+    """Generate a list of random profile images. Passing a seed makes the list reproducible."""
+    images = generate_profile_image_array(count, seed).reshape((count, image_data_length * 2))
+    # Pack two pixels into each byte, in the format used by ProfileImage
+    packed_images = (images[:, 0::2] << 4) | images[:, 1::2]
+    image_bytes = packed_images.tobytes()
+    return [
+        ProfileImage.from_bytes(image_bytes[i : i + image_data_length])
+        for i in range(0, len(image_bytes), image_data_length)
+    ]
@@ -0,0 +1,90 @@
+import numpy
+from PIL import Image
+
+image_length = 16
+pixel_count = image_length * image_length
+# An image with every pixel set to colour 1. Multiplying this by a colour index
+# gives an image filled with that colour.
+solid_image = int("1" * pixel_count, 16)
+
+
+def solid(colour_index):
+    """Return an image (as an int) filled entirely with a single colour."""
+    return solid_image * colour_index
+
+
+def load_mask(mask_image_file_path, width=image_length, height=image_length):
+    """Takes a .png file, converts it to black and white, and scales it to the
+    size of a ProfileImage. The mask is returned as an int in the same layout as
+    int(ProfileImage), where every masked pixel is 0xF and every other pixel is 0."""
+    mask_image = Image.open(mask_image_file_path).convert("RGBA")
+
+    # Change high alpha pixels to black, in case the mask is via the alpha channel
+    # If the alpha value of a pixel renders it to be more than half transparent,
+    # make that pixel black. This ensures that an image using an alpha mask can
+    # now be used as a value mask (monochrome).
+    black = (0, 0, 0, 255)
+    alpha_channel = 3
+    mask_data = mask_image.getdata()
+    mask_data = [black if pixel[alpha_channel] < 128 else pixel for pixel in mask_data]
+    mask_image.putdata(mask_data)
+
+    # Convert mask to greyscale
+    mask_image = mask_image.convert("L")
+    # Scale mask to size of ProfileImage
+    mask_image = mask_image.resize((width, height), Image.NEAREST)
+
+    # Pack the mask into an int, one nybble per pixel
+    mask = 0
+    for value in mask_image.getdata():
+        mask <<= 4
+        if value > 128:  # if brighter than mid-grey
+            mask |= 0xF
+    return mask
+
+
+def mask_to_array(mask, width=image_length, height=image_length):
+    """Convert a mask loaded with load_mask into a 2-dimensional boolean array."""
+    mask_bytes = numpy.frombuffer(mask.to_bytes(width * height // 2, byteorder="big"), dtype=numpy.uint8)
+    mask_array = numpy.empty(width * height, dtype=bool)
+    mask_array[0::2] = mask_bytes >> 4 != 0
+    mask_array[1::2] = mask_bytes & 0xF != 0
+    return mask_array.reshape((height, width))
+
+
+def apply_mask(image, mask, colour_index):
+    """Paint every pixel of an image (as an int) covered by the mask with a colour."""
+    return (image & ~mask) | (solid(colour_index) & mask)
+
+
+class MaskSet:
+    """A collection of masks loaded from .png files. The files are only read the
+    first time the masks are needed, and are then kept for the lifetime of the
+    process so that generating an image never touches the disk."""
+
+    def __init__(self, mask_image_file_paths):
+        self.paths = sorted(mask_image_file_paths)
+        self._masks = None
+        self._array = None
+
+    @property
+    def masks(self):
+        if self._masks is None:
+            self._masks = tuple(load_mask(path) for path in self.paths)
+        return self._masks
+
+    @property
+    def array(self):
+        """The masks stacked into a single boolean array of shape (len(self), height, width)."""
+        if self._array is None:
+            self._array = numpy.stack([mask_to_array(mask) for mask in self.masks])
+        return self._array
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.masks[index]
+
+    def __iter__(self):
+        return iter(self.masks)
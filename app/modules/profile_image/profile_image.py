@@ -1,5 +1,6 @@
 import base64
 from PIL import Image
+from . import masks
 
 image_length = 16
 palette_size = 16
@@ -23,17 +24,82 @@ default_palette = {
 }
 
 
+# Each byte of image data holds two pixels, one per nybble
+image_data_length = image_length * image_length // 2
+
+# Translation tables for unpacking the first and last nybble of every byte
+first_nybble_table = bytes(i >> 4 for i in range(256))
+last_nybble_table = bytes(i & 0xF for i in range(256))
+
+
+class ProfileImageRow:
+    """A view onto a single row of a ProfileImage, so that pixels can be
+    accessed as image.image[y][x]."""
+
+    __slots__ = ("profile_image", "y")
+
+    def __init__(self, profile_image, y):
+        self.profile_image = profile_image
+        self.y = y
+
+    def __getitem__(self, x):
+        return self.profile_image.get_pixel(x, self.y)
+
+    def __setitem__(self, x, colour):
+        self.profile_image.set_pixel(x, self.y, colour)
+
+    def __len__(self):
+        return self.profile_image.width
+
+    def __iter__(self):
+        return (self[x] for x in range(len(self)))
+
+
+class ProfileImageRows:
+    """A view onto the rows of a ProfileImage."""
+
+    __slots__ = ("profile_image",)
+
+    def __init__(self, profile_image):
+        self.profile_image = profile_image
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.profile_image.height:
+            raise IndexError("Row index out of range.")
+        return ProfileImageRow(self.profile_image, y)
+
+    def __len__(self):
+        return self.profile_image.height
+
+    def __iter__(self):
+        return (self[y] for y in range(len(self)))
+
+
 class ProfileImage:
     """A square pixel-art image for use as a profile picture. Each pixel is
-    represented by an int, which references a colour on a palette."""
+    represented by an int, which references a colour on a palette.
+
+    Pixels are stored two to a byte in a single bytearray, in the same format
+    that is stored in the database, so converting to and from bytes is a copy."""
+
+    __slots__ = ("data",)
+
+    width = image_length
+    height = image_length
+    palette_size = palette_size
 
-    def __init__(self):
-        self.width = image_length
-        self.height = image_length
-        self.palette_size = palette_size
-        self.image = []
-        for _ in range(self.height):
-            self.image.append([0] * self.width)
+    def __init__(self, image_bytes=None):
+        if image_bytes is None:
+            self.data = bytearray(image_data_length)
+        else:
+            if len(image_bytes) != image_data_length:
+                raise ValueError(f"Image data must be exactly {image_data_length} bytes long.")
+            self.data = bytearray(image_bytes)
+
+    @property
+    def image(self):
+        """The pixels of the image, indexed as image[y][x]."""
+        return ProfileImageRows(self)
 
     @classmethod
     def from_base64_string(cls, base64_string):
@@ -41,57 +107,51 @@ class ProfileImage:
         return cls.from_bytes(image_bytes)
 
     def to_base64_string(self):
-        return base64.b64encode(bytes(self)).decode("utf-8")
+        return base64.b64encode(self.data).decode("utf-8")
 
     @classmethod
     def from_bytes(cls, image_bytes):
-        flat_image = []
-        for i in image_bytes:
-            flat_image.append(i >> 4)  # First nybble
-            flat_image.append(i & 2 ** 4 - 1)  # Last nybble
-        image = cls()
-        image.image = [flat_image[i : i + 16] for i in range(0, 256, 16)]
-        return image
+        return cls(image_bytes)
 
     def __bytes__(self):
-        flat_image = sum(self.image, [])  # flatten the image into a 1-dimensional list
-        image_bytearray = bytearray()
-        for i in range(0, len(flat_image), 2):
-            image_bytearray.append((flat_image[i] << 4) + flat_image[i + 1])
-        return bytes(image_bytearray)
+        return bytes(self.data)
 
     @classmethod
     def from_int(cls, image_int):
-        return cls.from_bytes(image_int.to_bytes(128, byteorder="big"))
+        return cls(image_int.to_bytes(image_data_length, byteorder="big"))
 
     def __int__(self):
-        return int.from_bytes(bytes(self), byteorder="big")
+        return int.from_bytes(self.data, byteorder="big")
 
     def __eq__(self, other):
-        return self.image == other.image
+        if not isinstance(other, ProfileImage):
+            return NotImplemented
+        return self.data == other.data
+
+    def pixel_bytes(self):
+        """Return the image with one byte per pixel, row by row."""
+        pixels = bytearray(image_data_length * 2)
+        pixels[0::2] = self.data.translate(first_nybble_table)
+        pixels[1::2] = self.data.translate(last_nybble_table)
+        return bytes(pixels)
 
     def to_PIL_image(self, palette=default_palette):
         """
         Converts to a PIL Image, so that the image can be saved in a standard image format.
         :palette: takes a dictionary that maps the numbers 0..15 to an (r,g,b) tuple
         """
-        flat_image = sum(self.image, [])  # flattens list
-        colour_data = [palette[colour_index] for colour_index in flat_image]
-        pil_image = Image.new("RGB", (self.width, self.height))
-        pil_image.putdata(colour_data)
-        return pil_image
+        pil_image = Image.frombytes("P", (self.width, self.height), self.pixel_bytes())
+        pil_image.putpalette([channel for i in range(self.palette_size) for channel in palette[i]])
+        return pil_image.convert("RGB")
 
     def fill(self, colour):
         """Fill the image with colour."""
-        for y in range(self.height):
-            for x in range(self.width):
-                self.image[y][x] = colour
+        self.assert_colour_is_valid(colour)
+        self.data[:] = bytes([colour << 4 | colour]) * image_data_length
 
     def pretty_print(self):
         """Print image as text."""
-        for row in self.image:
-            print(" ".join([str(x).rjust(2) for x in row]))
-        print()
+        print(self)
 
     def __str__(self):
         image_str = ""
@@ -99,42 +159,41 @@ class ProfileImage:
             image_str += " ".join([str(x).rjust(2) for x in row]) + "\n"
         return image_str
 
+    def get_pixel(self, x, y):
+        """Return the colour of a pixel."""
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError("Pixel coordinates out of range.")
+        index, last_nybble = divmod(y * self.width + x, 2)
+        if last_nybble:
+            return self.data[index] & 0xF
+        return self.data[index] >> 4
+
     def set_pixel(self, x, y, colour):
         """Set the colour of a pixel."""
         self.assert_colour_is_valid(colour)
-        self.image[y][x] = colour
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError("Pixel coordinates out of range.")
+        index, last_nybble = divmod(y * self.width + x, 2)
+        if last_nybble:
+            self.data[index] = (self.data[index] & 0xF0) | colour
+        else:
+            self.data[index] = (self.data[index] & 0x0F) | (colour << 4)
 
     def assert_colour_is_valid(self, colour):
         """Ensure the colour falls within the range of the palette."""
         if not 0 <= colour < 16:
             raise ValueError(f"Colour must be between 0 and 15 (inclusive).")
 
+    def apply_mask(self, mask, colour_index):
+        """Imposes a mask loaded with masks.load_mask onto the ProfileImage as the
+        chosen colour."""
+        self.assert_colour_is_valid(colour_index)
+        image_int = masks.apply_mask(int(self), mask, colour_index)
+        self.data[:] = image_int.to_bytes(image_data_length, byteorder="big")
+
     def apply_image_as_mask(self, mask_image_file_path, colour_index):
         """Takes a .png file, converts it to black and white, scales it to the
         size of the PixelImage, and imposes itself onto the PixelImage as the
         chosen colour."""
-        mask_image = Image.open(mask_image_file_path).convert("RGBA")
-
-        # Change high alpha pixels to black, in case the mask is via the alpha channel
-        # If the alpha value of a pixel renders it to be more than half transparent,
-        # make that pixel black. This ensures that an image using an alpha mask can
-        # now be used as a value mask (monochrome).
-        black = (0, 0, 0, 255)
-        alpha_channel = 3
-        mask_data = mask_image.getdata()
-        mask_data = [black if pixel[alpha_channel] < 128 else pixel for pixel in mask_data]
-        mask_image.putdata(mask_data)
-
-        # Convert mask to greyscale
-        mask_image = mask_image.convert("L")
-        # Scale mask to size of ProfileImage
-        mask_image = mask_image.resize((self.width, self.height), Image.NEAREST)
-        # Convert PIL Image to a 2-dimensional list
-        mask = list(mask_image.getdata())
-        mask_2d = [mask[i : i + self.width] for i in range(0, 256, self.width)]
-
-        # Apply mask to ProfileImage
-        for y, row in enumerate(mask_2d):
-            for x, value in enumerate(row):
-                if value > 128:  # if brighter than mid-grey
-                    self.set_pixel(x, y, colour_index)
+        mask = masks.load_mask(mask_image_file_path, self.width, self.height)
+        self.apply_mask(mask, colour_index)
@@ -0,0 +1,63 @@
+import hashlib
+import io
+from PIL import Image
+from app.modules.cache import LRUCache
+from .profile_image import ProfileImage, default_palette, image_length
+
+palettes = {"default": default_palette}
+max_scale = 32
+# The largest number of pixels that a single rendering can have, across all of its pictures
+max_pixels = 1024 * 1024
+# Rendered .png files are kept in memory, up to this many bytes per worker
+png_cache = LRUCache(max_size=8 * 1024 * 1024, size_function=len)
+
+
+def get_etag(pictures, scale=1, palette_name="default"):
+    """Return a strong ETag for the rendering of one or more pictures, without
+    rendering them."""
+    etag = hashlib.sha1(f"{palette_name}:{scale}:".encode("utf-8"))
+    for picture in pictures:
+        etag.update(picture)
+    return etag.hexdigest()
+
+
+def get_pixel_count(picture_count, scale=1):
+    """Return the number of pixels in a rendering of some pictures at a scale."""
+    return picture_count * (image_length * scale) ** 2
+
+
+def to_png_bytes(pil_image):
+    png_file = io.BytesIO()
+    pil_image.save(png_file, format="PNG")
+    return png_file.getvalue()
+
+
+def render_png(picture, scale=1, palette_name="default"):
+    """Render a stored profile picture to a .png file, scaled up by an integer factor."""
+    picture = bytes(picture)
+
+    def render():
+        pil_image = ProfileImage.from_bytes(picture).to_PIL_image(palettes[palette_name])
+        if scale != 1:
+            pil_image = pil_image.resize((image_length * scale, image_length * scale), Image.NEAREST)
+        return to_png_bytes(pil_image)
+
+    return png_cache.get_or_create((picture, palette_name, scale), render)
+
+
+def render_sprite_sheet(pictures, scale=1, palette_name="default"):
+    """Render many stored profile pictures into a single .png file, in a single
+    row in the order they were given."""
+    pictures = [bytes(picture) for picture in pictures]
+
+    def render():
+        sprite_length = image_length * scale
+        sprite_sheet = Image.new("RGB", (sprite_length * len(pictures), sprite_length))
+        for i, picture in enumerate(pictures):
+            pil_image = ProfileImage.from_bytes(picture).to_PIL_image(palettes[palette_name])
+            if scale != 1:
+                pil_image = pil_image.resize((sprite_length, sprite_length), Image.NEAREST)
+            sprite_sheet.paste(pil_image, (i * sprite_length, 0))
+        return to_png_bytes(sprite_sheet)
+
+    return png_cache.get_or_create((b"".join(pictures), palette_name, scale), render)
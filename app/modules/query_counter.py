@@ -0,0 +1,40 @@
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Records the SQL statements executed on an engine by the current thread,
+    while used as a context manager."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self._thread = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is self._thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self._thread = threading.current_thread()
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(engine, max_count):
+    """Fail with an AssertionError if more than max_count SQL statements are
+    executed inside the with block. Used to stop N+1 query regressions."""
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.count > max_count:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(f"Expected at most {max_count} queries, but {counter.count} were executed:\n{statements}")
@@ -0,0 +1,266 @@
+import atexit
+import bisect
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the request latency histogram buckets, in seconds
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class EndpointMetrics:
+    """Totals for every request made to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets = [0] * (len(latency_buckets) + 1)  # The last bucket is +Inf
+        self.seconds = 0.0
+        self.queries = 0
+        self.database_seconds = 0.0
+        self.response_bytes = 0
+
+    def _asdict(self):
+        return dict(vars(self))
+
+
+class RequestMetrics:
+    """Records the latency, number of SQL statements, time spent in the database,
+    and response size of every request, totalled per endpoint.
+
+    Each worker records its own requests, and writes its totals to a file in a
+    directory shared by every worker at most once every write_interval seconds,
+    so that any worker can report the totals of all of them. Files are named by
+    process ID and start time, so the totals of workers that have exited are
+    still included. Collecting the totals merges the files of workers that have
+    exited into a single file, so that restarted workers don't leave a growing
+    number of files behind."""
+
+    def __init__(self, directory=None, write_interval=1.0):
+        self.directory = directory
+        self.write_interval = write_interval
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._current = threading.local()
+        self._pid = None
+        self._file_name = None
+        self._last_write_time = 0
+
+    def listen(self, target):
+        """Count the statements executed by an engine, or by every engine if given the Engine class."""
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def remove_listeners(self, target):
+        event.remove(target, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if getattr(self._current, "start_time", None) is not None:
+            context._metrics_start_time = time.perf_counter()
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        start_time = getattr(context, "_metrics_start_time", None)
+        if start_time is not None and getattr(self._current, "start_time", None) is not None:
+            self._current.queries += 1
+            self._current.database_seconds += time.perf_counter() - start_time
+
+    def start_request(self):
+        """Start recording a request made by this thread."""
+        current = self._current
+        current.queries = 0
+        current.database_seconds = 0.0
+        current.response_bytes = 0
+        current.start_time = time.perf_counter()
+
+    def set_response_bytes(self, response_bytes):
+        """Record the size of the response to the request made by this thread, before it's finished."""
+        self._current.response_bytes = response_bytes
+
+    def finish_request(self, endpoint, response_bytes=None):
+        """Finish recording the request made by this thread, and add it to the totals
+        of its endpoint. If response_bytes isn't given, the size recorded with
+        set_response_bytes is used."""
+        current = self._current
+        if getattr(current, "start_time", None) is None:
+            return
+        if response_bytes is None:
+            response_bytes = current.response_bytes
+        seconds = time.perf_counter() - current.start_time
+        current.start_time = None
+        with self._lock:
+            self._check_process()
+            metrics = self.endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self.endpoints[endpoint] = EndpointMetrics()
+            metrics.requests += 1
+            metrics.buckets[bisect.bisect_left(latency_buckets, seconds)] += 1
+            metrics.seconds += seconds
+            metrics.queries += current.queries
+            metrics.database_seconds += current.database_seconds
+            metrics.response_bytes += response_bytes or 0
+        if self.directory is not None and time.monotonic() - self._last_write_time >= self.write_interval:
+            self.write(blocking=False)
+
+    def _check_process(self):
+        # Called with the lock held. Forked workers start their totals from
+        # scratch, and write them to their own file.
+        if os.getpid() != self._pid:
+            if self._pid is not None:
+                self.endpoints = {}
+            self._pid = os.getpid()
+            self._file_name = None
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: metrics._asdict() for endpoint, metrics in self.endpoints.items()}
+
+    def write(self, blocking=True):
+        """Write this worker's totals to its file in the shared directory. If
+        blocking is False, and another thread is already writing them, returns
+        without writing."""
+        if self.directory is None:
+            return
+        # Only one thread writes at a time, as they share the temporary file
+        if not self._write_lock.acquire(blocking):
+            return
+        try:
+            with self._lock:
+                self._check_process()
+                if self._file_name is None:
+                    self._file_name = os.path.join(self.directory, f"{os.getpid()}-{time.time_ns()}.json")
+                    os.makedirs(self.directory, exist_ok=True)
+                    atexit.register(self.write)
+            self._last_write_time = time.monotonic()
+            # Written to a temporary file first, so that readers never see a partly written file
+            temporary_file_name = f"{self._file_name}.tmp"
+            try:
+                with open(temporary_file_name, "w") as file:
+                    json.dump(self.snapshot(), file)
+                os.replace(temporary_file_name, self._file_name)
+            except OSError:
+                logger.exception("Failed to write request metrics to %s", self._file_name)
+        finally:
+            self._write_lock.release()
+
+    def clear(self):
+        """Delete the totals written by every worker, eg. when the server starts."""
+        if self.directory is not None and os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, file_name))
+
+    def collect(self):
+        """Return the totals of every worker, by endpoint."""
+        if self.directory is None:
+            return self.snapshot()
+        self.write()
+        # Readers share the lock, and merging the files of exited workers takes it
+        # alone, so that no reader sees a worker's totals both merged and unmerged
+        with open(os.path.join(self.directory, lock_file_name), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._merge_exited_workers()
+            except OSError:
+                logger.exception("Failed to merge the request metrics of exited workers in %s", self.directory)
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            totals = {}
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith(".json"):
+                    add_totals(totals, read_totals(os.path.join(self.directory, file_name)))
+        return totals
+
+    def _merge_exited_workers(self):
+        # Called with the exclusive lock held. Adds the totals of workers that
+        # have exited to the merged file, and deletes their files.
+        exited_file_names = []
+        for file_name in os.listdir(self.directory):
+            pid = file_name.partition("-")[0]
+            if pid.isdigit() and not is_process_running(int(pid)):
+                exited_file_names.append(os.path.join(self.directory, file_name))
+        if not exited_file_names:
+            return
+        merged_file_name = os.path.join(self.directory, merged_totals_file_name)
+        totals = read_totals(merged_file_name)
+        for file_name in exited_file_names:
+            if file_name.endswith(".json"):
+                add_totals(totals, read_totals(file_name))
+        with open(f"{merged_file_name}.tmp", "w") as file:
+            json.dump(totals, file)
+        os.replace(f"{merged_file_name}.tmp", merged_file_name)
+        for file_name in exited_file_names:
+            os.remove(file_name)
+
+
+# The totals of workers that have exited are merged into this file
+merged_totals_file_name = "exited-workers.json"
+lock_file_name = "collect.lock"
+
+
+def is_process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but as another user
+        return True
+    return True
+
+
+def read_totals(file_name):
+    """Read the totals written to a file, or return no totals if it can't be read."""
+    try:
+        with open(file_name) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def add_totals(totals, other_totals):
+    """Add one set of totals, by endpoint, to another."""
+    for endpoint, metrics in other_totals.items():
+        endpoint_totals = totals.setdefault(endpoint, EndpointMetrics()._asdict())
+        for name, value in metrics.items():
+            if name == "buckets":
+                endpoint_totals[name] = [a + b for a, b in zip(endpoint_totals[name], value)]
+            else:
+                endpoint_totals[name] += value
+
+
+def format_prometheus(totals):
+    """Format endpoint totals in the Prometheus text exposition format."""
+    lines = [
+        "# HELP doctrine_request_duration_seconds Time taken to handle requests.",
+        "# TYPE doctrine_request_duration_seconds histogram",
+    ]
+    endpoints = sorted(totals)
+    labels = {}
+    for endpoint in endpoints:
+        escaped_endpoint = endpoint.replace("\\", "\\\\").replace('"', '\\"')
+        labels[endpoint] = f'endpoint="{escaped_endpoint}"'
+    for endpoint in endpoints:
+        metrics = totals[endpoint]
+        cumulative_count = 0
+        for upper_bound, count in zip(latency_buckets + ("+Inf",), metrics["buckets"]):
+            cumulative_count += count
+            bucket_labels = f'{labels[endpoint]},le="{upper_bound}"'
+            lines.append(f"doctrine_request_duration_seconds_bucket{{{bucket_labels}}} {cumulative_count}")
+        lines.append(f"doctrine_request_duration_seconds_sum{{{labels[endpoint]}}} {metrics['seconds']}")
+        lines.append(f"doctrine_request_duration_seconds_count{{{labels[endpoint]}}} {metrics['requests']}")
+    counters = [
+        ("doctrine_request_queries_total", "SQL statements executed by requests.", "queries"),
+        ("doctrine_request_database_seconds_total", "Time spent executing SQL statements.", "database_seconds"),
+        ("doctrine_response_bytes_total", "Size of response bodies, excluding streamed responses.", "response_bytes"),
+    ]
+    for name, description, field in counters:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for endpoint in endpoints:
+            lines.append(f"{name}{{{labels[endpoint]}}} {totals[endpoint][field]}")
+    return "\n".join(lines) + "\n"
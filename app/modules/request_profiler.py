@@ -0,0 +1,172 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import secrets
+import string
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# The number of functions listed in a report, by the time spent in them
+hotspot_count = 30
+# Statements are cut down to this many characters in reports
+max_statement_length = 2000
+
+
+class RequestProfiler:
+    """Runs requests under cProfile, and records the SQL statements they execute
+    with their timings, to diagnose slow endpoints where they're slow. Reports are
+    written as JSON files to a directory shared by every worker, which only keeps
+    the newest max_reports reports.
+
+    Requests are profiled either on request, or at random, with a probability of
+    sample_rate, so that a low rate of requests is always being profiled.
+    Statement parameters aren't recorded, as they can include passwords."""
+
+    def __init__(self, directory=None, max_reports=100, sample_rate=0):
+        self.directory = directory
+        self.max_reports = max_reports
+        self.sample_rate = sample_rate
+        self._current = threading.local()
+        self._write_lock = threading.Lock()
+
+    def listen(self, target):
+        """Record the statements executed by an engine, or by every engine if given the Engine class."""
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if getattr(self._current, "profile", None) is not None:
+            context._profiler_start_time = time.perf_counter()
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        start_time = getattr(context, "_profiler_start_time", None)
+        if start_time is not None and getattr(self._current, "profile", None) is not None:
+            seconds = time.perf_counter() - start_time
+            self._current.statements.append({"statement": statement[:max_statement_length], "seconds": seconds})
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, sampled=False):
+        """Start profiling the request being made by this thread."""
+        current = self._current
+        current.report_id = secrets.token_hex(8)
+        current.details = {}
+        current.statements = []
+        current.sampled = sampled
+        current.start_time = time.perf_counter()
+        current.profile = cProfile.Profile()
+        current.profile.enable()
+
+    def is_profiling(self):
+        return getattr(self._current, "profile", None) is not None
+
+    def is_sampled(self):
+        return self._current.sampled
+
+    def get_report_id(self):
+        """Return the ID that the report of the request being profiled will have."""
+        return self._current.report_id
+
+    def add_details(self, **details):
+        """Add details of the request being profiled (eg. its status) to its report."""
+        self._current.details.update(details)
+
+    def stop(self):
+        """Stop profiling the request being made by this thread, and return its
+        report, with any details added with add_details."""
+        current = self._current
+        current.profile.disable()
+        seconds = time.perf_counter() - current.start_time
+        profile, current.profile = current.profile, None
+        report_time = datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
+        report = {"id": current.report_id, "time": report_time, "seconds": seconds, "sampled": current.sampled}
+        report.update(current.details)
+        report["database_seconds"] = sum(statement["seconds"] for statement in current.statements)
+        report["statements"] = current.statements
+        report["hotspots"] = get_hotspots(profile)
+        return report
+
+    def write_report(self, report):
+        """Write a report to the shared directory, deleting the oldest reports if
+        there are more than max_reports."""
+        if self.directory is None:
+            return
+        with self._write_lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                # Written to a temporary file first, so that readers never see a partly written report
+                file_name = os.path.join(self.directory, f"{report['id']}.json")
+                with open(f"{file_name}.tmp", "w") as file:
+                    json.dump(report, file)
+                os.replace(f"{file_name}.tmp", file_name)
+                for old_file_name in self._list_report_files()[self.max_reports :]:
+                    os.remove(old_file_name)
+            except OSError:
+                logger.exception("Failed to write request profile report to %s", self.directory)
+
+    def _list_report_files(self):
+        """Return the paths of every report file, newest first."""
+        file_names = [
+            os.path.join(self.directory, file_name)
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith(".json")
+        ]
+        return sorted(file_names, key=get_modification_time, reverse=True)
+
+    def list_reports(self):
+        """Return a summary of every stored report, newest first."""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
+        summaries = []
+        for file_name in self._list_report_files():
+            report = self._read_report_file(file_name)
+            if report is not None:
+                summaries.append({key: value for key, value in report.items() if key not in ("statements", "hotspots")})
+        return summaries
+
+    def get_report(self, report_id):
+        """Return a stored report, or None if it doesn't exist."""
+        if self.directory is None or not report_id or not all(c in string.hexdigits for c in report_id):
+            return None
+        return self._read_report_file(os.path.join(self.directory, f"{report_id}.json"))
+
+    def _read_report_file(self, file_name):
+        try:
+            with open(file_name) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # The report may have been deleted to make room for a newer one
+            return None
+
+
+def get_modification_time(file_name):
+    try:
+        return os.path.getmtime(file_name)
+    except OSError:
+        # Deleted by another worker since the directory was listed
+        return 0
+
+
+def get_hotspots(profile):
+    """Return the functions that a profiled request spent the most time in."""
+    stats = pstats.Stats(profile)
+    hotspots = []
+    for (file_name, line_number, function_name), (_, calls, own_seconds, seconds, _) in stats.stats.items():
+        hotspots.append(
+            {
+                "function": f"{file_name}:{line_number}({function_name})",
+                "calls": calls,
+                "own_seconds": own_seconds,
+                "cumulative_seconds": seconds,
+            }
+        )
+    hotspots.sort(key=lambda hotspot: hotspot["own_seconds"], reverse=True)
+    return hotspots[:hotspot_count]
@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import time
+from array import array
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import select
+from app import db
+from app.modules.change_marker import ChangeMarker
+
+
+class ResourceCatalogue:
+    """A read-only snapshot of the resource_type table, for looking up resource
+    types without going through the ORM. Masses and volumes are held as whole
+    thousandths in arrays indexed by resource type ID, which is exact for their
+    DECIMAL(13, 3) columns, and names are mapped back to IDs with a dict.
+
+    The version is a hash of the catalogue's contents, so two catalogues loaded
+    from the same rows have the same version, and a catalogue is stale if its
+    version differs from that of a freshly loaded one."""
+
+    def __init__(self, rows):
+        """Takes an iterable of (id, name, mass, volume) tuples. The arrays are
+        sized by the largest ID, as resource type IDs are expected to be dense."""
+        rows = sorted(tuple(row) for row in rows)
+        size = rows[-1][0] + 1 if rows else 0
+        self._names = [None] * size
+        self._masses = array("q", [-1]) * size  # Thousandths, or -1 if there's no resource type with the ID
+        self._volumes = array("q", [-1]) * size
+        self.ids = {}
+        version = hashlib.sha1()
+        for resource_type_id, name, mass, volume in rows:
+            mass = int(Decimal(mass).scaleb(3))
+            volume = int(Decimal(volume).scaleb(3))
+            self._names[resource_type_id] = name
+            self._masses[resource_type_id] = mass
+            self._volumes[resource_type_id] = volume
+            self.ids[name] = resource_type_id
+            version.update(f"{resource_type_id}:{name}:{mass}:{volume};".encode("utf-8"))
+        self.version = version.hexdigest()[:16]
+        self.loaded_at = datetime.utcnow()
+
+    @classmethod
+    def from_database(cls, connection=None):
+        """Load the catalogue from the resource_type table, using the session or
+        the given connection (eg. when called during a flush)."""
+        from app.models import ResourceType
+
+        resource_type = ResourceType.__table__
+        query = select([resource_type.c.id, resource_type.c.name, resource_type.c.mass, resource_type.c.volume])
+        return cls((connection or db.session).execute(query.order_by(resource_type.c.id)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, resource_type_id):
+        return 0 <= resource_type_id < len(self._names) and self._names[resource_type_id] is not None
+
+    def _check_id(self, resource_type_id):
+        if resource_type_id not in self:
+            raise KeyError(resource_type_id)
+
+    def name(self, resource_type_id):
+        self._check_id(resource_type_id)
+        return self._names[resource_type_id]
+
+    def mass(self, resource_type_id):
+        """The mass of a resource type, as a Decimal."""
+        self._check_id(resource_type_id)
+        return Decimal(self._masses[resource_type_id]).scaleb(-3)
+
+    def volume(self, resource_type_id):
+        """The volume of a resource type, as a Decimal."""
+        self._check_id(resource_type_id)
+        return Decimal(self._volumes[resource_type_id]).scaleb(-3)
+
+
+# Each worker holds one catalogue, which is replaced as a whole when reloaded, so
+# readers never see a partly loaded catalogue. Resource types are static game
+# data, so the catalogue is only reloaded when asked to, or when a resource type
+# that it doesn't know about is looked up. Asking any worker to reload marks
+# catalogue_reloads, which is shared between workers, and every worker checks it
+# at most once every reload_check_interval seconds, and reloads if it's changed.
+catalogue_reloads = ChangeMarker()
+reload_check_interval = 1  # Seconds
+_catalogue = None
+_catalogue_reload_version = None
+_last_reload_check_time = 0
+_catalogue_lock = threading.Lock()
+
+
+def get_resource_catalogue(connection=None):
+    """Return the resource type catalogue, loading it if needed, or reloading it
+    if any worker has been asked to reload its catalogue since it was loaded."""
+    global _last_reload_check_time
+    if _catalogue is None:
+        return reload_resource_catalogue(connection)
+    if time.monotonic() - _last_reload_check_time >= reload_check_interval:
+        _last_reload_check_time = time.monotonic()
+        if catalogue_reloads.version() != _catalogue_reload_version:
+            return reload_resource_catalogue(connection)
+    return _catalogue
+
+
+def reload_resource_catalogue(connection=None):
+    """Load this worker's resource type catalogue again from the database, and return it."""
+    global _catalogue, _catalogue_reload_version
+    with _catalogue_lock:
+        # Read first, so that a reload asked for while this one loads isn't missed
+        _catalogue_reload_version = catalogue_reloads.version()
+        _catalogue = ResourceCatalogue.from_database(connection)
+        return _catalogue
+
+
+def reload_every_resource_catalogue():
+    """Reload this worker's resource type catalogue, and have every other worker
+    reload theirs within reload_check_interval seconds."""
+    catalogue_reloads.mark()
+    return reload_resource_catalogue()
+
+
+def get_resource_type_catalogue(resource_type_id, connection=None):
+    """Return the catalogue, first reloading it if it doesn't contain a resource
+    type, eg. because the resource type was added after it was loaded. Raises a
+    KeyError if the resource type doesn't exist."""
+    catalogue = get_resource_catalogue(connection)
+    if resource_type_id not in catalogue:
+        catalogue = reload_resource_catalogue(connection)
+        catalogue._check_id(resource_type_id)
+    return catalogue
@@ -0,0 +1,262 @@
+import gc
+import logging
+import math
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import WorldEntity
+
+logger = logging.getLogger(__name__)
+
+
+class SpatialIndex:
+    """An in-memory index of the positions of world entities, for finding the
+    entities near a point or inside a box. Each dome has its own uniform grid of
+    square cells, and each cell holds the entities inside it along with their
+    positions, so a query only has to look at the cells that it overlaps."""
+
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        # Each position tuple is shared between both of these to save memory
+        self.domes = {}  # Dome ID -> {(cell_x, cell_y): {entity ID: (dome ID, x, y)}}
+        self.positions = {}  # Entity ID -> (dome ID, x, y)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls, cell_size=32):
+        """Build the index from the world_entity table."""
+        spatial_index = cls(cell_size)
+        rows = db.session.query(
+            WorldEntity.id, WorldEntity.location_dome_id, WorldEntity.location_x, WorldEntity.location_y
+        )
+        spatial_index.bulk_load(rows.yield_per(10000))
+        return spatial_index
+
+    def bulk_load(self, rows):
+        """Add many (entity ID, dome ID, x, y) rows to the index at once."""
+        with self._lock:
+            for entity_id, dome_id, x, y in rows:
+                self._insert(entity_id, dome_id, x, y)
+        # The index is made of millions of small objects that live as long as it
+        # does, so they're moved out of the garbage collector's way once loaded.
+        # Collection isn't paused while loading, as that would pause it for every
+        # request thread too.
+        gc.freeze()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.positions
+
+    def _cell(self, x, y):
+        return (x // self.cell_size, y // self.cell_size)
+
+    def _insert(self, entity_id, dome_id, x, y):
+        position = (dome_id, x, y)
+        cells = self.domes.setdefault(dome_id, {})
+        cells.setdefault(self._cell(x, y), {})[entity_id] = position
+        self.positions[entity_id] = position
+
+    def _remove(self, entity_id):
+        dome_id, x, y = self.positions.pop(entity_id)
+        cells = self.domes[dome_id]
+        cell = self._cell(x, y)
+        del cells[cell][entity_id]
+        if not cells[cell]:
+            del cells[cell]
+
+    def move(self, entity_id, dome_id, x, y):
+        """Add an entity to the index, or update its position if it's already there."""
+        with self._lock:
+            if entity_id in self.positions:
+                old_dome_id, old_x, old_y = self.positions[entity_id]
+                if old_dome_id == dome_id and self._cell(old_x, old_y) == self._cell(x, y):
+                    # Still in the same cell, so only the stored position needs to change
+                    position = (dome_id, x, y)
+                    self.domes[dome_id][self._cell(x, y)][entity_id] = position
+                    self.positions[entity_id] = position
+                    return
+                self._remove(entity_id)
+            self._insert(entity_id, dome_id, x, y)
+
+    def remove(self, entity_id):
+        """Remove an entity from the index, if it's there."""
+        with self._lock:
+            if entity_id in self.positions:
+                self._remove(entity_id)
+
+    def _overlapping_cells(self, dome_id, min_x, min_y, max_x, max_y):
+        """Yield the non-empty cells of a dome that overlap a box."""
+        cells = self.domes.get(dome_id)
+        if not cells:
+            return
+        min_cell_x, min_cell_y = self._cell(min_x, min_y)
+        max_cell_x, max_cell_y = self._cell(max_x, max_y)
+        if (max_cell_x - min_cell_x + 1) * (max_cell_y - min_cell_y + 1) > len(cells):
+            # The box covers more cells than are occupied, so check the occupied ones instead
+            for (cell_x, cell_y), cell in cells.items():
+                if min_cell_x <= cell_x <= max_cell_x and min_cell_y <= cell_y <= max_cell_y:
+                    yield cell
+            return
+        for cell_x in range(min_cell_x, max_cell_x + 1):
+            for cell_y in range(min_cell_y, max_cell_y + 1):
+                cell = cells.get((cell_x, cell_y))
+                if cell:
+                    yield cell
+
+    def within_box(self, dome_id, min_x, min_y, max_x, max_y):
+        """Return (entity ID, x, y) for every entity in a dome inside a box, edges included."""
+        with self._lock:
+            return [
+                (entity_id, x, y)
+                for cell in self._overlapping_cells(dome_id, min_x, min_y, max_x, max_y)
+                for entity_id, (_, x, y) in cell.items()
+                if min_x <= x <= max_x and min_y <= y <= max_y
+            ]
+
+    def within_radius(self, dome_id, x, y, radius):
+        """Return (entity ID, x, y) for every entity in a dome no further than
+        radius away from a point."""
+        radius_squared = radius * radius
+        min_x, min_y = math.floor(x - radius), math.floor(y - radius)
+        max_x, max_y = math.ceil(x + radius), math.ceil(y + radius)
+        with self._lock:
+            return [
+                (entity_id, entity_x, entity_y)
+                for cell in self._overlapping_cells(dome_id, min_x, min_y, max_x, max_y)
+                for entity_id, (_, entity_x, entity_y) in cell.items()
+                if (entity_x - x) ** 2 + (entity_y - y) ** 2 <= radius_squared
+            ]
+
+
+# Each worker keeps its own spatial index. Entities added, moved or deleted through
+# the ORM in this worker update it once they're committed; changes made by other
+# workers or directly in the database are picked up when it's rebuilt after
+# spatial_index_ttl.
+# Rebuilds run in a background thread, and the old index is served until the new
+# one is ready, so that no request waits for a rebuild other than the first.
+spatial_index_ttl = 60  # Seconds
+_spatial_index = None
+_spatial_index_load_time = 0
+_spatial_index_lock = threading.Lock()
+_first_load_lock = threading.Lock()
+_rebuild_thread = None
+# While the index is being rebuilt, the changes made to the old one, as (entity
+# ID, (dome ID, x, y) or None if removed), to be made to the new one too
+_pending_changes = None
+
+
+def load_spatial_index():
+    """Build a new spatial index from the database, and start serving it."""
+    global _spatial_index, _spatial_index_load_time, _pending_changes
+    with _spatial_index_lock:
+        _pending_changes = []
+    load_time = time.monotonic()
+    spatial_index = SpatialIndex.from_database()
+    with _spatial_index_lock:
+        for entity_id, position in _pending_changes:
+            apply_change(spatial_index, entity_id, position)
+        _pending_changes = None
+        _spatial_index = spatial_index
+        _spatial_index_load_time = load_time
+    return spatial_index
+
+
+def rebuild_spatial_index():
+    try:
+        load_spatial_index()
+    except Exception:
+        logger.exception("Failed to rebuild the spatial index")
+    finally:
+        db.session.remove()
+
+
+def get_spatial_index():
+    """Return the world entity spatial index, building it from the database if
+    there isn't one yet, and starting a rebuild if it's out of date."""
+    global _rebuild_thread
+    with _spatial_index_lock:
+        spatial_index = _spatial_index
+        is_out_of_date = time.monotonic() - _spatial_index_load_time > spatial_index_ttl
+        is_rebuilding = _rebuild_thread is not None and _rebuild_thread.is_alive()
+        if spatial_index is not None and is_out_of_date and not is_rebuilding:
+            _rebuild_thread = threading.Thread(target=rebuild_spatial_index, name="spatial index", daemon=True)
+            _rebuild_thread.start()
+    if spatial_index is not None:
+        return spatial_index
+    # Only one thread builds the first index, and the others wait for it
+    with _first_load_lock:
+        return _spatial_index or load_spatial_index()
+
+
+def apply_change(spatial_index, entity_id, position):
+    if position is None:
+        spatial_index.remove(entity_id)
+    else:
+        spatial_index.move(entity_id, *position)
+
+
+def record_change(entity_id, position):
+    with _spatial_index_lock:
+        spatial_index = _spatial_index
+        if _pending_changes is not None:
+            _pending_changes.append((entity_id, position))
+    if spatial_index is not None:
+        apply_change(spatial_index, entity_id, position)
+
+
+def record_session_change(world_entity, position):
+    session = object_session(world_entity)
+    if session is not None:
+        session.info.setdefault("world_entity_changes", []).append((world_entity.id, position))
+
+
+@event.listens_for(WorldEntity, "after_insert")
+@event.listens_for(WorldEntity, "after_update")
+def update_spatial_index(mapper, connection, world_entity):
+    position = (world_entity.location_dome_id, world_entity.location_x, world_entity.location_y)
+    record_session_change(world_entity, position)
+
+
+@event.listens_for(WorldEntity, "after_delete")
+def remove_from_spatial_index(mapper, connection, world_entity):
+    record_session_change(world_entity, None)
+
+
+# Changes are held in the session until they're committed, so that other threads
+# never see them before then, and they're never made if they're rolled back. The
+# number of changes made before each open savepoint is kept, so that rolling back
+# to a savepoint only forgets the changes made since.
+@event.listens_for(db.session, "after_transaction_create")
+def start_savepoint(session, transaction):
+    if transaction.nested:
+        change_count = len(session.info.get("world_entity_changes", ()))
+        session.info.setdefault("world_entity_savepoints", []).append(change_count)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_rolled_back_changes(session):
+    changes = session.info.get("world_entity_changes")
+    if changes and session.transaction.nested:
+        del changes[session.info["world_entity_savepoints"][-1] :]
+    elif changes:
+        changes.clear()
+
+
+@event.listens_for(db.session, "after_commit")
+def apply_committed_changes(session):
+    # Releasing a savepoint doesn't commit anything yet
+    if not session.transaction.nested:
+        for entity_id, position in session.info.pop("world_entity_changes", ()):
+            record_change(entity_id, position)
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def end_savepoint(session, transaction):
+    if transaction.nested:
+        session.info["world_entity_savepoints"].pop()
+    elif transaction.parent is None:
+        session.info.pop("world_entity_changes", None)
@@ -0,0 +1,64 @@
+import time
+from datetime import datetime
+from app import db
+from app.models import AccessToken
+
+
+class TokenSweeper:
+    """Deletes expired access tokens. Tokens are deleted in batches of at most
+    batch_size rows, each in its own short transaction, with a pause between
+    batches so that the sweep never holds locks on the access_token table for
+    long or starves logins of database time."""
+
+    def __init__(self, batch_size=1000, batch_pause=0.1):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause  # Seconds
+        # Statistics
+        self.sweeps = 0
+        self.rows_swept = 0
+        self.last_sweep_rows = 0
+        self.last_sweep_seconds = 0
+        self.max_sweep_seconds = 0
+
+    def sweep_batch(self, now):
+        """Delete up to batch_size tokens that expired before now, and return how many were deleted."""
+        # Finding the IDs first means the delete only locks rows that will be deleted
+        token_ids = [
+            token_id
+            for token_id, in db.session.query(AccessToken.id)
+            .filter(AccessToken.expires_at < now)
+            .order_by(AccessToken.expires_at)
+            .limit(self.batch_size)
+        ]
+        if token_ids:
+            AccessToken.query.filter(AccessToken.id.in_(token_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return len(token_ids)
+
+    def sweep(self):
+        """Delete every token that has expired, and return how many were deleted."""
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        rows = 0
+        while True:
+            batch_rows = self.sweep_batch(now)
+            rows += batch_rows
+            if batch_rows < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        sweep_seconds = time.perf_counter() - start
+        self.sweeps += 1
+        self.rows_swept += rows
+        self.last_sweep_rows = rows
+        self.last_sweep_seconds = sweep_seconds
+        self.max_sweep_seconds = max(self.max_sweep_seconds, sweep_seconds)
+        return rows
+
+    def stats(self):
+        return {
+            "sweeps": self.sweeps,
+            "rows_swept": self.rows_swept,
+            "last_sweep_rows": self.last_sweep_rows,
+            "last_sweep_seconds": self.last_sweep_seconds,
+            "max_sweep_seconds": self.max_sweep_seconds,
+        }
@@ -0,0 +1,90 @@
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation, ROUND_DOWN
+from sqlalchemy import bindparam
+from app import db, exceptions
+from app.models import FinancialTransaction, TransactionEvent, Wallet
+
+# The largest value a wallet or a single transfer can hold, from the DECIMAL(14, 2) columns
+max_value = Decimal("999999999999.99")
+cent = Decimal("0.01")
+
+Transfer = namedtuple("Transfer", ["sending_wallet_id", "receiving_wallet_id", "value"])
+
+
+def parse_value(value):
+    """Convert a money value from a request body to a Decimal, ensuring that it's
+    a positive number of whole cents."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise exceptions.MalformedFieldError("Transfer values must be numbers or numeric strings.")
+    try:
+        # Floats go through str() so that eg. 0.1 becomes Decimal("0.1") and not 0.1000000000000000055...
+        value = Decimal(str(value))
+    except InvalidOperation:
+        raise exceptions.MalformedFieldError("Transfer values must be numbers or numeric strings.")
+    if not value.is_finite() or not 0 < value <= max_value:
+        raise exceptions.MalformedFieldError(f"Transfer values must be greater than 0 and at most {max_value}.")
+    if value != value.quantize(cent, rounding=ROUND_DOWN):
+        raise exceptions.MalformedFieldError("Transfer values must be a whole number of cents.")
+    return value.quantize(cent)
+
+
+def apply_transfers(transfers):
+    """Move money between wallets, all in one database transaction. Either every
+    transfer is applied or, if any one of them can't be, none of them are. The
+    transfers are recorded as the financial transactions of a single new
+    transaction event, which is returned along with the new wallet values.
+
+    The wallets stay locked until the caller commits the session. If a transfer
+    can't be applied, the session is rolled back before the error is raised."""
+    wallet_ids = set()
+    for transfer in transfers:
+        wallet_ids.update((transfer.sending_wallet_id, transfer.receiving_wallet_id))
+    wallet_ids = sorted(wallet_ids)
+    try:
+        # Lock every wallet involved until the transaction ends. The rows are always
+        # locked in order of ID, so two batches sharing wallets can't deadlock.
+        query = db.session.query(Wallet.id, Wallet.value).filter(Wallet.id.in_(wallet_ids)).order_by(Wallet.id)
+        balances = dict(query.with_for_update())
+        if len(balances) != len(wallet_ids):
+            raise exceptions.ResourceNotFoundError("A wallet with one of the specified IDs was not found.")
+
+        # Apply the transfers in order, so that a wallet can pass on money it
+        # received earlier in the same batch, but never drops below zero.
+        for i, transfer in enumerate(transfers):
+            if balances[transfer.sending_wallet_id] < transfer.value:
+                raise exceptions.InsufficientFundsError(
+                    f"Wallet #{transfer.sending_wallet_id} doesn't hold enough money for transfer {i}."
+                )
+            if balances[transfer.receiving_wallet_id] + transfer.value > max_value:
+                raise exceptions.MalformedFieldError(
+                    f"Transfer {i} would take wallet #{transfer.receiving_wallet_id} over the maximum value."
+                )
+            balances[transfer.sending_wallet_id] -= transfer.value
+            balances[transfer.receiving_wallet_id] += transfer.value
+
+        # Write everything with one statement per table, executed as a batch
+        transaction_event = TransactionEvent()
+        db.session.add(transaction_event)
+        db.session.flush()
+        wallet_update = (
+            Wallet.__table__.update().where(Wallet.id == bindparam("wallet_id")).values(value=bindparam("new_value"))
+        )
+        db.session.execute(
+            wallet_update, [{"wallet_id": wallet_id, "new_value": value} for wallet_id, value in balances.items()]
+        )
+        db.session.execute(
+            FinancialTransaction.__table__.insert(),
+            [
+                {
+                    "value": transfer.value,
+                    "sending_wallet_id": transfer.sending_wallet_id,
+                    "receiving_wallet_id": transfer.receiving_wallet_id,
+                    "transaction_event_id": transaction_event.id,
+                }
+                for transfer in transfers
+            ],
+        )
+    except Exception:
+        db.session.rollback()
+        raise
+    return transaction_event, balances
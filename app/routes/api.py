@@ -1,15 +1,114 @@
+import hashlib
+import math
 import sqlalchemy
-import mmh3
-from datetime import timedelta
-from flask import jsonify, request, Blueprint
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from flask import current_app, g, json, jsonify, request, Blueprint, Response, stream_with_context
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import contains_eager, joinedload, object_session, subqueryload
 from app import db
 from app.models import *
 from app import exceptions
-from app.modules.profile_image import generate_profile_image, ProfileImage
+from app.modules.profile_image import generate_profile_image, generate_profile_images, ProfileImage
+from app.modules.profile_image import rendering
+from app.modules import access_tokens, bulk_inserts, passwords, transfers
+from app.modules.cache import LRUCache
+from app.modules.event_writer import BufferedEventWriter
+from app.modules.bloom_filter import KnownEmailFilter
+from app.modules.change_marker import ChangeLog
+from app.modules.pool_monitor import pool_monitor
+from app.modules.request_metrics import RequestMetrics, format_prometheus
+from app.modules.request_profiler import RequestProfiler
+from app.modules import resource_catalogue
+from app.modules.dome_graph import dome_changes, get_dome_graph, get_loaded_dome_graph
+from app.modules.spatial_index import get_spatial_index
 
 
 api = Blueprint("api", __name__)
 
+# The largest number of profile images that can be generated by a single request
+max_generated_profile_images = 100
+# The largest number of profile pictures that can be rendered into a single sprite sheet
+max_sprite_sheet_pictures = 100
+# The largest number of profiles that can be created by a single request
+max_profile_batch_size = 1000
+# The largest number of wallet transfers that can be made by a single request
+max_transfer_batch_size = 1000
+# The largest number of tunnels that can be followed out of a dome in a neighbourhood query
+max_neighbourhood_hops = 16
+# Listings are returned a page at a time, unless they're streamed
+default_page_size = 100
+max_page_size = 1000
+# Streamed listings are fetched from the database this many rows at a time
+stream_batch_size = 500
+
+
+@api.record
+def configure_instrumentation(state):
+    request_metrics.directory = state.app.config["REQUEST_METRICS_DIRECTORY"]
+    request_profiler.directory = state.app.config["REQUEST_PROFILE_DIRECTORY"]
+    request_profiler.max_reports = state.app.config["REQUEST_PROFILE_MAX_REPORTS"]
+    request_profiler.sample_rate = state.app.config["REQUEST_PROFILE_SAMPLE_RATE"]
+    sign_ups.file_name = state.app.config["SIGN_UP_LOG_FILE"]
+    token_revocations.file_name = state.app.config["TOKEN_REVOCATION_LOG_FILE"]
+    resource_catalogue.catalogue_reloads.file_name = state.app.config["RESOURCE_CATALOGUE_VERSION_FILE"]
+    dome_changes.file_name = state.app.config["DOME_GRAPH_VERSION_FILE"]
+
+
+def is_profile_requested():
+    """Test whether a developer has asked for the current request to be profiled,
+    with an 'X-Doctrine-Profile: 1' header. If the request can't be profiled, the
+    reason is sent back in an 'X-Doctrine-Profile-Error' header."""
+    if request.headers.get("X-Doctrine-Profile") != "1":
+        return False
+    try:
+        token = get_current_access_token()
+    except exceptions.BaseError as error:
+        g.profile_error = error.message
+        return False
+    if token is None or not token.is_developer:
+        g.profile_error = "Only developers can have requests profiled."
+        return False
+    return True
+
+
+@api.before_request
+def start_recording_request():
+    request_metrics.start_request()
+    if is_profile_requested():
+        request_profiler.start()
+    elif request_profiler.should_sample():
+        request_profiler.start(sampled=True)
+
+
+@api.after_request
+def record_request(response):
+    request_metrics.set_response_bytes(response.content_length)
+    if request_profiler.is_profiling():
+        request_profiler.add_details(status=response.status_code, streamed=response.is_streamed)
+        # Only developers who asked for a profile are told where to find it
+        if not request_profiler.is_sampled():
+            response.headers["X-Doctrine-Profile-Report"] = request_profiler.get_report_id()
+    if "profile_error" in g:
+        response.headers["X-Doctrine-Profile-Error"] = g.profile_error
+    return response
+
+
+@api.teardown_request
+def finish_recording_request(error):
+    # Requests are only finished here, as after_request functions aren't called
+    # for requests that fail with an unhandled exception. Streamed responses
+    # (see stream_with_context) keep the request open until they've been sent,
+    # so their metrics and profiles include generating the response.
+    request_metrics.finish_request(request.endpoint)
+    if request_profiler.is_profiling():
+        request_profiler.add_details(method=request.method, path=request.full_path, endpoint=request.endpoint)
+        if error is not None:
+            request_profiler.add_details(status=500, error=repr(error))
+        request_profiler.write_report(request_profiler.stop())
+
 
 def assert_request_body():
     """Ensure the request has body data."""
@@ -35,6 +134,19 @@ def get_body_fields(*field_names):
     return {name: get_body_field(name) for name in field_names}
 
 
+def get_query_parameter(parameter_name, parameter_type=str, default=None):
+    """Return a query string parameter, or the default if it wasn't supplied."""
+    parameter = request.args.get(parameter_name)
+    if parameter is None:
+        return default
+    try:
+        return parameter_type(parameter)
+    except ValueError:
+        raise exceptions.MalformedParameterError(
+            f"The '{parameter_name}' parameter must be of type '{parameter_type.__name__}'."
+        )
+
+
 def get_or_create_record(model, **kwargs):
     """Fetch a database record, creating it first if it doesn't exist."""
     instance = db.session.query(model).filter_by(**kwargs).first()
@@ -47,37 +159,339 @@ def get_or_create_record(model, **kwargs):
         return instance
 
 
-def get_current_account():
-    """Returns the account associated with the current request."""
+# Access tokens that have been looked up recently, so that authorising a request
+# doesn't need to touch the database. Each worker has its own cache, keyed by the
+# hash of each token. Revoking a token appends its hash to token_revocations,
+# which is shared between workers, and every worker removes the tokens revoked
+# since it last looked from its cache before using it, so a revocation only sends
+# that one token back to the database. Tokens deleted without being revoked (eg.
+# directly in the database) stay usable for up to token_cache_ttl.
+CachedAccessToken = namedtuple("CachedAccessToken", ["account_id", "is_developer", "expiry_time", "cache_expiry_time"])
+token_cache = LRUCache(max_size=10000)
+token_cache_ttl = timedelta(seconds=60)
+token_revocations = ChangeLog()
+# When each recently revoked token was removed from the cache, so that a lookup
+# made before the revocation was committed can't put it back
+recently_revoked_tokens = LRUCache(max_size=10000)
+_token_revocations_position = None
+_token_cache_lock = threading.Lock()
+
+# Hashes of every email address, for turning away sign-ins to unknown email
+# addresses. The hashes of email addresses added or changed by a commit are
+# appended to sign_ups, which is shared between workers, so that every worker
+# can add them to its filter without rebuilding it.
+sign_ups = ChangeLog()
+
+
+def load_email_hashes():
+    with db.engine.connect() as connection:
+        return [email_hash for email_hash, in connection.execute(select([EmailAddress.hash]))]
+
+
+known_emails = KnownEmailFilter(load_email_hashes, sign_ups)
+
+
+@event.listens_for(EmailAddress, "after_insert")
+@event.listens_for(EmailAddress, "after_update")
+def record_email_address_hash(mapper, connection, email_address):
+    session = object_session(email_address)
+    if session is not None:
+        session.info.setdefault("email_address_hashes", set()).add(bytes(email_address.hash).hex())
+
+
+@event.listens_for(db.session, "after_commit")
+def log_sign_ups(session):
+    # Logged once the rows are visible to other workers, and never discarded on
+    # rollback, as a savepoint can be rolled back while they're still pending
+    email_hashes = session.info.pop("email_address_hashes", None)
+    if email_hashes:
+        sign_ups.append(sorted(email_hashes))
+
+# Sign-ins are logged from a background thread, off the /login request path
+sign_in_event_writer = BufferedEventWriter(AccountSignInEvent.__table__, lambda: db.engine)
+
+# The latency, SQL statement count, database time, and response size of every
+# request, totalled by endpoint and shared between workers, see /api/metrics
+request_metrics = RequestMetrics()
+request_metrics.listen(Engine)
+
+# Requests run under cProfile when a developer asks, or at random, see /api/request_profiles/
+request_profiler = RequestProfiler()
+request_profiler.listen(Engine)
+
+# Serialised account and profile responses, keyed by their ETags. Created when
+# first used, as it's sized from the app config.
+response_cache = None
+
+
+def get_token_key(token_string):
+    """Return the key that a token is cached and revoked under. Only the hashes of
+    tokens are shared between workers, rather than the tokens themselves."""
+    return hashlib.sha256(token_string.encode("utf-8")).hexdigest()
+
+
+def remove_revoked_tokens():
+    """Remove the tokens revoked by any worker since the last call from this
+    worker's token cache. Only stats the shared file if none have been."""
+    global _token_revocations_position
+    with _token_cache_lock:
+        position, revoked_keys = token_revocations.read(_token_revocations_position)
+        _token_revocations_position = position
+        if revoked_keys is None:
+            # Some revocations can't be known, eg. because the log was started afresh
+            token_cache.clear()
+            return
+        for key in revoked_keys:
+            token_cache.delete(key)
+            recently_revoked_tokens.set(key, datetime.utcnow())
+
+
+def cache_access_token(token_string, account_id, is_developer, expiry_time):
+    """Cache a token, unless it has been revoked since it was looked up."""
+    now = datetime.utcnow()
+    key = get_token_key(token_string)
+    cached_token = CachedAccessToken(account_id, is_developer, expiry_time, min(expiry_time, now + token_cache_ttl))
+    with _token_cache_lock:
+        revoked_time = recently_revoked_tokens.get(key)
+        if revoked_time is None or now - revoked_time > token_cache_ttl:
+            token_cache.set(key, cached_token)
+    return cached_token
+
+
+def resolve_access_token(token_string):
+    """Return the account ID, developer status, and expiry time of an access
+    token as a CachedAccessToken, or None if the token doesn't exist."""
+    # If tokens are signed, bogus tokens can be turned away without a lookup
+    signing_key = access_tokens.get_signing_key()
+    if signing_key is not None and not access_tokens.has_valid_signature(token_string, signing_key):
+        return None
+    remove_revoked_tokens()
+    key = get_token_key(token_string)
+    cached_token = token_cache.get(key)
+    if cached_token is not None and datetime.utcnow() <= cached_token.cache_expiry_time:
+        return cached_token
+    # Fetch the token and its account in a single query
+    token_info = (
+        db.session.query(AccessToken.account_id, Account.is_developer, AccessToken.expires_at)
+        .join(Account, AccessToken.account_id == Account.id)
+        .filter(AccessToken.token == token_string)
+        .one_or_none()
+    )
+    if token_info is None:
+        token_cache.delete(key)
+        return None
+    return cache_access_token(token_string, *token_info)
+
+
+def create_access_token(account, duration, attempts=3):
+    """Create and flush a new access token for an account, ready to be committed.
+    Token uniqueness is enforced by the database, so in the vanishingly unlikely
+    case of a collision, the transaction is rolled back and the token is generated
+    again. It's inserted without a savepoint, so nothing else can be pending in
+    the session, as it would be rolled back too."""
+    for _ in range(attempts):
+        token = AccessToken(account=account, duration=duration)
+        db.session.add(token)
+        try:
+            db.session.flush()
+        except sqlalchemy.exc.IntegrityError:
+            db.session.rollback()
+            continue
+        return token
+    raise exceptions.ServerError("Failed to generate a unique access token.")
+
+
+def revoke_access_token(token_string):
+    """Delete an access token, so that it can no longer be used. Other workers
+    may keep accepting it until it's appended to token_revocations after the commit."""
+    token_cache.delete(get_token_key(token_string))
+    AccessToken.query.filter_by(token=token_string).delete()
+
+
+def query_accounts(profile_loader=joinedload):
+    """Query accounts, eagerly loading everything that Account._asdict serialises.
+    When loading many accounts, use subqueryload so that the profiles of every
+    account are fetched in one extra query instead of duplicating account rows."""
+    return Account.query.options(
+        joinedload(Account.email_address),
+        profile_loader(Account.profiles).joinedload(Profile.entity).joinedload(Entity.wallet),
+    )
+
+
+def query_profiles():
+    """Query profiles, eagerly loading everything that Profile._asdict serialises."""
+    return Profile.query.options(
+        joinedload(Profile.entity).joinedload(Entity.wallet),
+        joinedload(Profile.account).joinedload(Account.email_address),
+    )
+
+
+def get_page(query, id_column, limit, after=0):
+    """Return up to limit rows with IDs greater than after, in ID order. Paging by
+    the last seen ID (keyset pagination) stays fast however deep the page is."""
+    return query.filter(id_column > after).order_by(id_column).limit(limit).all()
+
+
+def list_resources(resource_name, query, id_column, serialise):
+    """Respond with a page of a resource listing, chosen with the 'limit' and
+    'after' parameters. If the 'stream' parameter is 'ndjson', the whole listing
+    is instead streamed as newline-delimited JSON, one resource per line, so that
+    memory use doesn't grow with the number of rows."""
+    after = get_query_parameter("after", int, default=0)
+    if get_query_parameter("stream") == "ndjson":
+
+        def generate_lines():
+            nonlocal after
+            while True:
+                page = get_page(query, id_column, stream_batch_size, after)
+                for resource in page:
+                    yield json.dumps(serialise(resource)) + "\n"
+                if len(page) < stream_batch_size:
+                    return
+                after = page[-1].id
+
+        return Response(stream_with_context(generate_lines()), mimetype="application/x-ndjson")
+
+    limit = get_query_parameter("limit", int, default=default_page_size)
+    if not 1 <= limit <= max_page_size:
+        raise exceptions.MalformedParameterError(
+            f"The 'limit' parameter must be between 1 and {max_page_size} (inclusive)."
+        )
+    page = get_page(query, id_column, limit, after)
+    listing = {
+        resource_name: [serialise(resource) for resource in page],
+        # The value to pass as 'after' to get the next page, if there is one
+        "next": page[-1].id if len(page) == limit else None,
+    }
+    # Counting every row is slow on large tables, so it's only done on request
+    if get_query_parameter("include_count") == "true":
+        listing["count"] = query.order_by(None).count()
+    return jsonify(listing)
+
+
+def make_version_etag(resource_name, resource_id, versions):
+    """Return a strong ETag for a resource, from the IDs and version counters of
+    every row that it's serialised from. Any change to one of the rows changes
+    the ETag, so responses can be validated without loading or serialising them."""
+    return hashlib.sha1(repr((resource_name, resource_id, versions)).encode("utf-8")).hexdigest()
+
+
+def get_account_etag(account_id):
+    """Return the ETag of an account, or None if it doesn't exist."""
+    versions = (
+        db.session.query(Account.version, EmailAddress.version, Profile.id, Profile.version, Wallet.id, Wallet.version)
+        .join(Account.email_address)
+        .outerjoin(Account.profiles)
+        .outerjoin(Profile.entity)
+        .outerjoin(Entity.wallet)
+        .filter(Account.id == account_id)
+        .order_by(Profile.id)
+        .all()
+    )
+    if not versions:
+        return None
+    return make_version_etag("account", account_id, [tuple(row) for row in versions])
+
+
+def get_profile_etag(profile_id):
+    """Return the ID of the account that owns a profile and the profile's ETag,
+    or (None, None) if it doesn't exist."""
+    versions = (
+        db.session.query(
+            Profile.account_id, Profile.version, Account.version, EmailAddress.version, Wallet.id, Wallet.version
+        )
+        .join(Profile.account)
+        .join(Account.email_address)
+        .join(Profile.entity)
+        .join(Entity.wallet)
+        .filter(Profile.id == profile_id)
+        .one_or_none()
+    )
+    if versions is None:
+        return None, None
+    return versions.account_id, make_version_etag("profile", profile_id, tuple(versions))
+
+
+def get_response_cache():
+    """Return the shared response cache, or None if it's disabled."""
+    global response_cache
+    if response_cache is None:
+        max_size = current_app.config["RESPONSE_CACHE_SIZE"]
+        if not max_size:
+            return None
+        response_cache = LRUCache(max_size=max_size, size_function=len)
+    return response_cache
+
+
+def make_versioned_response(etag, serialise):
+    """Return a JSON response with a strong ETag. Conditional requests for an
+    unchanged resource are answered with a 304 without loading or serialising
+    anything, and other requests are answered from the response cache if
+    possible. Cached responses don't need to be invalidated: once one of their
+    rows changes, their ETag is never looked up again, and they age out.
+
+    The ETag must be computed in the same transaction that serialise() loads
+    the resource in, so that both see the same version of every row."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        cache = get_response_cache()
+        body = cache.get(etag) if cache is not None else None
+        if body is None:
+            body = jsonify(serialise()).get_data()
+            if cache is not None:
+                cache.set(etag, body)
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Responses may only be reused by the client that requested them, and only
+    # after checking with the server that they're still current
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def get_access_token_string():
+    """Returns the access token string sent with the current request."""
     authorization = request.headers.get("Authorization")
     if authorization is None:
         raise exceptions.MissingHeaderError("Authorization")
     if not authorization.startswith("Bearer "):
         raise exceptions.MalformedHeaderError("Authorization header content must start with 'Bearer '.")
-    token_string = authorization[len("Bearer ") :]
+    return authorization[len("Bearer ") :]
+
+
+def get_current_access_token():
+    """Returns the access token sent with the current request, as a CachedAccessToken."""
     # Check if the access token exists and is not expired
-    try:
-        token = AccessToken.query.filter_by(token=token_string).one()
-    except sqlalchemy.orm.exc.NoResultFound:
+    token = resolve_access_token(get_access_token_string())
+    if token is None:
         return None
-    if token.is_expired():
+    if datetime.utcnow() > token.expiry_time:
         raise exceptions.ExpiredTokenError
-    return token.account
+    return token
+
+
+def get_current_account():
+    """Returns the account associated with the current request."""
+    token = get_current_access_token()
+    if token is None:
+        return None
+    return Account.query.get(token.account_id)
 
 
 def restrict_access(authorized_account_id=None, error_message=None):
     """Restrict access to only developers and the specified account."""
     try:
-        current_account = get_current_account()
+        current_token = get_current_access_token()
     except exceptions.MissingHeaderError:
         raise exceptions.NoAuthorizationSuppliedError
-    if current_account is None:
+    if current_token is None:
         raise exceptions.UnauthorizedAccessError(error_message)
-    if current_account.is_developer:
+    if current_token.is_developer:
         return
     if authorized_account_id is None:
         raise exceptions.UnauthorizedAccessError(error_message)
-    if current_account.id == authorized_account_id:
+    if current_token.account_id == authorized_account_id:
         return
     raise exceptions.UnauthorizedAccessError(error_message)
 
@@ -89,47 +503,142 @@ def index():
 
 @api.route("/generators/profile_image")
 def generate_random_profile_image():
-    """Get a randomly generated profile image as a Base64-encoded string."""
-    return jsonify({"image": generate_profile_image().to_base64_string()})
+    """Get a randomly generated profile image as a Base64-encoded string. If the
+    'count' parameter is given, a list of that many images is returned instead."""
+    count = get_query_parameter("count", int)
+    seed = get_query_parameter("seed", int)
+    if count is None:
+        return jsonify({"image": generate_profile_image().to_base64_string()})
+    if not 1 <= count <= max_generated_profile_images:
+        raise exceptions.MalformedParameterError(
+            f"The 'count' parameter must be between 1 and {max_generated_profile_images} (inclusive)."
+        )
+    if seed is not None and seed < 0:
+        raise exceptions.MalformedParameterError("The 'seed' parameter must not be negative.")
+    images = generate_profile_images(count, seed)
+    return jsonify({"images": [image.to_base64_string() for image in images]})
 
 
 @api.route("/login", methods=["POST"])
 def login():
     # Find the account matching the given email address
     password = get_body_field("password")
-    email_address = get_body_field("email_address")
-    email_hash = mmh3.hash128(email_address)
-    email_hash = email_hash.to_bytes(16, byteorder="big")
-    try:
-        email_address = EmailAddress.query.filter_by(hash=email_hash).one()
-        account = Account.query.filter_by(email_address=email_address).one()
-    except sqlalchemy.orm.exc.NoResultFound:
+    email_hash = hash_email_address(get_body_field("email_address"))
+    # Turn away email addresses that certainly don't exist without touching the database
+    if not known_emails.might_exist(email_hash):
+        raise exceptions.InvalidCredentialsError
+    # Fetch the account, its email address, and everything it serialises in a single query
+    account = (
+        query_accounts()
+        .join(Account.email_address)
+        .options(contains_eager(Account.email_address))
+        .filter(EmailAddress.hash == email_hash)
+        .one_or_none()
+    )
+    if account is None:
         raise exceptions.InvalidCredentialsError
     # Test that the password matches the hashed account password
-    if not bcrypt.checkpw(password.encode("utf-8"), account.password_hash):
+    if not passwords.check_password(password, account.password_hash):
         raise exceptions.InvalidCredentialsError
-    # Generate and return an access token
-    token = AccessToken(account=account, duration=timedelta(hours=24))
-    db.session.add(token)
+    # Generate and return an access token. Everything is serialised before the
+    # token is committed, while it's all still loaded.
+    token = create_access_token(account, timedelta(hours=24))
+    cache_access_token(token.token, account.id, account.is_developer, token.expiry_time)
+    response = {"token": str(token), "account": account._asdict()}
+    db.session.commit()
+    sign_in_event_writer.write({"account_id": response["account"]["id"], "sign_in_time": datetime.utcnow()})
+    return jsonify(response)
+
+
+@api.route("/logout", methods=["POST"])
+def logout():
+    """Revoke the access token used to make the request."""
+    try:
+        token_string = get_access_token_string()
+    except exceptions.MissingHeaderError:
+        raise exceptions.NoAuthorizationSuppliedError
+    if resolve_access_token(token_string) is None:
+        raise exceptions.UnauthorizedAccessError
+    revoke_access_token(token_string)
     db.session.commit()
-    return jsonify({"token": str(token), "account": account,})
+    # Only once it's committed, so that other workers can't cache the token again
+    token_revocations.append([get_token_key(token_string)])
+    return "", 204
+
+
+@api.route("/caches")
+def get_cache_statistics():
+    """Get the hit and miss counters of this worker's caches, for sizing them."""
+    restrict_access()
+    cache_statistics = {
+        "access_tokens": token_cache.stats(),
+        "profile_pictures": rendering.png_cache.stats(),
+        "known_emails": known_emails.stats(),
+    }
+    # Only reported once the dome graph has been loaded, rather than loading it here
+    dome_graph = get_loaded_dome_graph()
+    if dome_graph is not None:
+        cache_statistics["dome_paths"] = dome_graph.path_cache.stats()
+    if get_response_cache() is not None:
+        cache_statistics["responses"] = get_response_cache().stats()
+    return jsonify(cache_statistics)
+
+
+@api.route("/event_writers")
+def get_event_writer_statistics():
+    """Get the queue depths and flush times of this worker's buffered event writers."""
+    restrict_access()
+    return jsonify({"account_sign_in_events": sign_in_event_writer.stats()})
+
+
+@api.route("/metrics")
+def get_metrics():
+    """Get the latency histogram, SQL statement count, database time, and response
+    size of requests to each endpoint, totalled across every worker, in the
+    Prometheus text format."""
+    restrict_access()
+    return Response(format_prometheus(request_metrics.collect()), content_type="text/plain; version=0.0.4")
+
+
+@api.route("/request_profiles/")
+def get_request_profiles():
+    """Get a summary of every stored request profile report, newest first."""
+    restrict_access()
+    return jsonify({"reports": request_profiler.list_reports()})
+
+
+@api.route("/request_profiles/<report_id>")
+def get_request_profile(report_id):
+    """Get a request profile report, with the SQL statements that the request
+    executed and the functions it spent the most time in."""
+    restrict_access()
+    report = request_profiler.get_report(report_id)
+    if report is None:
+        raise exceptions.ResourceNotFoundError("A request profile report with this ID was not found.")
+    return jsonify(report)
+
+
+@api.route("/database_pool")
+def get_database_pool_statistics():
+    """Get the connection counts and checkout wait times of this worker's database
+    connection pool, to tell whether slow requests are waiting for connections."""
+    restrict_access()
+    return jsonify(pool_monitor.stats())
 
 
 @api.route("/accounts/")
 def get_accounts_metadata():
     restrict_access()
-    accounts_info = {
-        "count": db.session.query(Account).count(),
-        "accounts": [account for account in Account.query.all()],
-    }
-    return jsonify(accounts_info)
+    query = query_accounts(profile_loader=subqueryload)
+    return list_resources("accounts", query, Account.id, Account._asdict)
 
 
 @api.route("/accounts/", methods=["POST"])
 def create_account():
     password = get_body_field("password")
     email_address = get_body_field("email_address")
-    email_address = get_or_create_record(EmailAddress, email_address=email_address)
+    email_hash = hash_email_address(email_address)
+    email_address = EmailAddress.query.filter_by(hash=email_hash).first() or EmailAddress(email_address)
     account = Account(email_address=email_address, password=password)
     db.session.add(account)
     try:
@@ -142,20 +651,16 @@ def create_account():
 @api.route("/accounts/<int:account_id>")
 def get_account(account_id):
     restrict_access(account_id)
-    account = Account.query.get(account_id)
-    if account is None:
+    etag = get_account_etag(account_id)
+    if etag is None:
         raise exceptions.ResourceNotFoundError("An account with this ID was not found.")
-    return jsonify(account)
+    return make_versioned_response(etag, lambda: query_accounts().get(account_id)._asdict())
 
 
 @api.route("/profiles/")
 def get_profiles_metadata():
     restrict_access()
-    profiles_info = {
-        "count": db.session.query(Profile).count(),
-        "profiles": [profile._asdict() for profile in Profile.query.all()],
-    }
-    return jsonify(profiles_info)
+    return list_resources("profiles", query_profiles(), Profile.id, Profile._asdict)
 
 
 @api.route("/profiles/", methods=["POST"])
@@ -166,36 +671,314 @@ def create_profile():
     try:
         picture_string = get_body_field("picture", field_type=str)
         picture = ProfileImage.from_base64_string(picture_string)
+    except ValueError:
+        raise exceptions.MalformedFieldError("The 'picture' field must be a Base64-encoded profile image.")
     except exceptions.MissingFieldError:
         # If no picture is provided, generate one
         picture = generate_profile_image()
-    picture_bytes = bytes(picture)
 
     account = Account.query.get(account_id)
     if account is None:
         raise exceptions.ResourceNotFoundError("An account with the specified ID was not found.")
-    if not Profile.query.filter_by(name=name).count() == 0:
-        raise exceptions.ResourceAlreadyExistsError("Another profile with the chosen name already exists.")
 
-    # Create the profile
-    entity = Entity()
-    db.session.add(entity)
-    profile = Profile(account=account, name=name, picture=picture_bytes, entity=entity)
+    # Create the profile, along with its entity and wallet, in a single transaction.
+    # Profile names are kept unique by the database.
+    profile = Profile(account=account, name=name, picture=picture, entity=Entity())
     db.session.add(profile)
+    try:
+        db.session.flush()
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+        raise exceptions.ResourceAlreadyExistsError("Another profile with the chosen name already exists.")
+    # Serialise the profile before committing, while all of its fields are still loaded
+    profile_info = profile._asdict()
     db.session.commit()
-    return jsonify(profile), 201
+    return jsonify(profile_info), 201
+
+
+@api.route("/profiles/batch", methods=["POST"])
+def create_profiles():
+    """Create many profiles at once, for onboarding tools and test fixtures. Takes a
+    'profiles' list in the same format as the body of POST /profiles/. Either every
+    profile is created, or none are."""
+    profile_fields = get_body_field("profiles", field_type=list)
+    if not 1 <= len(profile_fields) <= max_profile_batch_size:
+        raise exceptions.MalformedFieldError(
+            f"The 'profiles' field must contain between 1 and {max_profile_batch_size} profiles."
+        )
+    for fields in profile_fields:
+        if not isinstance(fields, dict):
+            raise exceptions.MalformedFieldError("Each item of the 'profiles' field must be an object.")
+        if not isinstance(fields.get("account_id"), int) or not isinstance(fields.get("name"), str):
+            raise exceptions.MalformedFieldError("Each profile must have an integer 'account_id' and a string 'name'.")
+
+    account_ids = {fields["account_id"] for fields in profile_fields}
+    for account_id in account_ids:
+        restrict_access(account_id, "Only the owner of an account can create a profile for that account.")
+    if db.session.query(Account.id).filter(Account.id.in_(account_ids)).count() != len(account_ids):
+        raise exceptions.ResourceNotFoundError("An account with one of the specified IDs was not found.")
+
+    # Generate pictures for every profile that doesn't have one, in a single batch
+    generated_pictures = generate_profile_images(sum("picture" not in fields for fields in profile_fields))
+    pictures = []
+    for fields in profile_fields:
+        if "picture" in fields:
+            try:
+                pictures.append(ProfileImage.from_base64_string(fields["picture"]))
+            except (ValueError, AttributeError):
+                raise exceptions.MalformedFieldError("The 'picture' field must be a Base64-encoded profile image.")
+        else:
+            pictures.append(generated_pictures.pop())
+
+    # Insert the wallets, then their entities, then the profiles, with one
+    # multi-row INSERT per table. Profile names are kept unique by the database.
+    creation_time = datetime.utcnow()
+    try:
+        wallet_ids = bulk_inserts.insert_rows(Wallet.__table__, [{"value": starting_wallet_value}] * len(pictures))
+        entity_ids = bulk_inserts.insert_rows(Entity.__table__, [{"wallet_id": wallet_id} for wallet_id in wallet_ids])
+        profile_rows = [
+            {
+                "name": fields["name"],
+                "picture": bytes(picture),
+                "account_id": fields["account_id"],
+                "entity_id": entity_id,
+                "creation_time": creation_time,
+            }
+            for fields, picture, entity_id in zip(profile_fields, pictures, entity_ids)
+        ]
+        profile_ids = bulk_inserts.insert_rows(Profile.__table__, profile_rows)
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+        raise exceptions.ResourceAlreadyExistsError("A profile with one of the chosen names already exists.")
+    profiles = {profile.id: profile for profile in query_profiles().filter(Profile.id.in_(profile_ids))}
+    profiles_info = {"profiles": [profiles[profile_id]._asdict(embed_account=False) for profile_id in profile_ids]}
+    db.session.commit()
+    return jsonify(profiles_info), 201
 
 
 @api.route("/profiles/<int:profile_id>")
 def get_profile(profile_id):
-    profile = Profile.query.get(profile_id)
+    account_id, etag = get_profile_etag(profile_id)
+    if etag is None:
+        # If the user isn't a developer, return an UnauthorizedAccessError
+        restrict_access()
+        # If the user is a developer, return a more informative error
+        raise exceptions.ResourceNotFoundError("A profile with this ID was not found.")
+    restrict_access(account_id)
+    return make_versioned_response(etag, lambda: query_profiles().get(profile_id)._asdict())
+
+
+def get_picture_scale(picture_count=1):
+    """Return the 'scale' parameter used when rendering profile pictures, checking
+    that the rendering of that many pictures wouldn't be too large."""
+    scale = get_query_parameter("scale", int, default=1)
+    if not 1 <= scale <= rendering.max_scale:
+        raise exceptions.MalformedParameterError(
+            f"The 'scale' parameter must be between 1 and {rendering.max_scale} (inclusive)."
+        )
+    if rendering.get_pixel_count(picture_count, scale) > rendering.max_pixels:
+        raise exceptions.MalformedParameterError(
+            f"At most {rendering.max_pixels} pixels can be rendered at once. Choose fewer pictures or a smaller scale."
+        )
+    return scale
+
+
+def make_png_response(pictures, scale, render_function):
+    """Return a rendered .png file with a strong ETag. Conditional requests for an
+    unchanged rendering are answered with a 304 without rendering anything."""
+    etag = rendering.get_etag(pictures, scale)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render_function(), mimetype="image/png")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
+
+
+@api.route("/profiles/<int:profile_id>/picture.png")
+def get_profile_picture(profile_id):
+    """Get the picture of a profile as a .png file. Only the account that owns the
+    profile and developers can get it."""
+    scale = get_picture_scale()
+    profile = db.session.query(Profile.account_id, Profile.picture).filter_by(id=profile_id).one_or_none()
     if profile is None:
         # If the user isn't a developer, return an UnauthorizedAccessError
         restrict_access()
         # If the user is a developer, return a more informative error
         raise exceptions.ResourceNotFoundError("A profile with this ID was not found.")
-    restrict_access(profile.account.id)
-    return jsonify(profile)
+    restrict_access(profile.account_id)
+    return make_png_response([profile.picture], scale, lambda: rendering.render_png(profile.picture, scale))
+
+
+@api.route("/profiles/pictures.png")
+def get_profile_pictures_sprite_sheet():
+    """Get the pictures of many profiles as a single .png sprite sheet. The profiles
+    are chosen with a comma-separated 'ids' parameter, and their pictures are laid
+    out left to right in the same order. Every profile must belong to the current
+    account, unless the user is a developer."""
+    try:
+        profile_ids = [int(profile_id) for profile_id in get_query_parameter("ids", default="").split(",")]
+    except ValueError:
+        raise exceptions.MalformedParameterError("The 'ids' parameter must be a comma-separated list of profile IDs.")
+    if not 1 <= len(profile_ids) <= max_sprite_sheet_pictures:
+        raise exceptions.MalformedParameterError(
+            f"The 'ids' parameter must contain between 1 and {max_sprite_sheet_pictures} profile IDs."
+        )
+    scale = get_picture_scale(len(profile_ids))
+    profiles = (
+        db.session.query(Profile.id, Profile.account_id, Profile.picture).filter(Profile.id.in_(profile_ids)).all()
+    )
+    if len(profiles) != len(set(profile_ids)):
+        restrict_access()
+        raise exceptions.ResourceNotFoundError("A profile with one of the specified IDs was not found.")
+    for account_id in {profile.account_id for profile in profiles}:
+        restrict_access(account_id)
+    pictures = {profile.id: profile.picture for profile in profiles}
+    pictures = [pictures[profile_id] for profile_id in profile_ids]
+    return make_png_response(pictures, scale, lambda: rendering.render_sprite_sheet(pictures, scale))
+
+
+@api.route("/transactions/batch", methods=["POST"])
+def create_financial_transactions():
+    """Move money between many wallets at once. Takes a 'transfers' list of objects
+    with 'sending_wallet_id', 'receiving_wallet_id' and 'value' fields. The transfers
+    are applied in order, and either all of them are made, or none are."""
+    restrict_access(error_message="Only developers can make batches of transfers.")
+    transfer_fields = get_body_field("transfers", field_type=list)
+    if not 1 <= len(transfer_fields) <= max_transfer_batch_size:
+        raise exceptions.MalformedFieldError(
+            f"The 'transfers' field must contain between 1 and {max_transfer_batch_size} transfers."
+        )
+    transfer_list = []
+    for fields in transfer_fields:
+        if not isinstance(fields, dict):
+            raise exceptions.MalformedFieldError("Each item of the 'transfers' field must be an object.")
+        sending_wallet_id = fields.get("sending_wallet_id")
+        receiving_wallet_id = fields.get("receiving_wallet_id")
+        if not isinstance(sending_wallet_id, int) or not isinstance(receiving_wallet_id, int):
+            raise exceptions.MalformedFieldError("Each transfer must have integer wallet IDs.")
+        if sending_wallet_id == receiving_wallet_id:
+            raise exceptions.MalformedFieldError("A wallet can't make a transfer to itself.")
+        value = transfers.parse_value(fields.get("value"))
+        transfer_list.append(transfers.Transfer(sending_wallet_id, receiving_wallet_id, value))
+
+    transaction_event, balances = transfers.apply_transfers(transfer_list)
+    # Serialise the transaction event before committing, while its fields are still loaded
+    response = {
+        "transaction_event": transaction_event._asdict(),
+        "wallets": [{"id": wallet_id, "value": value} for wallet_id, value in balances.items()],
+    }
+    db.session.commit()
+    return jsonify(response), 201
+
+
+def get_catalogue_info(catalogue):
+    return {
+        "version": catalogue.version,
+        "loaded_at": catalogue.loaded_at.replace(tzinfo=timezone.utc).isoformat(),
+        "resource_type_count": len(catalogue),
+    }
+
+
+@api.route("/resource_types/catalogue")
+def get_resource_catalogue_info():
+    """Get the version of this worker's resource type catalogue, and whether it's
+    stale compared to the resource_type table."""
+    restrict_access()
+    catalogue = resource_catalogue.get_resource_catalogue()
+    database_version = resource_catalogue.ResourceCatalogue.from_database().version
+    response = get_catalogue_info(catalogue)
+    response.update({"database_version": database_version, "is_stale": catalogue.version != database_version})
+    return jsonify(response)
+
+
+@api.route("/resource_types/catalogue/reload", methods=["POST"])
+def reload_resource_catalogue():
+    """Reload the resource type catalogue of every worker from the resource_type
+    table. The worker serving the request reloads its catalogue straight away,
+    and returns it, and the others reload theirs within a second."""
+    restrict_access()
+    return jsonify(get_catalogue_info(resource_catalogue.reload_every_resource_catalogue()))
+
+
+def assert_dome_exists(dome_graph, dome_id):
+    """Ensure a dome exists in the dome graph."""
+    if dome_id not in dome_graph:
+        raise exceptions.ResourceNotFoundError("A dome with this ID was not found.")
+
+
+@api.route("/domes/<int:dome_id>/path/<int:destination_id>")
+def get_dome_path(dome_id, destination_id):
+    """Get the shortest route through the tunnels between two domes."""
+    dome_graph = get_dome_graph()
+    assert_dome_exists(dome_graph, dome_id)
+    assert_dome_exists(dome_graph, destination_id)
+    path = dome_graph.shortest_path(dome_id, destination_id)
+    if path is None:
+        raise exceptions.ResourceNotFoundError("There is no route between these domes.")
+    length, dome_ids = path
+    return jsonify({"length": length, "domes": dome_ids})
+
+
+@api.route("/domes/<int:dome_id>/neighbourhood")
+def get_dome_neighbourhood(dome_id):
+    """Get every dome that can be reached from a dome through at most 'hops' tunnels."""
+    hops = get_query_parameter("hops", int, default=1)
+    if not 0 <= hops <= max_neighbourhood_hops:
+        raise exceptions.MalformedParameterError(
+            f"The 'hops' parameter must be between 0 and {max_neighbourhood_hops} (inclusive)."
+        )
+    dome_graph = get_dome_graph()
+    assert_dome_exists(dome_graph, dome_id)
+    return jsonify({"domes": dome_graph.neighbourhood(dome_id, hops)})
+
+
+@api.route("/domes/components")
+def get_dome_components():
+    """Get the groups of domes that are connected to one another by tunnels."""
+    return jsonify({"components": get_dome_graph().connected_components()})
+
+
+def get_required_query_parameter(parameter_name, parameter_type=str):
+    """Ensure the request has a specific query string parameter, and return it."""
+    parameter = get_query_parameter(parameter_name, parameter_type)
+    if parameter is None:
+        raise exceptions.MalformedParameterError(f"The '{parameter_name}' parameter is required.")
+    return parameter
+
+
+@api.route("/domes/<int:dome_id>/entities")
+def get_dome_entities(dome_id):
+    """Get the world entities in a dome that are either within 'radius' of the
+    point ('x', 'y'), or inside the box from ('min_x', 'min_y') to ('max_x', 'max_y')."""
+    assert_dome_exists(get_dome_graph(), dome_id)
+    spatial_index = get_spatial_index()
+    if "radius" in request.args:
+        x = get_required_query_parameter("x", float)
+        y = get_required_query_parameter("y", float)
+        radius = get_required_query_parameter("radius", float)
+        for parameter_name, parameter in (("x", x), ("y", y), ("radius", radius)):
+            if not math.isfinite(parameter):
+                raise exceptions.MalformedParameterError(f"The '{parameter_name}' parameter must be a finite number.")
+        if radius < 0:
+            raise exceptions.MalformedParameterError("The 'radius' parameter must not be negative.")
+        world_entities = spatial_index.within_radius(dome_id, x, y, radius)
+    else:
+        min_x = get_required_query_parameter("min_x", int)
+        min_y = get_required_query_parameter("min_y", int)
+        max_x = get_required_query_parameter("max_x", int)
+        max_y = get_required_query_parameter("max_y", int)
+        world_entities = spatial_index.within_box(dome_id, min_x, min_y, max_x, max_y)
+    world_entities.sort()
+    return jsonify(
+        {
+            "world_entities": [
+                {"id": entity_id, "location_x": x, "location_y": y} for entity_id, x, y in world_entities
+            ]
+        }
+    )
 
 
 @api.errorhandler(exceptions.BaseError)
@@ -19,12 +19,37 @@ function get_account_information_callback(response) {
     document.getElementById("account-is-developer").innerHTML = response.response.is_developer;
 
     // Create a profile card for each profile associated with the account
-    response.response.profiles.forEach(profile => {
-        add_profile_card(profile.name, profile.entity.wallet.value, profile.picture);
-    });
+    var profiles = response.response.profiles;
+    var canvases = profiles.map(profile => add_profile_card(profile.name, profile.entity.wallet.value));
+    draw_profile_pictures(profiles, canvases);
 }
 
-function add_profile_card(name, money, picture) {
+// Draw the pictures of many profiles from sprite sheets, so that only one image
+// needs to be fetched for every 100 profiles
+function draw_profile_pictures(profiles, canvases, sprite_sheet_size = 100) {
+    for (let start = 0; start < profiles.length; start += sprite_sheet_size) {
+        let sprite_sheet_canvases = canvases.slice(start, start + sprite_sheet_size);
+        let profile_ids = profiles.slice(start, start + sprite_sheet_size).map(profile => profile.id);
+        let sprite_sheet = new Image();
+        sprite_sheet.onload = function() {
+            sprite_sheet_canvases.forEach((canvas, i) => {
+                var ctx = canvas.getContext("2d");
+                ctx.imageSmoothingEnabled = false;
+                ctx.drawImage(sprite_sheet, i * 16, 0, 16, 16, 0, 0, canvas.width, canvas.height);
+            });
+            URL.revokeObjectURL(sprite_sheet.src);
+        };
+        // Pictures are only shown to their owners, so the sprite sheet is fetched
+        // with the access token rather than loaded directly by the image
+        send_request("/api/profiles/pictures.png?ids=" + profile_ids.join(","), function(response) {
+            if (response.status == 200) {
+                sprite_sheet.src = URL.createObjectURL(response.response);
+            }
+        }, null, "GET", "blob");
+    }
+}
+
+function add_profile_card(name, money, picture = null) {
     var card_template = document.getElementById("toolbox").getElementsByClassName("profile-card")[0];
     var new_card = card_template.cloneNode(true);
 
@@ -35,20 +60,36 @@ function add_profile_card(name, money, picture) {
     // Set profile picture on new card
     var canvas = new_card.getElementsByTagName("canvas")[0];
     initialise_profile_image(canvas);
-    canvas.profile_image.from_base64(picture);
+    if (picture !== null) {
+        canvas.profile_image.from_base64(picture);
+    }
 
     // Add new card to profile card container
     var reference_card = document.getElementById("create-profile");
     document.getElementById("profile-container").insertBefore(new_card, reference_card);
+    return canvas;
 }
 
+// Generated images are fetched in batches, so that randomising the profile image
+// only needs a request to the server once every few clicks
+var generated_profile_images = [];
+
 function randomise_new_profile_image() {
-    // Fetch a new generated image for the profile image editor
-    send_request("/api/generators/profile_image", randomise_new_profile_image_callback);
+    // Use a generated image that has already been fetched if there is one
+    if (generated_profile_images.length > 0) {
+        set_new_profile_image(generated_profile_images.pop());
+        return;
+    }
+    // Fetch a new batch of generated images for the profile image editor
+    send_request("/api/generators/profile_image?count=10", randomise_new_profile_image_callback);
 }
 
 function randomise_new_profile_image_callback(response) {
-    var generated_image = response.response.image;
+    generated_profile_images = response.response.images;
+    set_new_profile_image(generated_profile_images.pop());
+}
+
+function set_new_profile_image(generated_image) {
     var profile_image_editor = document.getElementById("profile-image-editor");
     profile_image_editor.profile_image.from_base64(generated_image);
 }
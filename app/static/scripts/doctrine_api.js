@@ -1,4 +1,4 @@
-function send_request(url, callback, body_data = null, method = null) {
+function send_request(url, callback, body_data = null, method = null, response_type = "json") {
     var request = new XMLHttpRequest();
     if (method === null) {
         if (body_data === null) {
@@ -14,7 +14,7 @@ function send_request(url, callback, body_data = null, method = null) {
         }
     };
 
-    request.responseType = "json"
+    request.responseType = response_type;
     request.open(method, url);
     // Set Authorization header
     if (get_token() !== null) {
@@ -39,7 +39,10 @@ function get_account_id() {
 }
 
 function log_out(redirect_to = "/") {
-    localStorage.removeItem("access_token");
-    localStorage.removeItem("account_id");
-    window.location.replace(redirect_to);
+    // Revoke the access token on the server before forgetting it
+    send_request("/api/logout", function() {
+        localStorage.removeItem("access_token");
+        localStorage.removeItem("account_id");
+        window.location.replace(redirect_to);
+    }, null, "POST");
 }
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Measures the dome graph on synthetic worlds of 10k to 100k domes. Domes are
+scattered over a square, and each one is connected by tunnels to a few of its
+nearest neighbours on a grid, similar to how a real world map would be laid out.
+
+Run from the project root directory with:
+    python3 benchmarks/dome_graph.py
+"""
+
+import os
+import random
+import sys
+import time
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from app.modules.dome_graph import DomeGraph
+
+
+def generate_world(dome_count, seed=0):
+    """Generate domes on a jittered grid, each connected to the domes to its right
+    and below it, with a fraction of the tunnels left out."""
+    rng = random.Random(seed)
+    width = int(dome_count ** 0.5)
+    domes = []
+    connections = []
+    for i in range(dome_count):
+        x, y = i % width, i // width
+        domes.append((i + 1, x * 1000 + rng.randint(-300, 300), y * 1000 + rng.randint(-300, 300)))
+        if x + 1 < width and i + 1 < dome_count and rng.random() < 0.9:
+            connections.append((i + 1, i + 2))
+        if i + width < dome_count and rng.random() < 0.9:
+            connections.append((i + 1, i + width + 1))
+    return domes, connections
+
+
+def time_per_call(function, arguments):
+    start = time.perf_counter()
+    for args in arguments:
+        function(*args)
+    return (time.perf_counter() - start) / len(arguments)
+
+
+if __name__ == "__main__":
+    for dome_count in (10_000, 30_000, 100_000):
+        domes, connections = generate_world(dome_count)
+        start = time.perf_counter()
+        dome_graph = DomeGraph(domes, connections)
+        build_time = time.perf_counter() - start
+
+        rng = random.Random(1)
+        pairs = [(rng.randint(1, dome_count), rng.randint(1, dome_count)) for _ in range(20)]
+        uncached = time_per_call(dome_graph.shortest_path, pairs)
+        cached = time_per_call(dome_graph.shortest_path, pairs)
+        neighbourhood = time_per_call(dome_graph.neighbourhood, [(dome_id, 3) for dome_id, _ in pairs])
+        start = time.perf_counter()
+        dome_graph.connected_components()
+        components_time = time.perf_counter() - start
+
+        print(f"{dome_count} domes, {len(connections)} tunnels")
+        print(f"  build graph          {build_time * 1e3:>10.1f} ms")
+        print(f"  shortest path        {uncached * 1e3:>10.2f} ms")
+        print(f"  shortest path cached {cached * 1e6:>10.2f} us")
+        print(f"  3-hop neighbourhood  {neighbourhood * 1e6:>10.2f} us")
+        print(f"  connected components {components_time * 1e3:>10.1f} ms")
@@ -0,0 +1,74 @@
+"""
+Compares checking whether an inventory has room for more resources using the
+stored inventory totals (Inventory.can_accept) against summing the inventory's
+resources with a join each time, for inventories of increasing size.
+
+Creates its own inventories and resources in the database configured for the
+app. Run from the project root directory with:
+    python3 benchmarks/inventory_capacity.py
+"""
+
+import os
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from sqlalchemy import func
+from app import app, db
+from app.models import Asset, Entity, Inventory, Resource, ResourceType
+
+check_count = 1000
+
+
+def can_accept_by_summing(inventory_id, resource_type, count):
+    item_count, total_volume, quantity_limit, volume_limit = (
+        db.session.query(
+            func.count(Resource.id),
+            func.coalesce(func.sum(ResourceType.volume), 0),
+            Inventory.quantity_limit,
+            Inventory.volume_limit,
+        )
+        .select_from(Inventory)
+        .outerjoin(Resource)
+        .outerjoin(ResourceType)
+        .filter(Inventory.id == inventory_id)
+        .group_by(Inventory.id)
+        .one()
+    )
+    return item_count + count <= quantity_limit and total_volume + count * resource_type.volume <= volume_limit
+
+
+def can_accept_by_totals(inventory_id, resource_type, count):
+    inventory = db.session.query(Inventory).get(inventory_id)
+    db.session.expire(inventory)  # Make every check read the inventory from the database
+    return inventory.can_accept(resource_type.id, count)
+
+
+def benchmark(name, function, inventory_id, resource_type):
+    start = time.perf_counter()
+    for _ in range(check_count):
+        function(inventory_id, resource_type, 1)
+    seconds = time.perf_counter() - start
+    print(f"  {name:<12} {seconds / check_count * 1e6:>10.1f} us per check")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        entity = Entity()
+        resource_type = ResourceType(name=uuid.uuid4().hex[:16], mass=Decimal(1), volume=Decimal(1))
+        db.session.add_all([entity, resource_type])
+        db.session.commit()
+        for resource_count in (10, 1000, 10_000):
+            inventory = Inventory(quantity_limit=10 ** 6, volume_limit=10 ** 6)
+            db.session.add(inventory)
+            for _ in range(resource_count):
+                db.session.add(Resource(asset=Asset(entity=entity), inventory=inventory, resource_type=resource_type))
+            db.session.commit()
+            print(f"Inventory holding {resource_count} resources:")
+            benchmark("summing", can_accept_by_summing, inventory.id, resource_type)
+            benchmark("totals", can_accept_by_totals, inventory.id, resource_type)
@@ -0,0 +1,330 @@
+"""
+Load tests the API with a mix of realistic requests from concurrent clients, and
+reports the latency percentiles and throughput of each kind of request.
+
+The app is served in-process, by a threaded development server on a free port,
+against a temporary SQLite database by default, or against the database given
+with --database-uri (eg. a local MySQL container). The database is seeded in
+bulk with accounts, each with profiles, wallets and an access token, and each
+client signs in as one of the accounts.
+
+Results are printed, and saved as JSON in benchmarks/results/, named by time and
+commit, so that runs can be compared between commits with --compare.
+
+Run from the project root directory with:
+    python3 benchmarks/load_test.py [--mix mixed] [--clients 8] [--duration 10]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+import bcrypt
+import requests
+from sqlalchemy import func
+from werkzeug.serving import make_server
+
+results_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "results")
+# Rows are inserted this many at a time when seeding the database
+seed_batch_size = 1000
+
+SeededAccount = namedtuple("SeededAccount", ["id", "email_address", "password", "token"])
+
+
+# Each kind of request takes a client and the account it's signed in as, and
+# returns the response. Clients make requests with these relative weights.
+def log_in(client, account):
+    return client.session.post(
+        f"{client.api_url}/login", json={"email_address": account.email_address, "password": account.password}
+    )
+
+
+def load_dashboard(client, account):
+    return client.session.get(f"{client.api_url}/accounts/{account.id}", headers=client.headers)
+
+
+def create_profile(client, account):
+    client.profile_count += 1
+    body = {"account_id": account.id, "name": f"{client.name}-{client.profile_count}"}
+    return client.session.post(f"{client.api_url}/profiles/", json=body, headers=client.headers)
+
+
+def generate_image(client, account):
+    return client.session.get(f"{client.api_url}/generators/profile_image")
+
+
+mixes = {
+    "mixed": {log_in: 1, load_dashboard: 6, create_profile: 1, generate_image: 2},
+    "dashboard": {load_dashboard: 1},
+    "logins": {log_in: 1},
+    "writes": {create_profile: 1},
+}
+
+
+class Client:
+    """Makes requests as one account, recording the latency of every request."""
+
+    def __init__(self, name, api_url, account, mix):
+        self.name = name
+        self.api_url = api_url
+        self.account = account
+        self.session = requests.Session()
+        self.headers = {"Authorization": f"Bearer {account.token}"}
+        self.requests, self.weights = zip(*mix.items())
+        self.profile_count = 0
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def run(self, end_time):
+        rng = random.Random(self.name)
+        while time.perf_counter() < end_time:
+            make_request = rng.choices(self.requests, self.weights)[0]
+            start = time.perf_counter()
+            response = make_request(self, self.account)
+            self.latencies[make_request.__name__].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                self.errors[make_request.__name__] += 1
+
+
+def insert_rows(table, rows):
+    from app import db
+
+    for i in range(0, len(rows), seed_batch_size):
+        db.session.execute(table.insert(), rows[i : i + seed_batch_size])
+
+
+def seed_database(account_count, profiles_per_account, work_factor):
+    """Insert accounts, each with profiles, wallets and an access token, in bulk,
+    and return them as SeededAccounts. Every account has the same password, so
+    that it's only hashed once."""
+    from app import db
+    from app.models import AccessToken, Account, EmailAddress, Entity, Profile, Wallet, hash_email_address
+    from app.modules import access_tokens
+    from app.modules.profile_image import generate_profile_images
+
+    def next_id(model):
+        return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+    run_id = uuid.uuid4().hex[:8]
+    password = "load test"
+    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=work_factor))
+    signing_key = access_tokens.get_signing_key()
+    now = datetime.utcnow()
+    accounts = []
+    email_rows, account_rows, token_rows = [], [], []
+    first_email_id, first_account_id, first_token_id = next_id(EmailAddress), next_id(Account), next_id(AccessToken)
+    for i in range(account_count):
+        email_address = f"load-test-{run_id}-{i}@mail.com"
+        token = access_tokens.generate_token(signing_key)
+        accounts.append(SeededAccount(first_account_id + i, email_address, password, token))
+        email_rows.append(
+            {"id": first_email_id + i, "hash": hash_email_address(email_address), "email_address": email_address}
+        )
+        account_rows.append(
+            {"id": first_account_id + i, "email_address_id": first_email_id + i, "password_hash": password_hash}
+        )
+        token_rows.append(
+            {
+                "id": first_token_id + i,
+                "account_id": first_account_id + i,
+                "token": token,
+                "creation_time": now,
+                "duration": timedelta(days=1),
+                "expires_at": now + timedelta(days=1),
+            }
+        )
+
+    profile_count = account_count * profiles_per_account
+    pictures = generate_profile_images(profile_count, seed=0) if profile_count else []
+    wallet_rows, entity_rows, profile_rows = [], [], []
+    first_wallet_id, first_entity_id, first_profile_id = next_id(Wallet), next_id(Entity), next_id(Profile)
+    for i in range(profile_count):
+        account_index, profile_index = divmod(i, profiles_per_account)
+        wallet_rows.append({"id": first_wallet_id + i, "value": 100})
+        entity_rows.append({"id": first_entity_id + i, "wallet_id": first_wallet_id + i})
+        profile_rows.append(
+            {
+                "id": first_profile_id + i,
+                "name": f"{run_id}-{account_index}-{profile_index}",
+                "picture": bytes(pictures[i]),
+                "account_id": first_account_id + account_index,
+                "entity_id": first_entity_id + i,
+            }
+        )
+
+    for model, rows in [
+        (EmailAddress, email_rows),
+        (Account, account_rows),
+        (AccessToken, token_rows),
+        (Wallet, wallet_rows),
+        (Entity, entity_rows),
+        (Profile, profile_rows),
+    ]:
+        insert_rows(model.__table__, rows)
+    db.session.commit()
+    return accounts
+
+
+def percentile(sorted_values, percent):
+    """Return the nearest-rank percentile of a sorted list."""
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[int(index)]
+
+
+def summarise(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 50) * 1e3 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1e3 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1e3 if latencies else None,
+    }
+
+
+def run_load_test(api_url, accounts, mix, client_count, duration):
+    """Run clients against the API for a number of seconds, and return a summary of each kind of request."""
+    clients = [Client(f"client{i}", api_url, accounts[i % len(accounts)], mix) for i in range(client_count)]
+    # Make each kind of request once first, so that start up costs (eg. starting
+    # the password hashing processes) aren't counted
+    for make_request in mix:
+        make_request(clients[0], clients[0].account)
+    end_time = time.perf_counter() + duration
+    threads = [threading.Thread(target=client.run, args=(end_time,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies, errors = defaultdict(list), defaultdict(int)
+    for client in clients:
+        for name, client_latencies in client.latencies.items():
+            latencies[name] += client_latencies
+            latencies["total"] += client_latencies
+        for name, client_errors in client.errors.items():
+            errors[name] += client_errors
+            errors["total"] += client_errors
+    return {name: summarise(latencies[name], errors[name], seconds) for name in latencies}
+
+
+def get_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit.stdout.strip() + ("-dirty" if status.stdout.strip() else "")
+
+
+def print_results(results, compare_results=None):
+    print(f"  {'request':<16} {'count':>7} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, summary in sorted(results.items(), key=lambda item: item[0] == "total"):
+        print(
+            f"  {name:<16} {summary['requests']:>7} {summary['errors']:>7} {summary['requests_per_second']:>9.1f}"
+            f" {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}"
+        )
+        previous = (compare_results or {}).get(name)
+        if previous:
+            changes = [
+                (summary[field] - previous[field]) / previous[field] * 100 if previous[field] else 0
+                for field in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")
+            ]
+            print(f"  {'':<16} {'':>7} {'':>7}" + "".join(f" {change:>+8.1f}%" for change in changes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-uri", help="database to run against, instead of a temporary SQLite database")
+    parser.add_argument("--mix", choices=sorted(mixes), default="mixed", help="the kinds of requests to make")
+    parser.add_argument("--accounts", type=int, default=1000, help="accounts to seed the database with")
+    parser.add_argument("--profiles-per-account", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run for")
+    parser.add_argument("--work-factor", type=int, default=4, help="bcrypt work factor for passwords")
+    parser.add_argument("--compare", help="a results file from an earlier run, to print changes against")
+    parser.add_argument("--no-save", action="store_true", help="don't save the results")
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from config import Config
+
+    database_directory = tempfile.TemporaryDirectory()
+
+    class LoadTestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_uri or f"sqlite:///{database_directory.name}/load_test.db"
+        PASSWORD_HASHING_WORK_FACTOR = args.work_factor
+        # Keep the server's own instrumentation out of the shared directories
+        REQUEST_METRICS_DIRECTORY = None
+        REQUEST_PROFILE_DIRECTORY = None
+
+    if args.database_uri is None:
+        # SQLite databases aren't pooled
+        LoadTestConfig.SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    app = create_app(LoadTestConfig)
+    with app.app_context():
+        if args.database_uri is None:
+            # Let reads carry on while another thread writes
+            db.session.execute("PRAGMA journal_mode=WAL")
+        db.create_all()
+        start = time.perf_counter()
+        accounts = seed_database(args.accounts, args.profiles_per_account, args.work_factor)
+        seed_seconds = time.perf_counter() - start
+        db.session.remove()
+    print(f"Seeded {args.accounts} accounts with {args.profiles_per_account} profiles each in {seed_seconds:.1f} s")
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("localhost", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://localhost:{server.server_port}/api"
+
+    print(f"Running the '{args.mix}' mix with {args.clients} clients for {args.duration} s")
+    results = run_load_test(api_url, accounts, mixes[args.mix], args.clients, args.duration)
+    server.shutdown()
+    # Write queued sign in events before the database is deleted
+    from app.routes.api import sign_in_event_writer
+
+    sign_in_event_writer.close()
+    database_name = db.get_engine(app).dialect.name
+    db.get_engine(app).dispose()
+    database_directory.cleanup()
+
+    compare_results = None
+    if args.compare:
+        with open(args.compare) as file:
+            compare_results = json.load(file)["results"]
+    print_results(results, compare_results)
+
+    if not args.no_save:
+        commit = get_commit()
+        run = {
+            "time": datetime.utcnow().isoformat(),
+            "commit": commit,
+            "database": database_name,
+            "arguments": vars(args),
+            "results": results,
+        }
+        os.makedirs(results_directory, exist_ok=True)
+        file_name = os.path.join(results_directory, f"{datetime.utcnow():%Y%m%d-%H%M%S}-{commit}-{args.mix}.json")
+        with open(file_name, "w") as file:
+            json.dump(run, file, indent=2)
+        print(f"Saved results to {os.path.relpath(file_name)}")
@@ -0,0 +1,77 @@
+"""
+Measures how a burst of concurrent logins affects the latency of a cheap API
+request (GET /api/accounts/<id>). Runs against a live server, the same as the
+API tests, so start the server first with ./start_server.
+
+Run from the project root directory with:
+    python3 benchmarks/login_storm.py [API URL] [login threads] [seconds]
+"""
+
+import statistics
+import sys
+import threading
+import time
+import uuid
+import requests
+
+API_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8004/api"
+LOGIN_THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+DURATION = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+
+def create_account():
+    """Create a new account, returning its credentials, ID, and an access token."""
+    credentials = {"email_address": f"benchmark-{uuid.uuid4().hex}@mail.com", "password": "benchmark"}
+    r = requests.post(f"{API_URL}/accounts/", json=credentials)
+    r.raise_for_status()
+    r = requests.post(f"{API_URL}/login", json=credentials)
+    r.raise_for_status()
+    return credentials, r.json()["account"]["id"], r.json()["token"]
+
+
+def measure_account_requests(account_id, token, duration):
+    """Repeatedly fetch an account for a number of seconds, returning the latencies."""
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+    latencies = []
+    end_time = time.perf_counter() + duration
+    while time.perf_counter() < end_time:
+        start = time.perf_counter()
+        session.get(f"{API_URL}/accounts/{account_id}").raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def log_in_repeatedly(credentials, end_time, status_codes):
+    session = requests.Session()
+    while time.perf_counter() < end_time:
+        status_code = session.post(f"{API_URL}/login", json=credentials).status_code
+        status_codes.append(status_code)
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1e3
+    p95 = latencies[int(len(latencies) * 0.95)] * 1e3
+    maximum = latencies[-1] * 1e3
+    print(f"{name:<16} {len(latencies):>6} requests   p50 {p50:>7.1f} ms   p95 {p95:>7.1f} ms   max {maximum:>7.1f} ms")
+
+
+if __name__ == "__main__":
+    credentials, account_id, token = create_account()
+    report("idle", measure_account_requests(account_id, token, DURATION / 2))
+
+    # Start a login storm, then measure the same request while it runs
+    status_codes = []
+    end_time = time.perf_counter() + DURATION
+    login_threads = [
+        threading.Thread(target=log_in_repeatedly, args=(credentials, end_time, status_codes))
+        for _ in range(LOGIN_THREADS)
+    ]
+    for thread in login_threads:
+        thread.start()
+    report("during logins", measure_account_requests(account_id, token, DURATION))
+    for thread in login_threads:
+        thread.join()
+
+    print(f"Logins: {status_codes.count(200)} succeeded, {status_codes.count(503)} rejected as busy")
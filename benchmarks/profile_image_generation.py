@@ -0,0 +1,50 @@
+"""
+Measures the cost of generating a random profile image. The 'file masks' case
+reads the border and icon .png files for every image (the way images were
+generated before masks were cached), while the 'cached masks' case combines
+masks that have already been decoded. The 'batch' case generates images 100 at
+a time with generate_profile_images.
+
+Run from the project root directory with:
+    python3 benchmarks/profile_image_generation.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from app.modules.profile_image import generate_profile_image, generate_profile_images, ProfileImage
+from app.modules.profile_image import generator
+from tests.test_profile_image import apply_image_file_as_mask
+
+
+def generate_profile_image_from_files():
+    """Generate a random profile image, decoding the mask files every time."""
+    profile_image = ProfileImage()
+    profile_image.fill(random.choice(generator.background_colours))
+    border_path = random.choice(generator.border_paths)
+    icon_path = random.choice(generator.icon_paths)
+    apply_image_file_as_mask(profile_image, border_path, random.choice(generator.midground_colours))
+    apply_image_file_as_mask(profile_image, icon_path, random.choice(generator.foreground_colours))
+    return profile_image
+
+
+def benchmark(name, function, number, images_per_call=1):
+    seconds = min(timeit.repeat(function, number=number, repeat=5))
+    seconds_per_image = seconds / (number * images_per_call)
+    print(f"{name:<14} {seconds_per_image * 1e6:>10.1f} us per image")
+    return seconds_per_image
+
+
+if __name__ == "__main__":
+    # Load the cached masks up front so that the first timed run isn't penalised
+    generate_profile_images(1)
+    before = benchmark("file masks", generate_profile_image_from_files, 200)
+    after = benchmark("cached masks", generate_profile_image, 2000)
+    batch = benchmark("batch", lambda: generate_profile_images(100), 20, images_per_call=100)
+    print(f"Speedup: {before / after:.1f}x cached, {before / batch:.1f}x batch")
@@ -0,0 +1,44 @@
+"""
+Measures the cost of serialising stored profile pictures to Base64 strings, as
+done once per profile by Profile._asdict. The 'decode/encode' case unpacks the
+stored bytes into a ProfileImage and packs them again, 'direct' encodes the
+stored bytes, and 'memoised' goes through Profile.picture_string, which encodes
+each picture on first use and then reuses the encoded string.
+
+Run from the project root directory with:
+    python3 benchmarks/profile_picture_serialisation.py
+"""
+
+import base64
+import os
+import sys
+import time
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from app.models import Profile
+from app.modules.profile_image import generate_profile_image, ProfileImage
+
+profile_count = 100_000
+
+
+def benchmark(name, function, profiles):
+    start = time.perf_counter()
+    for profile in profiles:
+        function(profile)
+    seconds = time.perf_counter() - start
+    print(f"{name:<16} {seconds * 1e3:>8.1f} ms for {len(profiles)} profiles")
+    return seconds
+
+
+if __name__ == "__main__":
+    pictures = [bytes(generate_profile_image()) for _ in range(100)]
+    profiles = [Profile(name=f"profile_{i}", picture=pictures[i % 100]) for i in range(profile_count)]
+
+    before = benchmark("decode/encode", lambda p: ProfileImage.from_bytes(p.picture).to_base64_string(), profiles)
+    direct = benchmark("direct", lambda p: base64.b64encode(p.picture).decode("utf-8"), profiles)
+    benchmark("memoised (cold)", lambda p: p.picture_string, profiles)
+    memoised = benchmark("memoised (warm)", lambda p: p.picture_string, profiles)
+    print(f"Speedup: {before / direct:.1f}x direct, {before / memoised:.1f}x memoised")
@@ -0,0 +1,92 @@
+"""
+Measures the overhead of recording request metrics. Times the per-request hooks
+on their own, the cost that counting and timing SQL statements adds to each
+statement, and how long a cheap request through the app takes, so that the
+overhead can be compared against it.
+
+Uses its own SQLite database. Run from the project root directory with:
+    python3 benchmarks/request_metrics.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from sqlalchemy import create_engine
+from app.modules.request_metrics import RequestMetrics
+
+hook_count = 100_000
+statement_count = 20_000
+request_count = 2_000
+
+
+def time_per_call(function, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return (time.perf_counter() - start) / count
+
+
+def time_statements(engine, request_metrics):
+    """Return the fastest of a few runs, as the difference being measured is small."""
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(5):
+            request_metrics.start_request()
+            timings.append(time_per_call(lambda: connection.execute("SELECT 1"), statement_count))
+            request_metrics.finish_request("benchmark", 0)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        # The hooks run before and after every request, and write to the shared
+        # directory at most once a second
+        request_metrics = RequestMetrics(directory)
+
+        def record_request():
+            request_metrics.start_request()
+            request_metrics.finish_request("benchmark", 100)
+
+        hook_seconds = time_per_call(record_request, hook_count)
+
+        engine = create_engine("sqlite://")
+        statement_seconds = time_statements(engine, request_metrics)
+        request_metrics.listen(engine)
+        counted_statement_seconds = time_statements(engine, request_metrics)
+        request_metrics.remove_listeners(engine)
+
+        from app import create_app, db
+        from config import Config
+
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{directory}/benchmark.db"
+            # SQLite databases aren't pooled
+            SQLALCHEMY_ENGINE_OPTIONS = {}
+            REQUEST_METRICS_DIRECTORY = directory
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+        client = app.test_client()
+        client.get("/api/domes/components")
+        request_seconds = time_per_call(lambda: client.get("/api/domes/components"), request_count)
+
+        # Stop writing to the directory before it's deleted
+        from app.routes.api import request_metrics as app_request_metrics
+
+        request_metrics.directory = None
+        app_request_metrics.directory = None
+
+    statement_overhead = counted_statement_seconds - statement_seconds
+    print(f"  request hooks                     {hook_seconds * 1e6:>8.2f} us per request")
+    print(f"  SQL statement                     {statement_seconds * 1e6:>8.2f} us")
+    print(f"  SQL statement, counted            {counted_statement_seconds * 1e6:>8.2f} us")
+    print(f"  counting overhead                 {statement_overhead * 1e6:>8.2f} us per statement")
+    print(f"  GET /api/domes/components         {request_seconds * 1e6:>8.2f} us, including hooks")
+    print(f"  hook overhead                     {hook_seconds / request_seconds * 100:>8.2f} % of the request")
@@ -0,0 +1,78 @@
+"""
+Compares the memory used by, and the speed of looking up, resource types held
+in the ResourceCatalogue against resource types held as ORM objects. ORM objects
+are looked up both from a plain dict, and through a session whose identity map
+already holds every resource type, which is the best case for lazy loading
+Resource.resource_type.
+
+Run from the project root directory with:
+    python3 benchmarks/resource_catalogue.py
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.models import ResourceType
+from app.modules.resource_catalogue import ResourceCatalogue
+
+resource_type_count = 10_000
+lookup_count = 1_000_000
+
+
+def measure_memory(function):
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def benchmark(name, function, ids):
+    start = time.perf_counter()
+    for resource_type_id in ids:
+        function(resource_type_id)
+    seconds = time.perf_counter() - start
+    print(f"  {name:<28} {seconds / len(ids) * 1e9:>8.0f} ns per lookup")
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    random_decimal = lambda: Decimal(rng.randint(1, 10 ** 6)).scaleb(-3)
+    rows = [(i + 1, f"resource type {i + 1}", random_decimal(), random_decimal()) for i in range(resource_type_count)]
+
+    # Load every resource type into the identity map of a session on an in-memory database
+    engine = create_engine("sqlite://")
+    ResourceType.__table__.create(engine)
+    engine.execute(
+        ResourceType.__table__.insert(), [dict(id=row[0], name=row[1], mass=row[2], volume=row[3]) for row in rows]
+    )
+    session = Session(engine)
+    loaded_resource_types = session.query(ResourceType).all()
+
+    catalogue, catalogue_size = measure_memory(lambda: ResourceCatalogue(rows))
+    orm_objects, orm_size = measure_memory(
+        lambda: {row[0]: ResourceType(id=row[0], name=row[1], mass=row[2], volume=row[3]) for row in rows}
+    )
+    print(f"Memory used by {resource_type_count} resource types:")
+    print(f"  catalogue   {catalogue_size / 1024:>8.0f} KiB")
+    print(f"  ORM objects {orm_size / 1024:>8.0f} KiB")
+
+    ids = [rng.randint(1, resource_type_count) for _ in range(lookup_count)]
+    print("Looking up the volume of a resource type:")
+    benchmark("catalogue", catalogue.volume, ids)
+    benchmark("ORM object by ID", lambda i: orm_objects[i].volume, ids)
+    benchmark("ORM object from session", lambda i: session.query(ResourceType).get(i).volume, ids[:100_000])
+    print("Looking up the name of a resource type:")
+    benchmark("catalogue", catalogue.name, ids)
+    benchmark("ORM object by ID", lambda i: orm_objects[i].name, ids)
+    benchmark("ORM object from session", lambda i: session.query(ResourceType).get(i).name, ids[:100_000])
@@ -0,0 +1,89 @@
+"""
+Compares finding the world entities near a point using the in-memory spatial
+index against filtering the world_entity table with SQL, with and without an
+index on the location columns. The table is held in an in-memory SQLite database
+so that the comparison doesn't include network round trips.
+
+Run from the project root directory with:
+    python3 benchmarks/spatial_index.py [entity count]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from app.modules.spatial_index import SpatialIndex
+
+dome_count = 20
+dome_radius = 5000  # Meters
+query_radius = 50  # Meters
+
+radius_query = """
+    SELECT id, location_x, location_y FROM world_entity
+    WHERE location_dome_id = ? AND location_x BETWEEN ? AND ? AND location_y BETWEEN ? AND ?
+    AND (location_x - ?) * (location_x - ?) + (location_y - ?) * (location_y - ?) <= ?
+"""
+
+
+def generate_entities(entity_count, seed=0):
+    rng = random.Random(seed)
+    location = lambda: rng.randint(-dome_radius, dome_radius)
+    return [(i + 1, rng.randint(1, dome_count), location(), location()) for i in range(entity_count)]
+
+
+def time_per_call(function, queries):
+    start = time.perf_counter()
+    for query in queries:
+        function(*query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+if __name__ == "__main__":
+    entity_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    entities = generate_entities(entity_count)
+    rng = random.Random(1)
+    queries = [
+        (rng.randint(1, dome_count), rng.randint(-dome_radius, dome_radius), rng.randint(-dome_radius, dome_radius))
+        for _ in range(100)
+    ]
+
+    start = time.perf_counter()
+    spatial_index = SpatialIndex()
+    spatial_index.bulk_load(entities)
+    print(f"Built spatial index of {entity_count} entities in {time.perf_counter() - start:.1f} s")
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute(
+        "CREATE TABLE world_entity "
+        "(id INTEGER PRIMARY KEY, location_dome_id INTEGER, location_x INTEGER, location_y INTEGER)"
+    )
+    connection.executemany("INSERT INTO world_entity VALUES (?, ?, ?, ?)", entities)
+
+    def sql_within_radius(dome_id, x, y):
+        r = query_radius
+        parameters = (dome_id, x - r, x + r, y - r, y + r, x, x, y, y, r * r)
+        return connection.execute(radius_query, parameters).fetchall()
+
+    def index_within_radius(dome_id, x, y):
+        return spatial_index.within_radius(dome_id, x, y, query_radius)
+
+    for query in queries:
+        assert sorted(sql_within_radius(*query)) == sorted(index_within_radius(*query))
+
+    sql_scan_time = time_per_call(sql_within_radius, queries[:10])
+    connection.execute(
+        "CREATE INDEX ix_world_entity_location ON world_entity (location_dome_id, location_x, location_y)"
+    )
+    sql_index_time = time_per_call(sql_within_radius, queries)
+    index_time = time_per_call(index_within_radius, queries)
+
+    print(f"Entities within {query_radius} m of a point:")
+    print(f"  SQL, full table scan   {sql_scan_time * 1e6:>10.1f} us")
+    print(f"  SQL, location index    {sql_index_time * 1e6:>10.1f} us")
+    print(f"  spatial index          {index_time * 1e6:>10.1f} us")
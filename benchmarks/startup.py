@@ -0,0 +1,145 @@
+"""
+Measures how long a server worker takes to start: importing the app, the first
+requests it serves, and spawning a worker process. Workers are spawned either
+cold, by starting a new interpreter that imports the app (gunicorn without
+--preload), or by forking a process that has already imported and preloaded
+the app (gunicorn --preload). Also measures the db.create_all() schema check
+that every worker used to run as it started.
+
+Uses its own SQLite database. Run from the project root directory with:
+    python3 benchmarks/startup.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+resource_type_count = 10_000
+
+# Run in a new interpreter, printing the seconds taken by each step
+create_app_code = """
+import os, sys, time
+start = time.perf_counter()
+sys.path.append(os.getcwd())
+from app import create_app
+from config import Config
+imported = time.perf_counter()
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ["BENCHMARK_DATABASE_URI"]
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+app = create_app(BenchmarkConfig)
+created = time.perf_counter()
+"""
+import_code = create_app_code + "print(imported - start)"
+requests_code = (
+    create_app_code
+    + """
+client = app.test_client()
+timings = []
+for url in ["/api/", "/api/", "/api/domes/components", "/api/domes/components"]:
+    request_start = time.perf_counter()
+    assert client.get(url).status_code == 200
+    timings.append(time.perf_counter() - request_start)
+print(*timings)
+"""
+)
+
+
+def run_python(code, database_uri):
+    """Run code in a new interpreter, and return the numbers that it prints."""
+    environment = dict(os.environ, BENCHMARK_DATABASE_URI=database_uri)
+    output = subprocess.run([sys.executable, "-c", code], env=environment, stdout=subprocess.PIPE, check=True).stdout
+    return [float(number) for number in output.split()]
+
+
+def spawn_cold_worker(database_uri):
+    """Start a new interpreter that imports the app and serves one request, and
+    return how long it took to serve it."""
+    start = time.perf_counter()
+    run_python(requests_code, database_uri)
+    return time.perf_counter() - start
+
+
+def spawn_forked_worker(app):
+    """Fork a worker from this process, which has already preloaded the app, and
+    return how long the worker took to serve one request."""
+    from app import dispose_engine
+
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        # The worker, doing what gunicorn's post_fork hook does
+        dispose_engine(app)
+        client = app.test_client()
+        client.get("/api/")
+        client.get("/api/domes/components")
+        os.write(write_fd, b"1")
+        os._exit(0)
+    os.read(read_fd, 1)
+    seconds = time.perf_counter() - start
+    os.waitpid(pid, 0)
+    os.close(read_fd)
+    os.close(write_fd)
+    return seconds
+
+
+def print_timing(name, timings):
+    print(f"  {name:<36} {statistics.median(timings) * 1e3:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    from app import create_app, db, preload_app
+    from app.models import ResourceType
+    from config import Config
+
+    database_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    database_uri = f"sqlite:///{database_file.name}"
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        # SQLite databases aren't pooled
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            ResourceType.__table__.insert(),
+            [dict(name=f"resource type {i}", mass=1, volume=1) for i in range(resource_type_count)],
+        )
+        db.session.commit()
+
+        # The schema check that each worker used to run at startup
+        schema_check_timings = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            db.create_all()
+            schema_check_timings.append(time.perf_counter() - start)
+        db.session.remove()
+
+    print(f"Median of {RUNS} runs, {resource_type_count} resource types")
+    print_timing("import app", [run_python(import_code, database_uri)[0] for _ in range(RUNS)])
+    print_timing("db.create_all() schema check", schema_check_timings)
+    request_timings = list(zip(*[run_python(requests_code, database_uri) for _ in range(RUNS)]))
+    print_timing("first request (GET /api/)", request_timings[0])
+    print_timing("second request (GET /api/)", request_timings[1])
+    print_timing("first dome graph request", request_timings[2])
+    print_timing("second dome graph request", request_timings[3])
+
+    print_timing("spawn cold worker", [spawn_cold_worker(database_uri) for _ in range(RUNS)])
+    start = time.perf_counter()
+    preload_app(app)
+    print_timing("preload app", [time.perf_counter() - start])
+    print_timing("fork preloaded worker", [spawn_forked_worker(app) for _ in range(RUNS)])
+    os.remove(database_file.name)
@@ -0,0 +1,77 @@
+"""
+Measures how many wallet transfers per second can be made through the database
+configured for the app. The 'one at a time' case loads both wallets through
+the ORM, changes them and records a transaction event per transfer, committing
+each transfer on its own. The batched cases go through transfers.apply_transfers,
+which locks every wallet in a batch at once and writes the batch with one
+statement per table.
+
+Creates its own wallets. Run from the project root directory with:
+    python3 benchmarks/wallet_transfers.py
+"""
+
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the benchmarks/ directory.
+sys.path.append(os.getcwd())
+
+from app import app, db
+from app.models import Entity, FinancialTransaction, TransactionEvent, Wallet
+from app.modules import transfers
+
+wallet_count = 1000
+transfer_count = 5000
+
+
+def transfer_one_at_a_time(transfer):
+    sending_wallet = db.session.query(Wallet).with_for_update().get(transfer.sending_wallet_id)
+    receiving_wallet = db.session.query(Wallet).with_for_update().get(transfer.receiving_wallet_id)
+    sending_wallet.value -= transfer.value
+    receiving_wallet.value += transfer.value
+    db.session.add(
+        FinancialTransaction(
+            value=transfer.value,
+            sending_wallet=sending_wallet,
+            receiving_wallet=receiving_wallet,
+            transaction_event=TransactionEvent(),
+        )
+    )
+    db.session.commit()
+
+
+def benchmark(name, function, batches):
+    start = time.perf_counter()
+    for batch in batches:
+        function(batch)
+    seconds = time.perf_counter() - start
+    print(f"{name:<24} {transfer_count / seconds:>10.0f} transfers/s")
+
+
+def apply_batch(batch):
+    transfers.apply_transfers(batch)
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        entities = [Entity() for _ in range(wallet_count)]
+        db.session.add_all(entities)
+        db.session.commit()
+        wallet_ids = [entity.wallet_id for entity in entities]
+
+        # Small transfers between random pairs of wallets, which every wallet can afford
+        rng = random.Random(0)
+        transfer_list = []
+        for _ in range(transfer_count):
+            sending_wallet_id, receiving_wallet_id = rng.sample(wallet_ids, 2)
+            transfer_list.append(transfers.Transfer(sending_wallet_id, receiving_wallet_id, Decimal("0.01")))
+
+        benchmark("one at a time", transfer_one_at_a_time, transfer_list)
+        for batch_size in (1, 10, 100, 1000):
+            batches = [transfer_list[i : i + batch_size] for i in range(0, transfer_count, batch_size)]
+            benchmark(f"batches of {batch_size}", apply_batch, batches)
@@ -0,0 +1,19 @@
+# Gunicorn settings, used by start_server and config/supervisor.conf
+
+# Listen on localhost:8004 with 4 worker processes of 4 threads each. Threads
+# let cheap requests be served while other requests wait on password hashing.
+bind = "localhost:8004"
+workers = 4
+threads = 4
+
+# Import the app once, in the master process, and fork the workers from it, so
+# that workers start quickly and share the memory used by static game data
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Workers open their own database connections, rather than sharing any
+    # inherited from the master process
+    from app import app, dispose_engine
+
+    dispose_engine(app)
@@ -1 +1,5 @@
-from app import app
+from app import app, preload_app
+
+# Load static game data up front. When served with gunicorn --preload, this is
+# done once, before the worker processes are forked.
+preload_app(app)
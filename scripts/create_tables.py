@@ -1,7 +1,7 @@
 """
 Runs sqlalchemy.create_all() to generate all database tables before the server
-is first started. If the tables were to be generated by the server as it starts
-up, they'll be generated correctly but will cause the server program to crash.
+is first started. The server never creates tables itself, so that starting a
+worker doesn't touch the database schema.
 """
 
 import os
@@ -11,14 +11,7 @@ import sys
 # while this script is inside the scripts/ directory.
 sys.path.append(os.getcwd())
 
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from config import Config
+from app import app, db
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-
-from app import models
-
-db.create_all()
+with app.app_context():
+    db.create_all()
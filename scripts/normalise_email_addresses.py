@@ -0,0 +1,50 @@
+"""
+Strips surrounding whitespace from every stored email address, lower-cases it,
+and recomputes its hash, as sign-ins look email addresses up by the hash of the
+normalised address. Must be run once on databases created before email addresses
+were normalised, as accounts with upper-case or padded email addresses can't
+sign in until then.
+
+Addresses that normalise to an address that's already stored can't both be
+kept, so they're left as they are and reported, to be merged by hand. Pass
+--dry-run to only report what would change.
+"""
+
+import os
+import sys
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the scripts/ directory.
+sys.path.append(os.getcwd())
+
+from app import app, db
+from app.models import EmailAddress, hash_email_address, normalise_email_address
+from app.routes.api import sign_ups
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv[1:]
+    with app.app_context():
+        rows = db.session.query(EmailAddress.id, EmailAddress.email_address, EmailAddress.hash).all()
+        ids_by_hash = {bytes(email_hash): email_id for email_id, _, email_hash in rows}
+        updates = []
+        conflicts = []
+        for email_id, email_address, email_hash in rows:
+            normalised_address = normalise_email_address(email_address)
+            normalised_hash = hash_email_address(normalised_address)
+            if normalised_address == email_address and normalised_hash == bytes(email_hash):
+                continue
+            if ids_by_hash.get(normalised_hash, email_id) != email_id:
+                conflicts.append((email_id, email_address, ids_by_hash[normalised_hash]))
+                continue
+            del ids_by_hash[bytes(email_hash)]
+            ids_by_hash[normalised_hash] = email_id
+            updates.append({"id": email_id, "email_address": normalised_address, "hash": normalised_hash})
+        if updates and not dry_run:
+            db.session.bulk_update_mappings(EmailAddress, updates)
+            db.session.commit()
+            # Bulk updates don't run the ORM events that add new hashes to the workers' email filters
+            sign_ups.append(sorted(update["hash"].hex() for update in updates))
+    for email_id, email_address, existing_id in conflicts:
+        print(f"Email address #{email_id} '{email_address}' normalises to the same address as #{existing_id}")
+    print(f"{len(updates)} email addresses {'need to be' if dry_run else 'have been'} normalised.")
+    print(f"{len(conflicts)} email addresses conflict with an existing address.")
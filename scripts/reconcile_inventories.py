@@ -0,0 +1,26 @@
+"""
+Recomputes the item count, total mass and total volume of every inventory from
+its resources, and reports any inventory whose stored totals have drifted from
+them. Pass --fix to overwrite the drifted totals with the recomputed ones.
+
+Should be run after adding the total columns to an existing database, and can
+be run regularly (eg. from cron) to catch resources changed outside of the ORM.
+"""
+
+import os
+import sys
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the scripts/ directory.
+sys.path.append(os.getcwd())
+
+from app import app
+from app.modules.inventories import reconcile_inventory_totals
+
+if __name__ == "__main__":
+    fix = "--fix" in sys.argv[1:]
+    with app.app_context():
+        drifts = reconcile_inventory_totals(fix=fix)
+    for drift in drifts:
+        print(f"Inventory #{drift.inventory_id}: stored {tuple(drift.stored)}, actual {tuple(drift.actual)}")
+    print(f"{len(drifts)} inventories have drifted" + (", and have been fixed." if fix and drifts else "."))
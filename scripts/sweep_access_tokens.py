@@ -0,0 +1,32 @@
+"""
+Deletes expired access tokens from the database, in small batches so that
+logins aren't held up. By default, sweeps once and exits, so it can be run from
+cron. If an interval in seconds is given, it instead sweeps repeatedly, waiting
+that long between sweeps, so it can be run under supervisor.
+
+Run from the project root directory with:
+    python3 scripts/sweep_access_tokens.py [interval]
+"""
+
+import json
+import os
+import sys
+import time
+
+# Append parent directory to python path. Allows the Flask app to be imported
+# while this script is inside the scripts/ directory.
+sys.path.append(os.getcwd())
+
+from app import app
+from app.modules.token_sweeper import TokenSweeper
+
+if __name__ == "__main__":
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    sweeper = TokenSweeper()
+    with app.app_context():
+        while True:
+            sweeper.sweep()
+            print(json.dumps(sweeper.stats()), flush=True)
+            if interval is None:
+                break
+            time.sleep(interval)
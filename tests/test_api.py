@@ -33,6 +33,22 @@ def test_generate_random_profile_image():
     image_string = r.json()["image"]
     assert len(image_string) == 172
 
+    # Get a batch of randomly generated images
+    r = requests.get(f"{API_URL}/generators/profile_image", params={"count": 5, "seed": 1})
+    r.raise_for_status()
+    assert len(r.json()["images"]) == 5
+    assert all(len(image_string) == 172 for image_string in r.json()["images"])
+
+    # Get the same batch again by reusing the seed
+    r2 = requests.get(f"{API_URL}/generators/profile_image", params={"count": 5, "seed": 1})
+    assert r.json() == r2.json()
+
+    # Attempt to get a batch of an invalid size
+    r = requests.get(f"{API_URL}/generators/profile_image", params={"count": "many"})
+    assert_http_error(r, 400, "MalformedParameterError")
+    r = requests.get(f"{API_URL}/generators/profile_image", params={"count": 0})
+    assert_http_error(r, 400, "MalformedParameterError")
+
 
 def test_create_account():
     ENDPOINT_URL = f"{API_URL}/accounts/"
@@ -95,6 +111,11 @@ def test_create_profile():
     r = requests.post(f"{API_URL}/profiles/", json={"account_id": 2, "name": "Test Profile"}, headers=headers)
     assert_http_error(r, 403, "UnauthorizedAccessError")
 
+    # Attempt to create a profile with a picture that isn't a valid profile image
+    body = {"account_id": 1, "name": "Test Profile", "picture": "AAAA"}
+    r = requests.post(f"{API_URL}/profiles/", json=body, headers=headers)
+    assert_http_error(r, 400, "MalformedFieldError")
+
     # Successfully create a profile
     r = requests.post(f"{API_URL}/profiles/", json={"account_id": 1, "name": "Test Profile"}, headers=headers)
     assert r.status_code == 201
@@ -120,3 +141,92 @@ def test_get_profile():
     assert r.status_code == 200
     assert "id" in r.json()
     assert "name" in r.json()
+
+
+def test_get_profile_picture():
+    headers = get_authorization_header("test@mail.com", "test")
+
+    # Fetch a profile picture as a .png file
+    r = requests.get(f"{API_URL}/profiles/1/picture.png", params={"scale": 4}, headers=headers)
+    assert r.status_code == 200
+    assert r.headers["Content-Type"] == "image/png"
+    assert r.content.startswith(b"\x89PNG")
+    assert "ETag" in r.headers
+
+    # Fetch the same picture again, using the ETag from the first request
+    conditional_headers = {"If-None-Match": r.headers["ETag"], **headers}
+    r2 = requests.get(f"{API_URL}/profiles/1/picture.png", params={"scale": 4}, headers=conditional_headers)
+    assert r2.status_code == 304
+
+    # Fetch a sprite sheet of several profile pictures
+    r = requests.get(f"{API_URL}/profiles/pictures.png", params={"ids": "1,1"}, headers=headers)
+    assert r.status_code == 200
+    assert r.content.startswith(b"\x89PNG")
+
+    # Attempt to fetch pictures without an access token, or with another account's token
+    r = requests.get(f"{API_URL}/profiles/1/picture.png")
+    assert_http_error(r, 401, "NoAuthorizationSuppliedError")
+    r = requests.get(f"{API_URL}/profiles/pictures.png", params={"ids": "1"})
+    assert_http_error(r, 401, "NoAuthorizationSuppliedError")
+    requests.post(f"{API_URL}/accounts/", json={"email_address": "other@mail.com", "password": "other"})
+    other_headers = get_authorization_header("other@mail.com", "other")
+    r = requests.get(f"{API_URL}/profiles/1/picture.png", headers=other_headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+    r = requests.get(f"{API_URL}/profiles/pictures.png", params={"ids": "1"}, headers=other_headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+
+    # Attempt to fetch pictures of profiles that don't exist, which isn't revealed to non-developers
+    r = requests.get(f"{API_URL}/profiles/1000/picture.png", headers=headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+    r = requests.get(f"{API_URL}/profiles/pictures.png", params={"ids": "1,1000"}, headers=headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+
+    # Attempt to fetch pictures at an invalid scale, or a sprite sheet with too many pixels
+    r = requests.get(f"{API_URL}/profiles/1/picture.png", params={"scale": 0}, headers=headers)
+    assert_http_error(r, 400, "MalformedParameterError")
+    r = requests.get(f"{API_URL}/profiles/pictures.png", params={"ids": ",".join(["1"] * 100), "scale": 32})
+    assert_http_error(r, 400, "MalformedParameterError")
+
+
+def test_logout():
+    headers = get_authorization_header("test@mail.com", "test")
+
+    # Use the access token, so that it's cached by the server
+    r = requests.get(f"{API_URL}/accounts/1", headers=headers)
+    assert r.status_code == 200
+
+    # Only developers can see cache statistics
+    r = requests.get(f"{API_URL}/caches", headers=headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+
+    # Revoke the access token, after which no server worker accepts it
+    r = requests.post(f"{API_URL}/logout", headers=headers)
+    assert r.status_code == 204
+    r = requests.get(f"{API_URL}/accounts/1", headers=headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+    r = requests.post(f"{API_URL}/logout", headers=headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
+
+
+def test_create_profiles():
+    headers = get_authorization_header("test@mail.com", "test")
+    ENDPOINT_URL = f"{API_URL}/profiles/batch"
+
+    # Successfully create several profiles at once
+    body = {"profiles": [{"account_id": 1, "name": "Batch Profile 1"}, {"account_id": 1, "name": "Batch Profile 2"}]}
+    r = requests.post(ENDPOINT_URL, json=body, headers=headers)
+    assert r.status_code == 201
+    assert [profile["name"] for profile in r.json()["profiles"]] == ["Batch Profile 1", "Batch Profile 2"]
+    assert all(len(profile["picture"]) == 172 for profile in r.json()["profiles"])
+
+    # Fail to create a batch containing an existing profile name, without creating the other profiles
+    body = {"profiles": [{"account_id": 1, "name": "Batch Profile 3"}, {"account_id": 1, "name": "Batch Profile 1"}]}
+    r = requests.post(ENDPOINT_URL, json=body, headers=headers)
+    assert_http_error(r, 409, "ResourceAlreadyExistsError")
+    r = requests.get(f"{API_URL}/accounts/1", headers=headers)
+    assert "Batch Profile 3" not in [profile["name"] for profile in r.json()["profiles"]]
+
+    # Attempt to create profiles for a different account to the current one
+    body = {"profiles": [{"account_id": 2, "name": "Batch Profile 4"}]}
+    r = requests.post(ENDPOINT_URL, json=body, headers=headers)
+    assert_http_error(r, 403, "UnauthorizedAccessError")
@@ -0,0 +1,78 @@
+import os
+import secrets
+import sys
+import tempfile
+
+sys.path.append(os.getcwd())
+
+
+from app.modules.bloom_filter import BloomFilter, KnownEmailFilter
+from app.modules.change_marker import ChangeLog
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(1000, error_rate=0.01)
+    hashes = [secrets.token_bytes(16) for _ in range(1000)]
+    for item_hash in hashes:
+        bloom_filter.add(item_hash)
+    assert all(item_hash in bloom_filter for item_hash in hashes)
+    false_positives = sum(secrets.token_bytes(16) in bloom_filter for _ in range(10000))
+    assert false_positives < 300
+
+
+def test_known_email_filter():
+    """Test that misses are only trusted once the filter has caught up with the
+    sign-ups log, so that an address is never turned away, and that new addresses
+    are added to the filter without rebuilding it."""
+    hashes = [secrets.token_bytes(16) for _ in range(10)]
+    sign_ups = ChangeLog()
+    known_emails = KnownEmailFilter(lambda: list(hashes), sign_ups, min_rebuild_interval=0)
+    # Every address may exist until the filter has been built in the background
+    new_hash = secrets.token_bytes(16)
+    assert known_emails.might_exist(new_hash)
+    known_emails._rebuild_thread.join()
+    assert known_emails.might_exist(hashes[0])
+    assert not known_emails.might_exist(new_hash)
+
+    # An address added elsewhere, eg. committed out of ID order, is read from the log
+    hashes.insert(0, new_hash)
+    sign_ups.append([new_hash.hex()])
+    assert known_emails.might_exist(new_hash)
+    assert not known_emails.might_exist(secrets.token_bytes(16))
+    assert known_emails.rebuilds == 1
+
+    # If the log has been started afresh, misses aren't trusted until the filter has been rebuilt
+    sign_ups.max_size = 0
+    other_hash = secrets.token_bytes(16)
+    hashes.append(other_hash)
+    sign_ups.append([secrets.token_bytes(16).hex()])
+    assert known_emails.might_exist(other_hash)
+    known_emails._rebuild_thread.join()
+    assert known_emails.might_exist(other_hash)
+    assert not known_emails.might_exist(secrets.token_bytes(16))
+    assert known_emails.rebuilds == 2
+
+
+def test_sign_ups_shared_between_workers():
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "sign-ups")
+        workers = [ChangeLog(file_name), ChangeLog(file_name)]
+        # Items appended to a file created after a position was taken are all read
+        position = workers[1].position()
+        workers[0].append(["a", "b"])
+        position, items = workers[1].read(position)
+        assert items == ["a", "b"]
+        position, items = workers[1].read(position)
+        assert items == []
+        workers[0].append(["c"])
+        position, items = workers[1].read(position)
+        assert items == ["c"]
+
+        # Readers are told that they've missed items once the file is started afresh
+        workers[0].max_size = 0
+        workers[0].append(["d"])
+        position, items = workers[1].read(position)
+        assert items is None
+        workers[0].max_size = 1024
+        workers[0].append(["e"])
+        assert workers[1].read(position)[1] == ["e"]
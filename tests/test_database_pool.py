@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, exc
+
+sys.path.append(os.getcwd())
+
+
+from app import app
+from app.modules.pool_monitor import PoolMonitor
+from tests.test_queries import create_accounts
+
+
+def test_saturated_pool():
+    """Test that checkouts from a saturated pool are counted as waits, overflow,
+    and timeouts, by holding more connections at once than the pool allows."""
+    monitor = PoolMonitor()
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{directory}/pool.db",
+            poolclass=monitor.create_pool_class(),
+            pool_size=2,
+            max_overflow=1,
+            pool_timeout=0.2,
+            connect_args={"check_same_thread": False},
+        )
+        thread_count = 6
+        barrier = threading.Barrier(thread_count)
+        results = []
+
+        def hold_connection():
+            barrier.wait()
+            try:
+                with engine.connect() as connection:
+                    connection.execute("SELECT 1")
+                    time.sleep(0.5)
+                results.append("connected")
+            except exc.TimeoutError:
+                results.append("timed out")
+
+        threads = [threading.Thread(target=hold_connection) for _ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = monitor.stats()
+        engine.dispose()
+
+    # Only pool_size + max_overflow connections can be held at once
+    assert results.count("connected") == 3
+    assert results.count("timed out") == 3
+    assert stats["checkouts"] == 3
+    assert stats["timeouts"] == 3
+    assert stats["max_connections_in_use"] == 3
+    assert stats["max_overflow_in_use"] == 1
+    assert stats["connections_in_use"] == 0
+    assert stats["max_wait_seconds"] >= 0.2
+    assert stats["pool_size"] == 2
+
+
+def test_database_pool_endpoint():
+    headers = create_accounts(0, 0)
+    r = app.test_client().get("/api/database_pool", headers=headers)
+    assert r.status_code == 200
+    assert "max_wait_seconds" in r.json
@@ -0,0 +1,63 @@
+import os
+import sys
+import uuid
+
+sys.path.append(os.getcwd())
+
+
+from app import app, db
+from app.models import Dome, DomeConnection
+from app.modules import dome_graph as dome_graph_module
+from app.modules.dome_graph import DomeGraph, get_dome_graph
+
+# Two groups of domes: a square of four domes with one diagonal tunnel, and a pair
+domes = [(1, 0, 0), (2, 3, 0), (3, 3, 4), (4, 0, 4), (10, 100, 100), (11, 100, 110)]
+connections = [(1, 2), (2, 3), (3, 4), (4, 1), (1, 3), (10, 11)]
+
+
+def test_shortest_path():
+    dome_graph = DomeGraph(domes, connections)
+    assert dome_graph.shortest_path(1, 3) == (5.0, [1, 3])
+    assert dome_graph.shortest_path(2, 4) == (7.0, [2, 1, 4])
+    # Reversed paths are served from the cache, and come back reversed
+    assert dome_graph.shortest_path(4, 2) == (7.0, [4, 1, 2])
+    assert dome_graph.path_cache.hits == 1
+    assert dome_graph.shortest_path(1, 1) == (0.0, [1])
+    assert dome_graph.shortest_path(1, 10) is None
+    # Domes in different components aren't searched for a path, or cached
+    assert len(dome_graph.path_cache) == 3
+
+
+def test_components_and_neighbourhoods():
+    dome_graph = DomeGraph(domes, connections)
+    assert sorted(dome_graph.connected_components()) == [[1, 2, 3, 4], [10, 11]]
+    assert dome_graph.is_reachable(2, 4)
+    assert not dome_graph.is_reachable(2, 11)
+    assert dome_graph.neighbourhood(2, 0) == [2]
+    assert dome_graph.neighbourhood(2, 1) == [1, 2, 3]
+    assert dome_graph.neighbourhood(2, 2) == [1, 2, 3, 4]
+
+
+def test_reloads_after_commits():
+    """Test that committed changes to domes and tunnels have the graph reloaded
+    in the background, while the old graph keeps being served."""
+    with app.app_context():
+        new_domes = [Dome(name=uuid.uuid4().hex[:32], diameter=100, world_location_x=0, world_location_y=0)]
+        new_domes.append(Dome(name=uuid.uuid4().hex[:32], diameter=100, world_location_x=30, world_location_y=40))
+        db.session.add_all(new_domes)
+        db.session.commit()
+        dome_ids = [dome.id for dome in new_domes]
+        old_dome_graph = dome_graph_module.load_dome_graph()
+        assert get_dome_graph() is old_dome_graph
+        assert not old_dome_graph.is_reachable(*dome_ids)
+
+        # Flushed changes aren't seen until they're committed
+        db.session.add(DomeConnection(dome_id_1=dome_ids[0], dome_id_2=dome_ids[1]))
+        db.session.flush()
+        assert get_dome_graph() is old_dome_graph
+        assert dome_graph_module._reload_thread is None or not dome_graph_module._reload_thread.is_alive()
+        db.session.commit()
+
+    assert get_dome_graph() is old_dome_graph
+    dome_graph_module._reload_thread.join()
+    assert get_dome_graph().shortest_path(*dome_ids) == (50.0, dome_ids)
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+from sqlalchemy import create_engine, Column, Integer, MetaData, Table
+from sqlalchemy.pool import StaticPool
+
+sys.path.append(os.getcwd())
+
+
+from app.modules.event_writer import BufferedEventWriter
+
+
+def create_writer(**kwargs):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    table = Table("event", MetaData(), Column("id", Integer, primary_key=True), Column("value", Integer))
+    table.create(engine)
+    return BufferedEventWriter(table, lambda: engine, **kwargs), engine
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_batches_and_close():
+    """Test that rows are written once a batch fills up, and that the rest are written on close."""
+    writer, engine = create_writer(max_batch_size=10, flush_interval=60)
+    for i in range(5):
+        writer.write({"value": i})
+    time.sleep(0.1)
+    assert writer.written == 0
+    assert writer.stats()["queue_depth"] == 5
+    for i in range(5, 10):
+        writer.write({"value": i})
+    wait_for(lambda: writer.written == 10)
+    assert writer.written == 10
+
+    for i in range(10, 13):
+        writer.write({"value": i})
+    writer.close()
+    assert [row.value for row in engine.execute("SELECT value FROM event ORDER BY id")] == list(range(13))
+    assert writer.stats()["queue_depth"] == 0
+    writer.write({"value": 13})
+    assert writer.dropped == 1
+
+
+def test_flush_interval_and_queue_limit():
+    writer, engine = create_writer(max_batch_size=100, flush_interval=0.05, max_queue_size=3)
+    for i in range(5):
+        writer.write({"value": i})
+    assert writer.dropped == 2
+    wait_for(lambda: writer.written == 3)
+    assert writer.written == 3
+    assert writer.flushes == 1
+    writer.close()
@@ -0,0 +1,71 @@
+import os
+import sys
+import uuid
+from decimal import Decimal
+
+sys.path.append(os.getcwd())
+
+
+from app import app, db
+from app.models import Asset, Entity, Inventory, Resource, ResourceType
+from app.modules.inventories import reconcile_inventory_totals
+
+
+def create_resource_type(mass, volume):
+    resource_type = ResourceType(name=uuid.uuid4().hex[:16], mass=Decimal(mass), volume=Decimal(volume))
+    db.session.add(resource_type)
+    return resource_type
+
+
+def create_resource(entity, inventory, resource_type):
+    resource = Resource(asset=Asset(entity=entity), inventory=inventory, resource_type=resource_type)
+    db.session.add(resource)
+    return resource
+
+
+def get_totals(inventory):
+    return (inventory.item_count, inventory.total_mass, inventory.total_volume)
+
+
+def test_inventory_totals():
+    """Test that inventory totals follow resources being added, moved and removed."""
+    with app.app_context():
+        entity = Entity()
+        ore = create_resource_type("2.5", "1")
+        heatsink = create_resource_type("0.25", "0.5")
+        inventory_1 = Inventory(quantity_limit=3, volume_limit=2.5)
+        inventory_2 = Inventory()
+        resources = [create_resource(entity, inventory_1, ore) for _ in range(2)]
+        resources.append(create_resource(entity, inventory_2, heatsink))
+        db.session.commit()
+        assert get_totals(inventory_1) == (2, 5, 2)
+        assert get_totals(inventory_2) == (1, Decimal("0.25"), Decimal("0.5"))
+        assert inventory_1.can_accept(heatsink.id)
+        assert not inventory_1.can_accept(ore.id)
+        assert not inventory_1.can_accept(heatsink.id, 2)
+        assert inventory_2.can_accept(ore.id, 1000)
+
+        # Move a resource to the other inventory, change the type of another, and delete the last
+        resources[0].inventory = inventory_2
+        resources[1].resource_type = heatsink
+        db.session.flush()
+        assert get_totals(inventory_1) == (1, Decimal("0.25"), Decimal("0.5"))
+        db.session.delete(resources[2])
+        db.session.commit()
+        assert get_totals(inventory_2) == (1, Decimal("2.5"), 1)
+        assert inventory_1.id not in [drift.inventory_id for drift in reconcile_inventory_totals()]
+
+
+def test_reconcile_inventory_totals():
+    with app.app_context():
+        inventory = Inventory()
+        create_resource(Entity(), inventory, create_resource_type("3", "2"))
+        db.session.commit()
+        # Simulate drift, eg. from resources changed outside of the ORM
+        inventory.item_count = 5
+        db.session.commit()
+        drifts = reconcile_inventory_totals(fix=True)
+        assert [drift.inventory_id for drift in drifts] == [inventory.id]
+        assert drifts[0].stored.item_count == 5
+        assert get_totals(inventory) == (1, 3, 2)
+        assert reconcile_inventory_totals() == []
@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+import pytest
+
+sys.path.append(os.getcwd())
+
+
+from app import exceptions
+from app.modules.passwords import PasswordHashingService
+
+
+def test_timed_out_jobs_keep_their_slots():
+    """Test that a job that times out still counts towards the limit until it finishes."""
+    service = PasswordHashingService(processes=1, queue_depth=0, work_factor=4)
+    try:
+        # Start the pool process before anything is timed
+        assert service.check_password("password", service.hash_password("password"))
+        service.timeout = 0.1
+        with pytest.raises(exceptions.ServiceUnavailableError):
+            service._run(time.sleep, 1)
+        with pytest.raises(exceptions.ServiceUnavailableError) as error:
+            service._run(time.sleep, 0)
+        assert "Too many" in error.value.message
+        time.sleep(1.5)
+        service.timeout = None
+        assert service._run(time.sleep, 0) is None
+    finally:
+        service.shutdown()
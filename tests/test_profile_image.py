@@ -4,9 +4,22 @@ import sys
 sys.path.append(os.getcwd())
 
 
+from PIL import Image
 from app.modules.profile_image import generate_profile_image, ProfileImage
 
 
+def apply_image_file_as_mask(profile_image, mask_image_file_path, colour_index):
+    """Apply a mask .png file to an image pixel by pixel, the way it was done
+    before masks were decoded once and cached, to test the cached masks against."""
+    mask_image = Image.open(mask_image_file_path).convert("RGBA")
+    black = (0, 0, 0, 255)
+    mask_image.putdata([black if pixel[3] < 128 else pixel for pixel in mask_image.getdata()])
+    mask_image = mask_image.convert("L").resize((profile_image.width, profile_image.height), Image.NEAREST)
+    for i, value in enumerate(mask_image.getdata()):
+        if value > 128:
+            profile_image.set_pixel(i % profile_image.width, i // profile_image.width, colour_index)
+
+
 def test_profile_image_serialisation():
     """Test that the serialisation methods on ProfileImage don't change the image."""
     p1 = generate_profile_image()
@@ -22,3 +35,44 @@ def test_profile_image_serialisation():
     # Test int serialisation
     p2 = ProfileImage.from_int(int(p1))
     assert p1 == p2
+
+
+def test_precomputed_masks_match_image_files():
+    """Test that applying a cached mask gives the same image as reading the mask file."""
+    from app.modules.profile_image.generator import border_masks, icon_masks
+
+    for mask_set in [border_masks, icon_masks]:
+        for path, mask in zip(mask_set.paths, mask_set):
+            p1 = ProfileImage()
+            p1.fill(10)
+            apply_image_file_as_mask(p1, path, 3)
+            p2 = ProfileImage()
+            p2.fill(10)
+            p2.apply_mask(mask, 3)
+            assert p1 == p2
+
+
+def test_profile_image_pixel_access():
+    """Test that pixels can be read and written through every access method."""
+    p1 = ProfileImage()
+    p1.fill(14)
+    p1.set_pixel(3, 0, 5)
+    p1.image[15][8] = 9
+    assert p1.image[0][3] == 5
+    assert p1.get_pixel(8, 15) == 9
+    assert p1.image[1][1] == 14
+    assert bytes(p1)[1] == 0xE5
+    assert p1.to_PIL_image().getpixel((3, 0)) == (1, 229, 242)
+
+
+def test_generate_profile_images():
+    """Test that batches of generated images are well-formed and reproducible from a seed."""
+    from app.modules.profile_image import generate_profile_images
+
+    images = generate_profile_images(50, seed=1234)
+    assert len(images) == 50
+    assert images == generate_profile_images(50, seed=1234)
+    for image in images:
+        assert ProfileImage.from_bytes(bytes(image)) == image
+        # Every image has a background, border and icon colour
+        assert 2 <= len(set(image.pixel_bytes())) <= 3
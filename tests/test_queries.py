@@ -0,0 +1,215 @@
+import json
+import os
+import sys
+import uuid
+from datetime import timedelta
+
+sys.path.append(os.getcwd())
+
+
+from app import app, db
+from app.models import Account, AccessToken, EmailAddress, Entity, Profile
+from app.modules.profile_image import generate_profile_image
+from app.modules.query_counter import assert_max_queries, QueryCounter
+from app.routes.api import known_emails
+
+# Keep password hashing fast, since these tests create many accounts
+app.config["PASSWORD_HASHING_WORK_FACTOR"] = 4
+
+
+def create_accounts(account_count, profiles_per_account):
+    """Create accounts with profiles directly in the database, and return an
+    authorization header for a developer account."""
+    with app.app_context():
+        run_id = uuid.uuid4().hex[:8]
+        for i in range(account_count):
+            email_address = EmailAddress(f"query-test-{run_id}-{i}@mail.com")
+            account = Account(email_address=email_address, password="test")
+            db.session.add(account)
+            for j in range(profiles_per_account):
+                entity = Entity()
+                profile = Profile(
+                    account=account, name=f"{run_id}-{i}-{j}", picture=generate_profile_image(), entity=entity
+                )
+                db.session.add(profile)
+        developer = Account(email_address=EmailAddress(f"query-test-{run_id}@mail.com"), password="test")
+        developer.is_developer = True
+        token = AccessToken(account=developer, duration=timedelta(hours=1))
+        db.session.add(token)
+        db.session.commit()
+        return {"Authorization": f"Bearer {token.token}"}
+
+
+def test_listing_query_counts():
+    """Test that listing accounts and profiles takes the same number of queries
+    no matter how many accounts and profiles there are."""
+    headers = create_accounts(10, 3)
+    client = app.test_client()
+
+    with assert_max_queries(db.engine, 4):
+        r = client.get("/api/accounts/", headers=headers)
+    assert r.status_code == 200
+    assert all("profiles" in account for account in r.json["accounts"])
+
+    with assert_max_queries(db.engine, 3):
+        r = client.get("/api/profiles/", headers=headers)
+    assert r.status_code == 200
+    assert all("wallet" in profile["entity"] for profile in r.json["profiles"])
+
+    account_id = r.json["profiles"][0]["account"]["id"]
+    with assert_max_queries(db.engine, 2):
+        r = client.get(f"/api/accounts/{account_id}", headers=headers)
+    assert r.status_code == 200
+
+
+def test_listing_pagination():
+    """Test that paging through a listing, or streaming it, returns every resource once."""
+    headers = create_accounts(7, 1)
+    client = app.test_client()
+
+    r = client.get("/api/profiles/", headers=headers, query_string={"include_count": "true"})
+    profile_count = r.json["count"]
+
+    # Page through every profile, 3 at a time
+    profile_ids = []
+    after = 0
+    while after is not None:
+        r = client.get("/api/profiles/", headers=headers, query_string={"limit": 3, "after": after})
+        assert r.status_code == 200
+        assert len(r.json["profiles"]) <= 3
+        profile_ids += [profile["id"] for profile in r.json["profiles"]]
+        after = r.json["next"]
+    assert profile_ids == sorted(set(profile_ids))
+    assert len(profile_ids) == profile_count
+
+    # Stream every profile as newline-delimited JSON
+    r = client.get("/api/profiles/", headers=headers, query_string={"stream": "ndjson"})
+    assert r.status_code == 200
+    streamed_profiles = [json.loads(line) for line in r.data.decode("utf-8").splitlines()]
+    assert [profile["id"] for profile in streamed_profiles] == profile_ids
+
+
+def test_login_query_count():
+    """Test that signing in fetches the account in one query and inserts the token
+    in another, and that unknown email addresses don't reach the database at all."""
+    create_accounts(1, 2)
+    with app.app_context():
+        email_address = str(Account.query.order_by(Account.id.desc()).offset(1).first().email_address)
+    client = app.test_client()
+    body = {"email_address": email_address.upper(), "password": "test"}
+    client.post("/api/login", json=body)
+
+    with QueryCounter(db.engine) as counter:
+        r = client.post("/api/login", json=body)
+    assert r.status_code == 200
+    assert len(r.json["account"]["profiles"]) == 2
+    # Every statement is counted, so that savepoints around the token insert would be too
+    assert [statement.split()[0] for statement in counter.statements] == ["SELECT", "INSERT"]
+
+    # Unknown email addresses are turned away without a query, once the filter has been built
+    known_emails.rebuild()
+    with assert_max_queries(db.engine, 0):
+        r = client.post("/api/login", json={"email_address": "nobody@mail.com", "password": "test"})
+    assert r.status_code == 403
+
+    # Email addresses added since are read from the sign-ups log, without rebuilding the filter
+    rebuilds = known_emails.rebuilds
+    create_accounts(1, 0)
+    with app.app_context():
+        email_address = str(Account.query.order_by(Account.id.desc()).offset(1).first().email_address)
+    r = client.post("/api/login", json={"email_address": email_address, "password": "test"})
+    assert r.status_code == 200
+    with assert_max_queries(db.engine, 0):
+        r = client.post("/api/login", json={"email_address": "nobody@mail.com", "password": "test"})
+    assert r.status_code == 403
+    assert known_emails.rebuilds == rebuilds
+
+
+def test_profile_batch_query_count():
+    """Test that creating a batch of profiles inserts each table's rows with one
+    statement, no matter how many profiles there are."""
+    headers = create_accounts(1, 0)
+    with app.app_context():
+        account_id = Account.query.order_by(Account.id.desc()).offset(1).first().id
+    client = app.test_client()
+    names = [f"batch-{uuid.uuid4().hex[:8]}-{i}" for i in range(50)]
+    body = {"profiles": [{"account_id": account_id, "name": name} for name in names]}
+
+    with QueryCounter(db.engine) as counter:
+        r = client.post("/api/profiles/batch", json=body, headers=headers)
+    assert r.status_code == 201
+    assert len([statement for statement in counter.statements if statement.startswith("INSERT")]) == 3
+    assert counter.count <= 6
+    profiles = r.json["profiles"]
+    assert [profile["name"] for profile in profiles] == names
+    assert len({profile["entity"]["wallet"]["id"] for profile in profiles}) == len(names)
+    assert all(profile["entity"]["wallet"]["value"] == 100 for profile in profiles)
+    with app.app_context():
+        for profile in profiles:
+            stored_profile = Profile.query.get(profile["id"])
+            assert stored_profile.name == profile["name"]
+            assert stored_profile.account_id == account_id
+            assert stored_profile.entity.wallet_id == profile["entity"]["wallet"]["id"]
+
+
+def test_conditional_gets():
+    """Test that accounts and profiles have ETags that change with their wallets,
+    profiles and email addresses, and that unchanged ones are answered with a 304
+    without being loaded."""
+    headers = create_accounts(1, 2)
+    with app.app_context():
+        account = Account.query.order_by(Account.id.desc()).offset(1).first()
+        account_id = account.id
+        profile_id, other_profile_id = [profile.id for profile in account.profiles]
+        wallet_id, other_wallet_id = [profile.entity.wallet_id for profile in account.profiles]
+    client = app.test_client()
+
+    for url in (f"/api/accounts/{account_id}", f"/api/profiles/{profile_id}"):
+        r = client.get(url, headers=headers)
+        assert r.status_code == 200
+        etag = r.headers["ETag"]
+        assert r.cache_control.no_cache
+
+        # Unchanged resources are only checked with a single query
+        with assert_max_queries(db.engine, 1):
+            r = client.get(url, headers={**headers, "If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.headers["ETag"] == etag
+
+        # Wallet transfers change the ETag
+        transfer = {"sending_wallet_id": other_wallet_id, "receiving_wallet_id": wallet_id, "value": 1}
+        r = client.post("/api/transactions/batch", headers=headers, json={"transfers": [transfer]})
+        assert r.status_code == 201
+        r = client.get(url, headers={**headers, "If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+        etag = r.headers["ETag"]
+
+        # So do changes to profiles
+        with app.app_context():
+            profile = Profile.query.get(profile_id)
+            profile.name = profile.name[::-1]
+            db.session.commit()
+        r = client.get(url, headers={**headers, "If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+        etag = r.headers["ETag"]
+
+        # And to email addresses, including bulk updates like those of the normalisation script
+        with app.app_context():
+            email_address_id = Account.query.get(account_id).email_address_id
+            email_address = f"changed-{profile_id}-{len(url)}@mail.com"
+            update = {"id": email_address_id, "email_address": email_address}
+            db.session.bulk_update_mappings(EmailAddress, [update])
+            db.session.commit()
+        r = client.get(url, headers={**headers, "If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+        account_info = r.json if "email_address" in r.json else r.json["account"]
+        assert account_info["email_address"] == email_address
+
+    # Cached responses are served from the response cache without being loaded
+    with assert_max_queries(db.engine, 1):
+        r = client.get(f"/api/profiles/{profile_id}", headers=headers)
+    assert r.status_code == 200
+    assert r.json["id"] == profile_id
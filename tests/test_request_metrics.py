@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import pytest
+
+sys.path.append(os.getcwd())
+
+
+from app import app
+from app.modules.request_metrics import RequestMetrics, format_prometheus, read_totals
+from app.routes.api import request_metrics
+from tests.test_queries import create_accounts
+
+
+def get_sample(metrics_text, name, endpoint):
+    match = re.search(rf'^{name}{{endpoint="{endpoint}"}} (\S+)$', metrics_text, re.MULTILINE)
+    return float(match.group(1))
+
+
+def test_totals_shared_between_workers():
+    with tempfile.TemporaryDirectory() as directory:
+        workers = [RequestMetrics(directory, write_interval=0), RequestMetrics(directory, write_interval=0)]
+        for i, worker in enumerate(workers):
+            for _ in range(i + 1):
+                worker.start_request()
+                worker.finish_request("api.index", 10)
+        totals = workers[0].collect()
+        assert totals["api.index"]["requests"] == 3
+        assert totals["api.index"]["response_bytes"] == 30
+        assert sum(totals["api.index"]["buckets"]) == 3
+        metrics_text = format_prometheus(totals)
+        assert 'doctrine_request_duration_seconds_bucket{endpoint="api.index",le="+Inf"} 3' in metrics_text
+
+        # The totals of workers that have exited are kept, in a single file
+        with open(os.path.join(directory, "999999999-1.json"), "w") as file:
+            json.dump(totals, file)
+        assert workers[0].collect()["api.index"]["requests"] == 6
+        assert workers[0].collect()["api.index"]["requests"] == 6
+        assert "999999999-1.json" not in os.listdir(directory)
+
+        workers[0].clear()
+        assert os.listdir(directory) == []
+        for worker in workers:
+            worker.directory = None
+
+
+def test_concurrent_writes(caplog):
+    """Test that threads writing at the same time never leave a partly written file,
+    or fail to write because another thread moved their temporary file."""
+    with tempfile.TemporaryDirectory() as directory:
+        worker = RequestMetrics(directory, write_interval=0)
+        worker.start_request()
+        worker.finish_request("api.index", 10)
+
+        def write():
+            for _ in range(200):
+                worker.write()
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        file_name = worker._file_name
+        while any(thread.is_alive() for thread in threads):
+            assert read_totals(file_name)["api.index"]["requests"] == 1
+        for thread in threads:
+            thread.join()
+        assert not caplog.records
+        worker.directory = None
+
+
+def test_metrics_endpoint():
+    headers = create_accounts(1, 1)
+    client = app.test_client()
+    assert client.get("/api/metrics").status_code == 401
+    for _ in range(3):
+        assert client.get("/api/accounts/", headers=headers).status_code == 200
+
+    r = client.get("/api/metrics", headers=headers)
+    assert r.status_code == 200
+    assert r.content_type.startswith("text/plain")
+    metrics_text = r.data.decode("utf-8")
+    assert get_sample(metrics_text, "doctrine_request_duration_seconds_count", "api.get_accounts_metadata") >= 3
+    assert get_sample(metrics_text, "doctrine_request_queries_total", "api.get_accounts_metadata") >= 3
+    assert get_sample(metrics_text, "doctrine_request_database_seconds_total", "api.get_accounts_metadata") > 0
+    assert get_sample(metrics_text, "doctrine_response_bytes_total", "api.get_accounts_metadata") > 0
+
+
+def test_failed_requests_recorded(monkeypatch):
+    """Test that requests that fail with an unhandled exception are still recorded,
+    even when the exception propagates out of the app without a response."""
+
+    def fail():
+        raise RuntimeError
+
+    monkeypatch.setitem(app.view_functions, "api.index", fail)
+    monkeypatch.setitem(app.config, "PROPAGATE_EXCEPTIONS", True)
+    requests_before = request_metrics.snapshot().get("api.index", {"requests": 0})["requests"]
+    with pytest.raises(RuntimeError):
+        app.test_client().get("/api/")
+    assert request_metrics.snapshot()["api.index"]["requests"] == requests_before + 1
@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+
+from app import app
+from app.routes.api import request_profiler
+from tests.test_queries import create_accounts
+
+
+def test_requested_profile():
+    headers = create_accounts(2, 1)
+    client = app.test_client()
+
+    r = client.get("/api/accounts/", headers={**headers, "X-Doctrine-Profile": "1"})
+    assert r.status_code == 200
+    report_id = r.headers["X-Doctrine-Profile-Report"]
+    r = client.get(f"/api/request_profiles/{report_id}", headers=headers)
+    assert r.status_code == 200
+    report = r.json
+    assert report["endpoint"] == "api.get_accounts_metadata"
+    assert not report["sampled"]
+    assert any(statement["statement"].startswith("SELECT") for statement in report["statements"])
+    assert report["database_seconds"] <= report["seconds"]
+    assert report["hotspots"]
+    r = client.get("/api/request_profiles/", headers=headers)
+    assert report_id in [summary["id"] for summary in r.json["reports"]]
+
+    # Streamed responses are profiled until they've been sent
+    r = client.get("/api/profiles/?stream=ndjson", headers={**headers, "X-Doctrine-Profile": "1"})
+    assert r.status_code == 200
+    assert r.data
+    report = request_profiler.get_report(r.headers["X-Doctrine-Profile-Report"])
+    assert report["streamed"]
+    assert any("FROM profile" in statement["statement"] for statement in report["statements"])
+
+    # Only developers can have requests profiled, or read reports, and anyone
+    # else asking for a profile is told why they didn't get one
+    r = client.get("/api/", headers={"X-Doctrine-Profile": "1"})
+    assert "X-Doctrine-Profile-Report" not in r.headers
+    assert r.headers["X-Doctrine-Profile-Error"]
+    r = client.get("/api/", headers={"X-Doctrine-Profile": "1", "Authorization": "Bearer expired"})
+    assert "X-Doctrine-Profile-Report" not in r.headers
+    assert r.headers["X-Doctrine-Profile-Error"]
+    assert client.get(f"/api/request_profiles/{report_id}").status_code == 401
+    r = client.get("/api/request_profiles/../config", headers=headers)
+    assert r.status_code == 404
+
+
+def test_sampled_profiles(monkeypatch, tmp_path):
+    monkeypatch.setattr(request_profiler, "directory", str(tmp_path))
+    monkeypatch.setattr(request_profiler, "max_reports", 3)
+    monkeypatch.setattr(request_profiler, "sample_rate", 1)
+    client = app.test_client()
+    for _ in range(5):
+        r = client.get("/api/")
+        assert "X-Doctrine-Profile-Report" not in r.headers
+
+    # Only the newest reports are kept
+    reports = request_profiler.list_reports()
+    assert len(reports) == 3
+    assert all(report["sampled"] and report["endpoint"] == "api.index" for report in reports)
+    assert len(os.listdir(tmp_path)) == 3
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from decimal import Decimal
+import pytest
+
+sys.path.append(os.getcwd())
+
+
+from app import app
+from app.modules import resource_catalogue
+from app.modules.change_marker import ChangeMarker
+from app.modules.resource_catalogue import ResourceCatalogue
+from tests.test_queries import create_accounts
+
+rows = [(3, "iron ore", Decimal("2.5"), Decimal("1.000")), (1, "light tyre", Decimal("12.125"), Decimal("40"))]
+
+
+def test_lookups():
+    catalogue = ResourceCatalogue(rows)
+    assert len(catalogue) == 2
+    assert 3 in catalogue and 1 in catalogue
+    assert 2 not in catalogue and 4 not in catalogue and -1 not in catalogue
+    assert catalogue.name(3) == "iron ore"
+    assert catalogue.mass(3) == Decimal("2.5")
+    assert catalogue.mass(1) == Decimal("12.125")
+    assert catalogue.volume(1) == Decimal("40")
+    assert catalogue.ids["light tyre"] == 1
+    with pytest.raises(KeyError):
+        catalogue.mass(2)
+
+
+def test_versions():
+    # The version depends only on the contents of the catalogue
+    assert ResourceCatalogue(rows).version == ResourceCatalogue(reversed(rows)).version
+    assert ResourceCatalogue(rows).version != ResourceCatalogue(rows[:1]).version
+    assert ResourceCatalogue([]).version != ResourceCatalogue(rows).version
+
+
+def test_reloads_shared_between_workers(monkeypatch):
+    """Test that asking another worker to reload makes this worker reload too."""
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        file_name = os.path.join(directory, "resource-catalogue")
+        monkeypatch.setattr(resource_catalogue.catalogue_reloads, "file_name", file_name)
+        monkeypatch.setattr(resource_catalogue, "reload_check_interval", 0)
+        catalogue = resource_catalogue.reload_resource_catalogue()
+        assert resource_catalogue.get_resource_catalogue() is catalogue
+        ChangeMarker(file_name).mark()
+        assert resource_catalogue.get_resource_catalogue() is not catalogue
+
+
+def test_catalogue_info():
+    headers = create_accounts(0, 0)
+    r = app.test_client().get("/api/resource_types/catalogue", headers=headers)
+    assert r.status_code == 200
+    assert r.json["is_stale"] is False
+    # Timestamps are UTC ISO 8601 strings, like everywhere else in the API
+    assert datetime.fromisoformat(r.json["loaded_at"]).tzinfo == timezone.utc
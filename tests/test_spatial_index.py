@@ -0,0 +1,117 @@
+import os
+import sys
+import uuid
+
+sys.path.append(os.getcwd())
+
+
+from app import app, db
+from app.models import Dome, WorldEntity
+from app.modules import dome_graph as dome_graph_module
+from app.modules import spatial_index as spatial_index_module
+from app.modules.spatial_index import SpatialIndex, get_spatial_index
+
+
+def create_spatial_index():
+    spatial_index = SpatialIndex(cell_size=10)
+    spatial_index.move(1, 1, 0, 0)
+    spatial_index.move(2, 1, 3, 4)
+    spatial_index.move(3, 1, 25, -5)
+    spatial_index.move(4, 1, -10, -10)
+    spatial_index.move(5, 2, 0, 0)
+    return spatial_index
+
+
+def test_radius_and_box_queries():
+    spatial_index = create_spatial_index()
+    assert sorted(spatial_index.within_radius(1, 0, 0, 5)) == [(1, 0, 0), (2, 3, 4)]
+    assert sorted(spatial_index.within_radius(1, 0, 0, 4.9)) == [(1, 0, 0)]
+    assert [e[0] for e in sorted(spatial_index.within_radius(1, 0, 0, 1000))] == [1, 2, 3, 4]
+    assert sorted(spatial_index.within_box(1, -10, -10, 3, 4)) == [(1, 0, 0), (2, 3, 4), (4, -10, -10)]
+    assert spatial_index.within_box(1, 26, -5, 30, 0) == []
+    assert spatial_index.within_radius(3, 0, 0, 1000) == []
+
+
+def test_moving_entities():
+    spatial_index = create_spatial_index()
+    # Within the same cell, into another cell, and into another dome
+    spatial_index.move(1, 1, 1, 1)
+    spatial_index.move(2, 1, 40, 40)
+    spatial_index.move(3, 2, 1, 0)
+    assert sorted(spatial_index.within_radius(1, 0, 0, 20)) == [(1, 1, 1), (4, -10, -10)]
+    assert sorted(spatial_index.within_radius(2, 0, 0, 20)) == [(3, 1, 0), (5, 0, 0)]
+    spatial_index.remove(4)
+    spatial_index.remove(4)
+    assert 4 not in spatial_index
+    assert len(spatial_index) == 4
+    assert spatial_index.within_box(1, -20, -20, 0, 0) == []
+
+
+def test_dome_entities_endpoint(monkeypatch):
+    """Test that out of date indexes keep being served while they're rebuilt, and
+    that points and radii that aren't finite are rejected."""
+    with app.app_context():
+        dome = Dome(name=uuid.uuid4().hex[:32], diameter=100, world_location_x=0, world_location_y=0)
+        db.session.add(dome)
+        db.session.flush()
+        old_index = get_spatial_index()
+        world_entity = WorldEntity(location_dome_id=dome.id, location_x=3, location_y=4)
+        db.session.add(world_entity)
+        db.session.commit()
+        dome_id, entity_id = dome.id, world_entity.id
+
+    monkeypatch.setattr(spatial_index_module, "spatial_index_ttl", 0)
+    assert get_spatial_index() is old_index
+    spatial_index_module._rebuild_thread.join()
+    monkeypatch.setattr(spatial_index_module, "spatial_index_ttl", 60)
+    assert get_spatial_index() is not old_index
+    assert entity_id in get_spatial_index()
+
+    # The dome graph is reloaded in the background once the new dome has been committed
+    with app.app_context():
+        dome_graph_module.get_dome_graph()
+    if dome_graph_module._reload_thread is not None:
+        dome_graph_module._reload_thread.join()
+
+    client = app.test_client()
+    r = client.get(f"/api/domes/{dome_id}/entities?x=0&y=0&radius=5")
+    assert r.status_code == 200
+    assert r.json["world_entities"] == [{"id": entity_id, "location_x": 3, "location_y": 4}]
+    for query in ["x=inf&y=0&radius=5", "x=0&y=nan&radius=5", "x=0&y=0&radius=inf", "x=0&y=0&radius=-1"]:
+        r = client.get(f"/api/domes/{dome_id}/entities?{query}")
+        assert r.status_code == 400
+        assert r.json["error"]["type"] == "MalformedParameterError"
+
+
+def test_only_committed_changes_are_indexed():
+    """Test that changes are only made to the index once they're committed, and
+    never if they're rolled back, including to a savepoint."""
+    with app.app_context():
+        dome = Dome(name=uuid.uuid4().hex[:32], diameter=100, world_location_x=0, world_location_y=0)
+        db.session.add(dome)
+        db.session.commit()
+        spatial_index = get_spatial_index()
+
+        world_entity = WorldEntity(location_dome_id=dome.id, location_x=1, location_y=1)
+        db.session.add(world_entity)
+        db.session.flush()
+        entity_id = world_entity.id
+        assert entity_id not in spatial_index
+        db.session.rollback()
+        db.session.commit()
+        assert entity_id not in spatial_index
+
+        moved_entity = WorldEntity(location_dome_id=dome.id, location_x=2, location_y=2)
+        db.session.add(moved_entity)
+        db.session.begin_nested()
+        moved_entity.location_x = 50
+        db.session.flush()
+        db.session.rollback()
+        db.session.begin_nested()
+        kept_entity = WorldEntity(location_dome_id=dome.id, location_x=3, location_y=3)
+        db.session.add(kept_entity)
+        db.session.commit()
+        assert kept_entity.id not in spatial_index
+        db.session.commit()
+        expected_entities = [(moved_entity.id, 2, 2), (kept_entity.id, 3, 3)]
+        assert sorted(spatial_index.within_radius(dome.id, 0, 0, 10)) == expected_entities
@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.getcwd())
+
+
+from app import app, db
+from app.models import AccessToken, Account
+from app.modules import access_tokens
+from app.modules.change_marker import ChangeLog
+from app.modules.token_sweeper import TokenSweeper
+from app.routes import api
+from app.routes.api import create_access_token
+from tests.test_queries import create_accounts
+
+
+# These tests create accounts, so they run after test_api.py, which expects the
+# accounts it creates to be the first in the database.
+
+
+def test_token_formats():
+    plain_tokens = {access_tokens.generate_token() for _ in range(100)}
+    assert len(plain_tokens) == 100
+    assert all(len(token) == 64 for token in plain_tokens)
+
+    key = b"test key"
+    token = access_tokens.generate_token(key)
+    assert len(token) == 64
+    assert access_tokens.has_valid_signature(token, key)
+    assert not access_tokens.has_valid_signature(token, b"other key")
+    assert not access_tokens.has_valid_signature(token[:-1] + ("A" if token[-1] != "A" else "B"), key)
+    assert not access_tokens.has_valid_signature(next(iter(plain_tokens)), key)
+    assert not access_tokens.has_valid_signature("short", key)
+    assert not access_tokens.has_valid_signature("\u00e9" * 64, key)
+
+
+def test_token_collision_retry(monkeypatch):
+    """Test that a new token is generated if it collides with an existing one."""
+    create_accounts(1, 0)
+    with app.app_context():
+        existing_token = AccessToken.query.first()
+        account = Account.query.get(existing_token.account_id)
+        new_tokens = iter([existing_token.token, "a" * 64])
+        monkeypatch.setattr(access_tokens, "generate_token", lambda signing_key: next(new_tokens))
+        token = create_access_token(account, timedelta(hours=1))
+        db.session.commit()
+        assert token.token == "a" * 64
+        db.session.delete(token)
+        db.session.commit()
+
+
+def test_signed_tokens(monkeypatch):
+    """Test that only signed tokens are accepted once tokens are signed."""
+    unsigned_headers = create_accounts(0, 0)
+    monkeypatch.setitem(app.config, "ACCESS_TOKEN_SIGNING_KEY", "test key")
+    signed_headers = create_accounts(0, 0)
+    client = app.test_client()
+    assert client.get("/api/caches", headers=signed_headers).status_code == 200
+    r = client.get("/api/caches", headers=unsigned_headers)
+    assert r.status_code == 403
+    assert r.json["error"]["type"] == "UnauthorizedAccessError"
+
+    # Tokens with characters that are never in a token are turned away, rather than causing an error
+    r = client.get("/api/caches", headers={"Authorization": "Bearer " + "\u00e9" * 64})
+    assert r.status_code == 403
+    assert r.json["error"]["type"] == "UnauthorizedAccessError"
+
+
+def test_logout_revokes_cached_token():
+    """Test that a token can't be used once it's revoked, even if it was cached."""
+    headers = create_accounts(0, 0)
+    client = app.test_client()
+    assert client.get("/api/caches", headers=headers).status_code == 200
+    assert client.post("/api/logout", headers=headers).status_code == 204
+    r = client.get("/api/caches", headers=headers)
+    assert r.status_code == 403
+    assert r.json["error"]["type"] == "UnauthorizedAccessError"
+    assert client.post("/api/logout", headers=headers).status_code == 403
+
+
+def test_revocations_shared_between_workers(monkeypatch):
+    """Test that a token revoked by another worker isn't accepted from this worker's
+    cache, and that other cached tokens still are."""
+    headers = create_accounts(0, 0)
+    other_headers = create_accounts(0, 0)
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "token-revocations")
+        monkeypatch.setattr(api.token_revocations, "file_name", file_name)
+        assert client.get("/api/caches", headers=headers).status_code == 200
+        assert client.get("/api/caches", headers=other_headers).status_code == 200
+        # Revoke the token as another worker would, without touching this worker's cache
+        token_string = headers["Authorization"][len("Bearer ") :]
+        with app.app_context():
+            AccessToken.query.filter_by(token=token_string).delete()
+            db.session.commit()
+        ChangeLog(file_name).append([api.get_token_key(token_string)])
+        r = client.get("/api/caches", headers=headers)
+        assert r.status_code == 403
+        assert r.json["error"]["type"] == "UnauthorizedAccessError"
+        # The other token is still served from the cache
+        misses = api.token_cache.misses
+        assert client.get("/api/caches", headers=other_headers).status_code == 200
+        assert api.token_cache.misses == misses
+
+        # A lookup made before the revocation was committed can't cache the token again
+        api.cache_access_token(token_string, 1, True, datetime.utcnow() + timedelta(hours=1))
+        assert api.get_token_key(token_string) not in api.token_cache
+
+
+def test_sweep_expired_tokens():
+    headers = create_accounts(0, 0)
+    with app.app_context():
+        account = Account.query.order_by(Account.id.desc()).first()
+        db.session.add_all([AccessToken(account=account, duration=timedelta(hours=-1)) for _ in range(5)])
+        db.session.commit()
+        sweeper = TokenSweeper(batch_size=2, batch_pause=0)
+        assert sweeper.sweep() >= 5
+        assert AccessToken.query.filter(AccessToken.expires_at < datetime.utcnow()).count() == 0
+        assert sweeper.sweep() == 0
+        assert sweeper.stats()["sweeps"] == 2
+    # Tokens that haven't expired are left alone
+    assert app.test_client().get("/api/caches", headers=headers).status_code == 200
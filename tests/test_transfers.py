@@ -0,0 +1,71 @@
+import os
+import sys
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+sys.path.append(os.getcwd())
+
+
+from app import app, db
+from app.models import Account, AccessToken, EmailAddress, Entity, FinancialTransaction, Wallet
+
+app.config["PASSWORD_HASHING_WORK_FACTOR"] = 4
+
+
+def create_wallets(wallet_count):
+    """Create wallets holding 100 each, and return their IDs along with an
+    authorization header for a developer account."""
+    with app.app_context():
+        entities = [Entity() for _ in range(wallet_count)]
+        db.session.add_all(entities)
+        email_address = EmailAddress(f"transfer-test-{uuid.uuid4().hex[:8]}@mail.com")
+        developer = Account(email_address=email_address, password="test")
+        developer.is_developer = True
+        token = AccessToken(account=developer, duration=timedelta(hours=1))
+        db.session.add(token)
+        db.session.commit()
+        return [entity.wallet_id for entity in entities], {"Authorization": f"Bearer {token.token}"}
+
+
+def get_wallet_values(wallet_ids):
+    with app.app_context():
+        return [Wallet.query.get(wallet_id).value for wallet_id in wallet_ids]
+
+
+def test_batch_transfers():
+    (a, b, c), headers = create_wallets(3)
+    client = app.test_client()
+
+    # Money received earlier in a batch can be passed on later in the same batch
+    transfers = [
+        {"sending_wallet_id": a, "receiving_wallet_id": b, "value": 60},
+        {"sending_wallet_id": b, "receiving_wallet_id": c, "value": "150.50"},
+        {"sending_wallet_id": c, "receiving_wallet_id": a, "value": 0.5},
+    ]
+    r = client.post("/api/transactions/batch", json={"transfers": transfers}, headers=headers)
+    assert r.status_code == 201
+    assert get_wallet_values([a, b, c]) == [Decimal("40.50"), Decimal("9.50"), Decimal("250.00")]
+    assert r.json["transaction_event"]["transaction_time"].endswith("+00:00")
+    with app.app_context():
+        transaction_event_id = r.json["transaction_event"]["id"]
+        assert FinancialTransaction.query.filter_by(transaction_event_id=transaction_event_id).count() == 3
+
+    # A batch that would overdraw a wallet makes none of its transfers
+    transfers = [
+        {"sending_wallet_id": c, "receiving_wallet_id": a, "value": 10},
+        {"sending_wallet_id": b, "receiving_wallet_id": a, "value": 10},
+    ]
+    r = client.post("/api/transactions/batch", json={"transfers": transfers}, headers=headers)
+    assert r.status_code == 409
+    assert r.json["error"]["type"] == "InsufficientFundsError"
+    assert get_wallet_values([a, b, c]) == [Decimal("40.50"), Decimal("9.50"), Decimal("250.00")]
+
+    # Malformed values and missing wallets are rejected
+    for value in (0, -1, "1.001", "many", True):
+        transfers = [{"sending_wallet_id": a, "receiving_wallet_id": b, "value": value}]
+        r = client.post("/api/transactions/batch", json={"transfers": transfers}, headers=headers)
+        assert r.json["error"]["type"] == "MalformedFieldError"
+    transfers = [{"sending_wallet_id": a, "receiving_wallet_id": 2 ** 31, "value": 1}]
+    r = client.post("/api/transactions/batch", json={"transfers": transfers}, headers=headers)
+    assert r.status_code == 404